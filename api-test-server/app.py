@@ -2,8 +2,11 @@
 
 from __future__ import annotations
 
+import json
+from datetime import datetime
+from itertools import count
 from time import time
-from typing import Any
+from typing import Any, Callable, Dict, List, Tuple
 
 from flask import Flask, jsonify, request
 from flask_cors import CORS
@@ -11,6 +14,24 @@ from flask_cors import CORS
 app = Flask(__name__)
 CORS(app)
 
+# overridden by the simulation runner to share its fake clock
+now: Callable[[], float] = time
+
+# teams the token user is a leader of
+leader_teams: List[str] = []
+
+# (time, method, path, form) of every request
+calls: List[Tuple[float, str, str, Dict[str, str]]] = []
+
+arenas: Dict[str, Dict[str, str]] = {}
+created_at: Dict[str, float] = {}
+arena_ids = count(1)
+
+
+@app.before_request
+def record_call() -> None:
+    calls.append((now(), request.method, request.path, request.form.to_dict()))
+
 
 @app.route("/api/token/test", methods=["POST"])
 def token_test() -> Any:
@@ -19,8 +40,8 @@ def token_test() -> Any:
         {
             token: {
                 "userId": "benwerner",
-                "expires": int(time() * 1000) + 60 * 60 * 1000,
-                "scopes": "tournament:write",
+                "expires": int(now() * 1000) + 60 * 60 * 1000,
+                "scopes": "tournament:write,team:lead",
             }
         }
     )
@@ -28,15 +49,92 @@ def token_test() -> Any:
 
 @app.route("/api/team/of/<user>")
 def teams(user: str) -> Any:
-    return jsonify([])
+    return jsonify([{"id": team, "leaders": [{"id": user}]} for team in leader_teams])
 
 
 @app.route("/api/team/<team>/arena")
 def existing_arenas(team: str) -> Any:
-    return ""
+    lines: List[str] = []
+    for id, arena in arenas.items():
+        if team not in (
+            arena.get("conditions.teamMember.teamId"),
+            arena.get("teamBattleByTeam"),
+        ):
+            continue
+        startsAt = int(arena["startDate"])
+        lines.append(
+            json.dumps(
+                {
+                    "id": id,
+                    "fullName": arena["name"] + " Arena",
+                    "system": "arena",
+                    "startsAt": startsAt,
+                    "secondsToStart": max(0, int(startsAt / 1000 - now())),
+                    "clock": {
+                        "limit": int(float(arena["clockTime"]) * 60),
+                        "increment": int(arena["clockIncrement"]),
+                    },
+                    "minutes": int(arena["minutes"]),
+                    "variant": {"key": arena["variant"], "name": arena["variant"]},
+                    "nbPlayers": 0,
+                }
+            )
+        )
+    return "\n".join(lines), 200, {"Content-Type": "application/x-ndjson"}
 
 
 @app.route("/api/tournament", methods=["POST"])
 def create_arena() -> Any:
-    print(request.form)
-    return jsonify({"id": "abc"})
+    id = f"arena{next(arena_ids):06}"
+    arenas[id] = request.form.to_dict()
+    created_at[id] = now()
+    return jsonify({"id": id, "fullName": arenas[id]["name"] + " Arena"})
+
+
+@app.route("/api/tournament/<id>")
+def get_arena(id: str) -> Any:
+    arena = arenas.get(id)
+    if arena is None:
+        return "", 404
+    extra = {"description": arena["description"]} if "description" in arena else {}
+    return jsonify(
+        {
+            **extra,
+            "id": id,
+            "fullName": arena["name"] + " Arena",
+            "startsAt": datetime.utcfromtimestamp(
+                int(arena["startDate"]) // 1000
+            ).isoformat()
+            + "Z",
+            "clock": {
+                "limit": int(float(arena["clockTime"]) * 60),
+                "increment": int(arena["clockIncrement"]),
+            },
+            "minutes": int(arena["minutes"]),
+            "variant": arena["variant"],
+        }
+    )
+
+
+@app.route("/api/tournament/<id>", methods=["POST"])
+def update_arena(id: str) -> Any:
+    if id not in arenas:
+        return "", 404
+    arenas[id].update(request.form.to_dict())
+    return jsonify({"id": id})
+
+
+@app.route("/api/tournament/<id>/terminate", methods=["POST"])
+def terminate_arena(id: str) -> Any:
+    arenas.pop(id, None)
+    return jsonify({"ok": True})
+
+
+@app.route("/api/tournament/team-battle/<id>", methods=["POST"])
+def team_battle(id: str) -> Any:
+    return jsonify({"id": id})
+
+
+@app.route("/team/<team>/pm-all", methods=["POST"])
+def team_pm(team: str) -> Any:
+    return jsonify({"ok": True})
@@ -1,18 +1,21 @@
 from __future__ import annotations
 
 import calendar
+import json
 import re
 from dataclasses import dataclass
 from datetime import datetime
-from time import time
-from typing import List, Optional, Tuple, cast
-
-import dateutil.parser
-import requests
+from time import perf_counter
+from typing import TYPE_CHECKING, Any, Dict, Iterator, List, Optional, Tuple, cast
 
+import clock
+import metrics
 from db import Schedule
 from model import ArenaEdit, MsgToSend
 
+if TYPE_CHECKING:
+    import requests
+
 HOST = "https://lichess.org"  # overridden from config in app.py
 ARENA_URL = "/tournament/{}"
 ENDPOINT_TEAMS = "/api/team/of/{}"
@@ -27,6 +30,22 @@ ENDPOINT_TEAM_PM = "/team/{}/pm-all"
 BOOL = ["false", "true"]
 
 
+def _request(
+    method: str, endpoint: str, *args: str, **kwargs: Any
+) -> requests.Response:
+    # imported on first use, it is slow to import
+    import requests
+
+    start = perf_counter()
+    status = "error"
+    try:
+        resp = requests.request(method, HOST + endpoint.format(*args), **kwargs)
+        status = str(resp.status_code)
+        return resp
+    finally:
+        metrics.API_LATENCY.observe(perf_counter() - start, method, endpoint, status)
+
+
 @dataclass
 class Token:
     token: str
@@ -44,7 +63,7 @@ class Token:
 
     @property
     def expired(self) -> bool:
-        return self.expires is not None and self.expires < time() - 24 * 60 * 60
+        return self.expires is not None and self.expires < clock.time() - 24 * 60 * 60
 
     def is_valid_msg_token_for_team(self, team: str) -> bool:
         return (
@@ -55,7 +74,7 @@ class Token:
 
 
 def verify_token(t: str) -> Optional[Token]:
-    res = requests.post(HOST + ENDPOINT_TOKEN_TEST, data=t)
+    res = _request("POST", ENDPOINT_TOKEN_TEST, data=t)
     res.raise_for_status()
     tt = res.json()[t]
     if not tt:
@@ -67,8 +86,10 @@ def verify_token(t: str) -> Optional[Token]:
 
 
 def leader_teams(userId: str, token: str) -> List[str]:
-    res = requests.get(
-        HOST + ENDPOINT_TEAMS.format(userId),
+    res = _request(
+        "GET",
+        ENDPOINT_TEAMS,
+        userId,
         headers={"Authorization": f"Bearer {token}"},
     )
     res.raise_for_status()
@@ -80,6 +101,20 @@ def leader_teams(userId: str, token: str) -> List[str]:
     ]
 
 
+def team_arenas(team: str) -> Iterator[Dict[str, Any]]:
+    resp = _request(
+        "GET",
+        ENDPOINT_TEAM_ARENAS,
+        team,
+        headers={"Accept": "application/x-ndjson"},
+        stream=True,
+    )
+    resp.raise_for_status()
+    for line in resp.iter_lines():
+        if line:
+            yield json.loads(line)
+
+
 def schedule_arena(
     s: Schedule, at: int, api_key: str, nth: int, prev: Optional[str]
 ) -> Tuple[str, Optional[str]]:
@@ -115,22 +150,25 @@ def schedule_arena(
     if s.minAccountAgeInDays:
         data["conditions.accountAge"] = s.minAccountAgeInDays
 
-    resp = requests.post(
-        HOST + ENDPOINT_CREATE_ARENA,
+    resp = _request(
+        "POST",
+        ENDPOINT_CREATE_ARENA,
         headers={"Authorization": f"Bearer {api_key}", "Accept": "application/json"},
         data=data,
     )
     resp.raise_for_status()
-    json = resp.json()
-    id = json.get("id")
+    arena = resp.json()
+    id = arena.get("id")
     if not isinstance(id, str):
         raise Exception(f"Created arena has invalid id: {id}")
 
     if s.is_team_battle:
         teams = s.team_battle_teams(at)
         leaders = s.teamBattleLeaders or 5
-        resp = requests.post(
-            HOST + ENDPOINT_TEAM_BATTLE.format(id),
+        resp = _request(
+            "POST",
+            ENDPOINT_TEAM_BATTLE,
+            id,
             headers={
                 "Authorization": f"Bearer {api_key}",
                 "Accept": "application/json",
@@ -139,14 +177,16 @@ def schedule_arena(
         )
         resp.raise_for_status()
 
-    return id, json.get("fullName")
+    return id, arena.get("fullName")
 
 
 def update_team_battle(
     arena_id: str, teams: List[str], nbLeaders: Optional[int], api_key: str
 ) -> None:
-    resp = requests.post(
-        HOST + ENDPOINT_TEAM_BATTLE.format(arena_id),
+    resp = _request(
+        "POST",
+        ENDPOINT_TEAM_BATTLE,
+        arena_id,
         headers={"Authorization": f"Bearer {api_key}", "Accept": "application/json"},
         data={"teams": ",".join(teams), "nbLeaders": nbLeaders or 5},
     )
@@ -154,8 +194,10 @@ def update_team_battle(
 
 
 def terminate_arena(id: str, api_key: str) -> None:
-    requests.post(
-        HOST + ENDPOINT_TERMINATE_ARENA.format(id),
+    _request(
+        "POST",
+        ENDPOINT_TERMINATE_ARENA,
+        id,
         headers={"Authorization": f"Bearer {api_key}", "Accept": "application/json"},
     ).raise_for_status()
 
@@ -193,8 +235,10 @@ def update_arena(
     if arena.minAccountAgeInDays:
         data["conditions.accountAge"] = arena.minAccountAgeInDays
 
-    resp = requests.post(
-        HOST + ENDPOINT_UPDATE_ARENA.format(arena.id),
+    resp = _request(
+        "POST",
+        ENDPOINT_UPDATE_ARENA,
+        arena.id,
         headers={"Authorization": f"Bearer {api_key}", "Accept": "application/json"},
         data=data,
     )
@@ -205,26 +249,19 @@ def update_arena(
     return None
 
 
-def update_link_to_next_arena(
-    id: str, prev: Optional[str], nxt: str, desc: str, nth: int, api_key: str
-) -> None:
-    resp = requests.get(HOST + ENDPOINT_GET_ARENA.format(id))
+def get_arena(id: str) -> Dict[str, Any]:
+    resp = _request("GET", ENDPOINT_GET_ARENA, id)
     resp.raise_for_status()
-    arena = resp.json()
+    return resp.json()
 
-    name = arena["fullName"]
-    if name.endswith(" Arena"):
-        name = name[: -len(" Arena")]
-    elif name.endswith(" Team Battle"):
-        name = name[: -len(" Team Battle")]
-    at = int(dateutil.parser.isoparse(arena["startsAt"]).timestamp())
 
+def arena_form(arena: Dict[str, Any]) -> Dict[str, Any]:
+    """Update form fields that keep the settings of `arena` as returned by get_arena."""
     data = {
         "clockTime": arena["clock"]["limit"] / 60,
         "clockIncrement": arena["clock"]["increment"],
         "minutes": arena["minutes"],
         "variant": arena["variant"],
-        "description": format_description(desc, prev, nxt, name, at, nth),
     }
     if "minGames" in arena:
         data["conditions.nbRatedGame.nb"] = arena["minRatedGames"]["nb"]
@@ -236,19 +273,57 @@ def update_link_to_next_arena(
         data["conditions.bots"] = arena["botsAllowed"]
     if "minAccountAgeInDays" in arena:
         data["conditions.accountAge"] = arena["minAccountAgeInDays"]
+    return data
+
+
+def update_link_to_next_arena(
+    id: str, prev: Optional[str], nxt: str, desc: str, nth: int, api_key: str
+) -> None:
+    import dateutil.parser
+
+    arena = get_arena(id)
+    name = arena["fullName"]
+    if name.endswith(" Arena"):
+        name = name[: -len(" Arena")]
+    elif name.endswith(" Team Battle"):
+        name = name[: -len(" Team Battle")]
+    at = int(dateutil.parser.isoparse(arena["startsAt"]).timestamp())
+
+    data = arena_form(arena)
+    data["description"] = format_description(desc, prev, nxt, name, at, nth)
+    _request(
+        "POST",
+        ENDPOINT_UPDATE_ARENA,
+        id,
+        headers={"Authorization": f"Bearer {api_key}", "Accept": "application/json"},
+        data=data,
+    ).raise_for_status()
+
 
-    requests.post(
-        HOST + ENDPOINT_UPDATE_ARENA.format(id),
+def move_arena(id: str, at: int, api_key: str) -> None:
+    """Changes only the start of an arena, re-sending its own settings."""
+    arena = get_arena(id)
+    data = arena_form(arena)
+    data["startDate"] = at * 1000
+    if arena.get("description"):
+        data["description"] = arena["description"]
+    _request(
+        "POST",
+        ENDPOINT_UPDATE_ARENA,
+        id,
         headers={"Authorization": f"Bearer {api_key}", "Accept": "application/json"},
         data=data,
     ).raise_for_status()
 
 
-def send_team_msg(msg: MsgToSend, token: str) -> None:
-    requests.post(
-        HOST + ENDPOINT_TEAM_PM.format(msg.team),
+def send_team_msgs(msgs: List[MsgToSend], token: str) -> None:
+    """Sends the messages of one team as a single message."""
+    _request(
+        "POST",
+        ENDPOINT_TEAM_PM,
+        msgs[0].team,
         headers={"Authorization": f"Bearer {token}", "Accept": "application/json"},
-        data={"message": msg.text()},
+        data={"message": "\n\n".join(msg.text() for msg in msgs)},
     ).raise_for_status()
 
 
@@ -5,55 +5,179 @@ from __future__ import annotations
 import json
 import logging
 from collections import defaultdict
+from dataclasses import dataclass, field
+from threading import Lock
 from time import time
-from typing import Any, DefaultDict, Dict, List, cast
-
-from flask import Flask, abort, jsonify, request
+from typing import (
+    Any,
+    DefaultDict,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    Set,
+    TypeVar,
+    cast,
+)
+
+from flask import (
+    Blueprint,
+    Flask,
+    Response,
+    abort,
+    current_app,
+    g,
+    jsonify,
+    request,
+    stream_with_context,
+)
+from flask.config import Config
 from flask.logging import default_handler  # pyright: ignore
 from flask_cors import CORS
 from werkzeug.exceptions import HTTPException
 
 import api
+import arenas
+import backup
+import bulk
+import capacity
+import db as db_module
+import ical
+import metrics
+import overlaps
+import planner
+import profiling
+import responses
+import scheduler as scheduler_module
 from auth import Auth
 from db import Db
-from model import ArenaEdit, ParseError, Schedule, ScheduleWithId, get_or_raise
-from scheduler import SchedulerThread, SchedulerWatchdog
+from model import (
+    EVENT_KINDS,
+    SCHEDULE_JSON_FIELDS,
+    ArenaEdit,
+    BulkArenaOp,
+    ParseError,
+    Schedule,
+    ScheduleWithId,
+    get_or_raise,
+)
+from scheduler import SchedulerLease, SchedulerThread, ShardLease
 
 OK_RESPONSE = '{"ok":true}'
-API_VERSION = "7"
+API_VERSION = "9"
+SCHEDULES_PAGE_SIZE = 500
+SCHEDULES_MAX_PAGE_SIZE = 2000
 
 root = logging.getLogger()
 root.addHandler(default_handler)  # pyright: ignore
 
-app = Flask(__name__)
-app.config.from_pyfile("config.py")
-app.logger.setLevel(logging.INFO)
+bp = Blueprint("app", __name__)
 
-LICHESS_API_KEY = cast(str, app.config["LICHESS_API_KEY"])
-TEAMS_WHITELIST = cast(List[str], app.config["TEAMS_WHITELIST"])
-ADMINS = cast(List[str], app.config["ADMINS"])
+T = TypeVar("T")
 
-try:
-    CORS(app)
-    api.HOST = app.config["HOST"]
 
-    # don't leak db into global scope
-    def create_tables() -> None:
-        with Db() as db:
-            db.create_tables(app)
+@dataclass(slots=True)
+class Settings:
+    """Settings of the app, read from config.py by create_app."""
+
+    lichess_api_key: str = ""
+    teams_whitelist: List[str] = field(default_factory=list[str])
+    admins: List[str] = field(default_factory=list[str])
+    metrics_token: str = ""
+    start_scheduler: bool = True
+    scheduler_sharding: bool = False
+    msg_collate_secs: int = scheduler_module.MSG_COLLATE_SECS
+
+    @staticmethod
+    def from_config(config: Config) -> Settings:
+        return Settings(
+            cast(str, config["LICHESS_API_KEY"]),
+            cast(List[str], config["TEAMS_WHITELIST"]),
+            cast(List[str], config["ADMINS"]),
+            setting(config, "METRICS_TOKEN", ""),
+            setting(config, "START_SCHEDULER", True),
+            setting(config, "SCHEDULER_SHARDING", False),
+            setting(config, "MSG_COLLATE_SECS", scheduler_module.MSG_COLLATE_SECS),
+        )
+
+
+def setting(config: Config, key: str, default: T) -> T:
+    return cast(T, config[key]) if key in config else default
+
+
+settings = Settings()
+auth = Auth([], [])
 
-    create_tables()
+# started by create_app or explicitly with start_background()
+lease: Optional[SchedulerLease] = None
+scheduler: Optional[SchedulerThread] = None
+scheduler_lock = Lock()
 
-    auth = Auth(ADMINS, TEAMS_WHITELIST)
-    SchedulerThread(LICHESS_API_KEY).start()
-    SchedulerWatchdog().start()
 
-except Exception as e:
-    app.logger.error(f"Exception during startup: {e}")
-    raise e
+def create_app(config_file: str = "config.py", start: bool = True) -> Flask:
+    """
+    With `start`, also starts the scheduler threads unless START_SCHEDULER is
+    off. Forking servers that preload the app pass False and call
+    start_background() in each worker instead, see gunicorn.conf.py.
+    """
+    global settings, auth
 
+    app = Flask(__name__)
+    app.config.from_pyfile(config_file)
+    app.logger.setLevel(logging.INFO)
+    settings = Settings.from_config(app.config)
 
-@app.errorhandler(HTTPException)
+    try:
+        CORS(app, expose_headers=["X-Next-Cursor"])
+        api.HOST = cast(str, app.config["HOST"])
+        db_module.DATABASE = setting(app.config, "DATABASE", db_module.DATABASE)
+
+        with Db() as d:
+            d.create_tables()
+
+        auth = Auth(settings.admins, settings.teams_whitelist)
+        planner.BUDGET_CAPACITY = setting(
+            app.config, "BUDGET_CAPACITY", planner.BUDGET_CAPACITY
+        )
+        planner.BUDGET_PER_HOUR = setting(
+            app.config, "BUDGET_PER_HOUR", planner.BUDGET_PER_HOUR
+        )
+        backup.BACKUP_DIR = setting(app.config, "BACKUP_DIR", backup.BACKUP_DIR)
+        backup.BACKUP_INTERVAL_SECS = setting(
+            app.config, "BACKUP_INTERVAL_SECS", backup.BACKUP_INTERVAL_SECS
+        )
+        backup.BACKUP_KEEP = setting(app.config, "BACKUP_KEEP", backup.BACKUP_KEEP)
+        backup.BACKUP_INTEGRITY_CHECK = setting(
+            app.config, "BACKUP_INTEGRITY_CHECK", backup.BACKUP_INTEGRITY_CHECK
+        )
+    except Exception as e:
+        app.logger.error(f"Exception during startup: {e}")
+        raise e
+
+    app.register_blueprint(bp)
+    if start and settings.start_scheduler:
+        start_background()
+    return app
+
+
+def start_background() -> SchedulerThread:
+    """Starts the scheduler, lease and backup threads of this process once."""
+    global lease, scheduler
+
+    with scheduler_lock:
+        if scheduler is None:
+            lease = ShardLease() if settings.scheduler_sharding else SchedulerLease()
+            scheduler = SchedulerThread(
+                settings.lichess_api_key, lease, settings.msg_collate_secs
+            )
+            scheduler.start()
+            lease.start()
+            if backup.BACKUP_DIR:
+                backup.BackupThread(lease).start()
+        return scheduler
+
+
+@bp.app_errorhandler(HTTPException)
 def error_bad_request(e: Any) -> Any:
     response = e.get_response()
     response.data = json.dumps(
@@ -66,23 +190,241 @@ def error_bad_request(e: Any) -> Any:
     return response
 
 
-@app.route("/version")
+@bp.before_app_request
+def start_request_profile() -> None:
+    if request.endpoint != "app.profile":
+        g.profile = profiling.profiler.begin("requests")
+
+
+@bp.teardown_app_request
+def end_request_profile(_: Optional[BaseException]) -> None:
+    profiling.profiler.end(g.pop("profile", None))
+
+
+@bp.after_app_request
+def compress_response(response: Response) -> Response:
+    return responses.compress(request, response)
+
+
+@bp.route("/version")
 def version() -> str:
     return API_VERSION
 
 
-@app.route("/schedules")
+@bp.route("/metrics")
+def metrics_endpoint() -> Any:
+    if (
+        settings.metrics_token
+        and request.headers.get("Authorization") != f"Bearer {settings.metrics_token}"
+    ):
+        abort(401)
+    return Response(metrics.expose(), mimetype="text/plain; version=0.0.4")
+
+
+@bp.route("/profile", methods=["GET", "POST"])
+def profile() -> Any:
+    auth().assert_admin()
+
+    if request.method == "POST":
+        try:
+            j = request.json
+            if not j:
+                abort(400)
+            target = get_or_raise(j, "target", str)
+            count = get_or_raise(j, "count", int)
+        except ParseError as e:
+            abort(400, description=str(e))
+        if target not in profiling.TARGETS or count <= 0:
+            abort(400, description=f"Invalid target or count: {target} {count}")
+        profiling.profiler.start(target, count)
+        return OK_RESPONSE
+
+    sort = request.args.get("sort", "cumulative")
+    limit = request.args.get("limit", 50, type=int)
+    try:
+        return jsonify(profiling.profiler.result(sort, limit))
+    except KeyError:
+        abort(400, description=f"Invalid sort key: {sort}")
+
+
+@bp.route("/memoryDiff", methods=["GET", "POST", "DELETE"])
+def memoryDiff() -> Any:
+    auth().assert_admin()
+
+    if request.method == "POST":
+        profiling.profiler.start_memory_diff()
+        return OK_RESPONSE
+    if request.method == "DELETE":
+        profiling.profiler.stop_memory_diff()
+        return OK_RESPONSE
+
+    limit = request.args.get("limit", 25, type=int)
+    return jsonify(profiling.profiler.memory_diff(limit))
+
+
+@bp.route("/arenaPlan")
+def arenaPlan() -> Any:
+    auth().assert_admin()
+    if scheduler is None or lease is None:
+        abort(503, description="The scheduler is not running in this process")
+    now = time()
+    with Db() as db:
+        work = planner.pending(
+            db.schedules(lease.node), db.created_upcoming_or_failed(), now
+        )
+    projections = planner.project(
+        work, now, scheduler.budget, scheduler.arenas_rate_limited_until
+    )
+    return jsonify(
+        {
+            # the budget is only tracked by the process running the scheduler
+            "schedulerLeader": lease.held,
+            # with sharding, the plan only covers the teams of this node
+            "node": lease.node,
+            "rateLimitedUntil": scheduler.arenas_rate_limited_until,
+            "budget": scheduler.budget.available(now),
+            "pending": len(work),
+            "late": [
+                {
+                    "scheduleId": p.pending.schedule.id,
+                    "team": p.pending.schedule.team,
+                    "name": p.pending.schedule.name,
+                    "at": p.pending.at,
+                    "deadline": p.pending.deadline,
+                    "projectedCreation": int(p.creation),
+                }
+                for p in projections
+                if p.late
+            ],
+        }
+    )
+
+
+@bp.route("/shards")
+def shards() -> Any:
+    auth().assert_admin()
+    with Db() as db:
+        teams = db.shards()
+    by_node: DefaultDict[str, List[str]] = defaultdict(list)
+    for team, node, _ in teams:
+        by_node[node].append(team)
+    return jsonify(
+        {
+            "node": lease.node if lease else None,
+            "nodes": by_node,
+        }
+    )
+
+
+@bp.route("/events")
+def events() -> Any:
+    auth().assert_admin()
+    kind = request.args.get("kind")
+    if kind is not None and kind not in EVENT_KINDS:
+        abort(400, description=f"Unknown kind: {kind}")
+    limit = request.args.get("limit", 100, type=int)
+    if not 0 < limit <= 1000:
+        abort(400, description="limit must be between 1 and 1000")
+    with Db() as db:
+        page = db.events(
+            request.args.get("team"),
+            kind,
+            request.args.get("before", type=int),
+            limit,
+        )
+    return jsonify(
+        {"events": page, "before": page[-1].id if len(page) == limit else None}
+    )
+
+
+@bp.route("/capacity")
+def capacity_report() -> Any:
+    auth().assert_admin()
+    days = request.args.get("days", 7, type=float)
+    if not 0 < days <= 60:
+        abort(400, description="days must be between 0 and 60")
+    with Db() as db:
+        schedules = db.schedules()
+    return jsonify(
+        capacity.report(
+            schedules,
+            int(time()),
+            days,
+            planner.BUDGET_PER_HOUR,
+            capacity.CALL_LIMIT_PER_HOUR,
+        )
+    )
+
+
+@bp.route("/conflicts")
+def conflicts() -> Any:
+    auth().assert_admin()
+    with Db() as db:
+        schedules = db.schedules()
+    return jsonify(overlaps.all_conflicts(schedules, int(time())))
+
+
+@bp.route("/calendar/<team>.ics")
+def calendar(team: str) -> Any:
+    # calendar apps can't authenticate, tournaments are public anyway
+    if team not in settings.teams_whitelist:
+        abort(404)
+    etag, body = ical.feed(team)
+    response = Response(body, mimetype="text/calendar")
+    response.set_etag(etag)
+    response.cache_control.max_age = ical.CACHE_SECS
+    return response.make_conditional(request)
+
+
+@bp.route("/schedules")
 def schedules() -> Any:
+    """
+    Pages of the schedules of the user's teams (or `team`s) by id, grouped by
+    team. The X-Next-Cursor header is the `cursor` of the next page, if any.
+    """
     user = auth()
+    teams = request.args.getlist("team")
+    for team in teams:
+        user.assert_for_team(team)
+    if not teams:
+        teams = settings.teams_whitelist if user.is_admin else user.teams
+    cursor = request.args.get("cursor", 0, type=int)
+    limit = request.args.get("limit", SCHEDULES_PAGE_SIZE, type=int)
+    if not 0 < limit <= SCHEDULES_MAX_PAGE_SIZE:
+        abort(400, description=f"limit must be between 1 and {SCHEDULES_MAX_PAGE_SIZE}")
+    fields: Optional[List[str]] = None
+    if "fields" in request.args:
+        fields = [f for f in request.args["fields"].split(",") if f]
+        unknown = set(fields) - set(SCHEDULE_JSON_FIELDS)
+        if unknown:
+            abort(400, description=f"Unknown fields: {', '.join(sorted(unknown))}")
+    q = request.args.get("q") or None
+
+    with Db() as db:
+        page = db.schedules_page(teams, cursor, limit + 1, fields, q)
+    by_team: DefaultDict[str, List[Dict[str, Any]]] = defaultdict(list)
+    for j in page[:limit]:
+        by_team[j["team"]].append(j)
+    response = responses.json_response([(team, by_team[team]) for team in teams])
+    if len(page) > limit:
+        response.headers["X-Next-Cursor"] = str(page[limit - 1]["id"])
+    return response
+
+
+@bp.route("/battleTeamSchedules/<team>")
+def battleTeamSchedules(team: str) -> Any:
+    auth().assert_admin()
     with Db() as db:
-        by_team: DefaultDict[str, List[ScheduleWithId]] = defaultdict(list)
-        for s in db.schedules():
-            by_team[s.team].append(s)
-        teams = TEAMS_WHITELIST if user.is_admin else user.teams
-        return jsonify([(team, by_team[team]) for team in teams])
+        rows = db.schedules_with_battle_team(team)
+    return jsonify(
+        [
+            {"id": id, "team": t, "name": name, "alternative": alternative}
+            for id, t, name, alternative in rows
+        ]
+    )
 
 
-@app.route("/scheduledMsg/<id>")
+@bp.route("/scheduledMsg/<id>")
 def scheduledMsg(id: str) -> Any:
     user = auth()
     with Db() as db:
@@ -94,18 +436,15 @@ def scheduledMsg(id: str) -> Any:
     return jsonify({"msgMinutesBefore": minsBefore, "msgTemplate": template})
 
 
-@app.route("/tokenState")
+@bp.route("/tokenState")
 def tokenState() -> Any:
     user = auth()
-    state = {}
-    teams = TEAMS_WHITELIST if user.is_admin else user.teams
+    teams = settings.teams_whitelist if user.is_admin else user.teams
     with Db() as db:
-        for team in teams:
-            state[team] = db.token_state(team)
-    return jsonify(state)
+        return jsonify(db.token_states(teams))
 
 
-@app.route("/tokenUser/<team>")
+@bp.route("/tokenUser/<team>")
 def tokenExists(team: str) -> Any:
     user = auth()
     user.assert_for_team(team)
@@ -113,7 +452,7 @@ def tokenExists(team: str) -> Any:
         return jsonify({"user": db.token_user(team)})
 
 
-@app.route("/setToken/<team>", methods=["POST"])
+@bp.route("/setToken/<team>", methods=["POST"])
 def setToken(team: str) -> Any:
     user = auth()
     user.assert_for_team(team)
@@ -137,7 +476,7 @@ def setToken(team: str) -> Any:
     return OK_RESPONSE
 
 
-@app.route("/createdUpcomingIds")
+@bp.route("/createdUpcomingIds")
 def createdUpcomingIds() -> Any:
     auth()
     by_team: DefaultDict[str, List[str]] = defaultdict(list)
@@ -147,8 +486,44 @@ def createdUpcomingIds() -> Any:
     return jsonify(by_team)
 
 
-@app.route("/create", methods=["POST"])
-def create() -> str:
+@bp.route("/teamArenas")
+def teamArenas() -> Any:
+    user = auth()
+    teams = request.args.getlist("team") or (
+        settings.teams_whitelist if user.is_admin else user.teams
+    )
+    for team in teams:
+        user.assert_for_team(team)
+
+    created: DefaultDict[str, Set[str]] = defaultdict(set)
+    with Db() as db:
+        for id, team in db.created_upcoming():
+            created[team].add(id)
+
+    def generate() -> Iterator[str]:
+        now = time()
+        for team in teams:
+            if not created[team]:
+                continue
+            try:
+                team_arenas = arenas.team_arenas.get(team)
+            except Exception as e:
+                current_app.logger.error(f"Failed to load arenas of {team}: {e}")
+                error = {"team": team, "error": "Failed to load arenas"}
+                yield json.dumps(error) + "\n"
+                continue
+            for arena in team_arenas:
+                secondsToStart = int(arena["startsAt"] / 1000 - now)
+                if arena["id"] in created[team] and secondsToStart > 0:
+                    arena = {**arena, "team": team, "secondsToStart": secondsToStart}
+                    yield json.dumps(arena) + "\n"
+
+    # keeps the app context for current_app.logger while streaming
+    return Response(stream_with_context(generate()), mimetype="application/x-ndjson")
+
+
+@bp.route("/create", methods=["POST"])
+def create() -> Any:
     user = auth()
 
     try:
@@ -162,13 +537,64 @@ def create() -> str:
     user.assert_for_team(schedule.team)
 
     with Db() as db:
+        team = list(db.iter_schedules([schedule.team]))
         db.insert_schedule(schedule)
 
-    return OK_RESPONSE
+    return jsonify(
+        {"ok": True, "conflicts": overlaps.conflicts_with(schedule, team, int(time()))}
+    )
+
+
+@bp.route("/import", methods=["POST"])
+def importSchedules() -> Any:
+    user = auth()
+
+    schedules: List[Schedule] = []
+    errors: List[Dict[str, object]] = []
+    for n, line in enumerate(request.stream, start=1):
+        if not line.strip():
+            continue
+        try:
+            j = json.loads(line)
+            if not isinstance(j, dict):
+                raise ParseError("Expected a JSON object")
+            schedule = Schedule.from_json(cast(Dict[str, Any], j))
+        except (ValueError, ParseError) as e:
+            errors.append({"line": n, "error": str(e)})
+            continue
+        if not user.is_admin and schedule.team not in user.teams:
+            errors.append({"line": n, "error": f"Not a leader of {schedule.team}"})
+            continue
+        schedules.append(schedule)
+
+    if errors:
+        return jsonify({"errors": errors}), 400
 
+    with Db() as db:
+        db.insert_schedules(schedules)
+
+    return jsonify({"ok": True, "imported": len(schedules)})
 
-@app.route("/edit", methods=["POST"])
-def edit() -> str:
+
+@bp.route("/export")
+def exportSchedules() -> Any:
+    user = auth()
+    teams = settings.teams_whitelist if user.is_admin else user.teams
+    team = request.args.get("team")
+    if team is not None:
+        user.assert_for_team(team)
+        teams = [team]
+
+    def generate() -> Iterator[str]:
+        with Db() as db:
+            for s in db.iter_schedules(teams):
+                yield json.dumps(s.to_json()) + "\n"
+
+    return Response(generate(), mimetype="application/x-ndjson")
+
+
+@bp.route("/edit", methods=["POST"])
+def edit() -> Any:
     user = auth()
 
     try:
@@ -184,9 +610,16 @@ def edit() -> str:
 
     with Db() as db:
         db.update_schedule(schedule)
+        team = list(db.iter_schedules([schedule.team]))
+        response = jsonify(
+            {
+                "ok": True,
+                "conflicts": overlaps.conflicts_with(schedule, team, int(time())),
+            }
+        )
 
         if not update_created:
-            return OK_RESPONSE
+            return response
 
         db.update_scheduled_msgs(schedule)
 
@@ -194,36 +627,36 @@ def edit() -> str:
         prev = db.previous_created(schedule.id, int(time()))
         nth = db.num_created_before(schedule.id, int(time()))
 
-        for i, (id, at) in enumerate(upcoming):
-            err = api.update_arena(
-                ArenaEdit.from_schedule(schedule, id, at),
-                upcoming[i - 1][0] if i > 0 else prev,
-                upcoming[i + 1][0] if i + 1 < len(upcoming) else None,
-                nth + i + 1,
-                LICHESS_API_KEY,
-            )
-            if err is not None:
-                abort(500, description=f"Failed to update tournament {id}: {err}")
-
-            if schedule.is_team_battle:
-                try:
-                    api.update_team_battle(
-                        id,
-                        schedule.team_battle_teams(at),
-                        schedule.teamBattleLeaders,
-                        LICHESS_API_KEY,
-                    )
-                except Exception as e:
-                    app.logger.error(f"Failed to update arena teams: {e}")
-                    abort(
-                        500,
-                        description=f"Failed to update teams for {id}",
-                    )
+    for i, (id, at) in enumerate(upcoming):
+        err = api.update_arena(
+            ArenaEdit.from_schedule(schedule, id, at),
+            upcoming[i - 1][0] if i > 0 else prev,
+            upcoming[i + 1][0] if i + 1 < len(upcoming) else None,
+            nth + i + 1,
+            settings.lichess_api_key,
+        )
+        if err is not None:
+            abort(500, description=f"Failed to update tournament {id}: {err}")
+
+        if schedule.is_team_battle:
+            try:
+                api.update_team_battle(
+                    id,
+                    schedule.team_battle_teams(at),
+                    schedule.teamBattleLeaders,
+                    settings.lichess_api_key,
+                )
+            except Exception as e:
+                current_app.logger.error(f"Failed to update arena teams: {e}")
+                abort(
+                    500,
+                    description=f"Failed to update teams for {id}",
+                )
 
-    return OK_RESPONSE
+    return response
 
 
-@app.route("/editArena", methods=["POST"])
+@bp.route("/editArena", methods=["POST"])
 def editArena() -> str:
     user = auth()
     try:
@@ -244,7 +677,8 @@ def editArena() -> str:
                 description="This tournament either doesn't exist or wasn't created by the scheduler",
             )
 
-    err = api.update_arena(arena, None, None, 0, LICHESS_API_KEY)
+    err = api.update_arena(arena, None, None, 0, settings.lichess_api_key)
+    arenas.team_arenas.invalidate(arena.team)
     if err is not None:
         abort(500, description=f"Failed to edit tournament: {err}")
 
@@ -260,10 +694,10 @@ def editArena() -> str:
                 arena.id,
                 arena.team_battle_teams(),
                 arena.teamBattleLeaders,
-                LICHESS_API_KEY,
+                settings.lichess_api_key,
             )
         except Exception as e:
-            app.logger.error(f"Failed to update arena teams: {e}")
+            current_app.logger.error(f"Failed to update arena teams: {e}")
             abort(
                 500,
                 description="Failed to update team battle teams (but other changes were applied successfully)",
@@ -272,33 +706,72 @@ def editArena() -> str:
     return OK_RESPONSE
 
 
-@app.route("/delete/<int:id>", methods=["POST"])
+@bp.route("/bulkArenas", methods=["POST"])
+def bulkArenas() -> Any:
+    """
+    Cancels, shifts or sets the team message of many created arenas, given
+    by `ids` or by `scheduleId` with an optional `start`/`end` time range.
+    """
+    user = auth()
+    try:
+        j = request.json
+        if not j or not isinstance(j, dict):
+            abort(400, description="Invalid request body")
+        op = BulkArenaOp.from_json(cast(Dict[str, object], j))
+    except ParseError as e:
+        abort(400, description=str(e))
+
+    if op.scheduleId is not None:
+        with Db() as db:
+            team = db.team_of_schedule(op.scheduleId)
+        if team is None:
+            abort(404)
+        user.assert_for_team(team)
+    too_many = f"At most {bulk.MAX_ARENAS} tournaments can be changed at once"
+    # before the ids end up in a query
+    if op.ids is not None and len(op.ids) > bulk.MAX_ARENAS:
+        abort(400, description=too_many)
+    selected = bulk.select(op)
+    for team in set(a.team for a in selected):
+        user.assert_for_team(team)
+    if len(selected) > bulk.MAX_ARENAS:
+        abort(400, description=too_many)
+
+    results = bulk.apply(op, selected, settings.lichess_api_key)
+    return jsonify({"ok": all(r["ok"] for r in results), "results": results})
+
+
+@bp.route("/delete/<int:id>", methods=["POST"])
 def delete(id: int) -> str:
     with Db() as db:
         team = db.team_of_schedule(id)
-        if team is None:
-            abort(404)
-        auth().assert_for_team(team)
+    if team is None:
+        abort(404)
+    auth().assert_for_team(team)
+
+    with Db() as db:
         db.delete_schedule(id)
 
     return OK_RESPONSE
 
 
-@app.route("/cancel/<id>", methods=["POST"])
+@bp.route("/cancel/<id>", methods=["POST"])
 def cancel(id: str) -> str:
     with Db() as db:
         arena = db.created(id)
-        if arena is None:
-            abort(
-                404,
-                description="This tournament either doesn't exist or wasn't created by the scheduler",
-            )
-        auth().assert_for_team(arena.team)
-        try:
-            api.terminate_arena(id, LICHESS_API_KEY)
-        except Exception as e:
-            app.logger.error(f"Failed to cancel tournament: {e}")
-            abort(500, description="Failed to cancel tournament")
+    if arena is None:
+        abort(
+            404,
+            description="This tournament either doesn't exist or wasn't created by the scheduler",
+        )
+    auth().assert_for_team(arena.team)
+    try:
+        api.terminate_arena(id, settings.lichess_api_key)
+    except Exception as e:
+        current_app.logger.error(f"Failed to cancel tournament: {e}")
+        abort(500, description="Failed to cancel tournament")
 
+    with Db() as db:
         db.delete_created(id)
-        return OK_RESPONSE
+    arenas.team_arenas.invalidate(arena.team)
+    return OK_RESPONSE
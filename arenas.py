@@ -0,0 +1,79 @@
+from __future__ import annotations
+
+import logging
+from dataclasses import dataclass
+from threading import Lock
+from time import time
+from typing import Any, Dict, List, Optional
+
+import api
+import metrics
+
+CACHE_SECS = 60
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(slots=True)
+class CacheEntry:
+    arenas: List[Dict[str, Any]]
+    time: float
+
+
+class TeamArenaCache:
+    """
+    Upcoming arenas of each team as listed by Lichess. Only one request per team
+    is made at a time, concurrent callers wait for it and share its result.
+    """
+
+    def __init__(self) -> None:
+        self.cache: Dict[str, CacheEntry] = {}
+        self.locks: Dict[str, Lock] = {}
+        self.lock = Lock()
+
+    def team_lock(self, team: str) -> Lock:
+        with self.lock:
+            return self.locks.setdefault(team, Lock())
+
+    def get_fresh(self, team: str) -> Optional[List[Dict[str, Any]]]:
+        cached = self.cache.get(team)
+        if cached and cached.time > time() - CACHE_SECS:
+            return cached.arenas
+        return None
+
+    def get(self, team: str) -> List[Dict[str, Any]]:
+        arenas = self.get_fresh(team)
+        if arenas is not None:
+            metrics.TEAM_ARENAS_CACHE.inc("hit")
+            return arenas
+
+        with self.team_lock(team):
+            # someone else might have refreshed it while we were waiting
+            arenas = self.get_fresh(team)
+            if arenas is not None:
+                metrics.TEAM_ARENAS_CACHE.inc("hit")
+                return arenas
+            metrics.TEAM_ARENAS_CACHE.inc("miss")
+
+            try:
+                arenas = [
+                    arena
+                    for arena in api.team_arenas(team)
+                    if arena.get("system") == "arena"
+                    and arena.get("secondsToStart", 0) > 0
+                ]
+            except Exception as e:
+                stale = self.cache.get(team)
+                if stale is None:
+                    raise
+                logger.warning(f"Failed to load arenas of {team}, using stale: {e}")
+                return stale.arenas
+
+            self.cache[team] = CacheEntry(arenas, time())
+            return arenas
+
+    def invalidate(self, team: str) -> None:
+        self.cache.pop(team, None)
+
+
+team_arenas = TeamArenaCache()
@@ -7,9 +7,9 @@ from time import time
 from typing import Dict, List, Optional
 
 from flask import abort, request
-from requests import HTTPError
 
 import api
+import metrics
 
 CACHE_SIZE = 100
 CACHE_SECS = 10 * 60
@@ -75,6 +75,8 @@ class Auth:
         self.cache[token] = CacheEntry(user, time())
 
     def __call__(self) -> User:
+        from requests import HTTPError
+
         auth_header = request.headers.get("Authorization")
         if not auth_header:
             logger.warning("No auth header")
@@ -89,8 +91,10 @@ class Auth:
 
         cached = self.get_from_cache(token)
         if cached:
+            metrics.AUTH_CACHE.inc("hit")
             cached.assert_leader_or_admin()
             return cached
+        metrics.AUTH_CACHE.inc("miss")
 
         if self.rate_limited_until > time():
             logger.warning("Rate limited")
@@ -124,5 +128,6 @@ class Auth:
             logger.error(f"Error during auth requests to Lichess: {e}")
             if e.response.status_code == 429:
                 self.rate_limited_until = int(time()) + RATE_LIMIT_TIMEOUT_SECS
+                metrics.RATE_LIMITED_UNTIL.set(self.rate_limited_until, "auth", "")
                 abort(503)
             abort(500)
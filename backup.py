@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+
+"""
+Online backups of the database through the SQLite backup API.
+
+Usage: python backup.py [--db database.sqlite] backup --dir backups
+       python backup.py [--db database.sqlite] list --dir backups
+       python backup.py [--db database.sqlite] restore backups/<snapshot>.sqlite
+"""
+
+from __future__ import annotations
+
+import argparse
+import logging
+import os
+import sqlite3
+import sys
+from datetime import datetime
+from threading import Thread
+from time import perf_counter
+from time import sleep as real_sleep
+from typing import List, Optional
+
+import db
+import metrics
+from clock import sleep, time
+from scheduler import SchedulerLease
+
+# overridden from config in app.py
+BACKUP_DIR = ""  # backups are disabled without a directory
+BACKUP_INTERVAL_SECS = 6 * 60 * 60
+BACKUP_KEEP = 7
+BACKUP_INTEGRITY_CHECK = True
+# pages copied per step, between steps other connections can use the database
+BACKUP_PAGES = 256
+BACKUP_STEP_SLEEP_SECS = 0.01
+# writes of other connections restart a backup, after that many it copies all at once
+MAX_RESTARTS = 3
+
+logger = logging.getLogger(__name__)
+
+
+class BackupRestarted(Exception):
+    pass
+
+
+def snapshot_name(now: float) -> str:
+    base = os.path.splitext(os.path.basename(db.DATABASE))[0]
+    return f"{base}-{datetime.utcfromtimestamp(now):%Y%m%d-%H%M%S}.sqlite"
+
+
+def snapshots(directory: str) -> List[str]:
+    """Paths of the snapshots of the database in `directory`, oldest first."""
+    base = os.path.splitext(os.path.basename(db.DATABASE))[0]
+    if not os.path.isdir(directory):
+        return []
+    return sorted(
+        os.path.join(directory, name)
+        for name in os.listdir(directory)
+        if name.startswith(f"{base}-") and name.endswith(".sqlite")
+    )
+
+
+def copy(src: sqlite3.Connection, dst: sqlite3.Connection, pages: int) -> None:
+    """Copies in steps of `pages`, timing how long each step holds the source."""
+    step_start = perf_counter()
+    remaining_before: Optional[int] = None
+
+    def progress(status: int, remaining: int, total: int) -> None:
+        nonlocal step_start, remaining_before
+        metrics.BACKUP_STEP.observe(perf_counter() - step_start)
+        if remaining_before is not None and remaining > remaining_before:
+            raise BackupRestarted()
+        remaining_before = remaining
+        # sqlite3 only sleeps between steps when the database is busy, so give
+        # writers a chance to get in
+        if remaining:
+            real_sleep(BACKUP_STEP_SLEEP_SECS)
+        step_start = perf_counter()
+
+    src.backup(dst, pages=pages, progress=progress, sleep=BACKUP_STEP_SLEEP_SECS)
+
+
+def integrity_check(path: str) -> Optional[str]:
+    """None if the database at `path` is fine, otherwise the problems found."""
+    conn = sqlite3.connect(path)
+    try:
+        rows = conn.execute("PRAGMA integrity_check").fetchall()
+    finally:
+        conn.close()
+    result = "\n".join(str(row[0]) for row in rows)
+    return None if result == "ok" else result
+
+
+def backup(
+    directory: str,
+    keep: Optional[int] = None,
+    check: Optional[bool] = None,
+    pages: Optional[int] = None,
+) -> str:
+    """Writes a snapshot of the database to `directory` and rotates old ones."""
+    keep = BACKUP_KEEP if keep is None else keep
+    check = BACKUP_INTEGRITY_CHECK if check is None else check
+    pages = BACKUP_PAGES if pages is None else pages
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, snapshot_name(time()))
+    tmp = path + ".tmp"
+    start = perf_counter()
+    try:
+        src = sqlite3.connect(db.DATABASE, timeout=db.BUSY_TIMEOUT_SECS)
+        try:
+            for attempt in range(MAX_RESTARTS + 1):
+                if os.path.exists(tmp):
+                    os.remove(tmp)
+                dst = sqlite3.connect(tmp)
+                try:
+                    copy(src, dst, pages if attempt < MAX_RESTARTS else -1)
+                    break
+                except BackupRestarted:
+                    metrics.BACKUPS.inc("restarted")
+                    logger.info("Database changed during the backup, restarting")
+                finally:
+                    dst.close()
+        finally:
+            src.close()
+
+        if check:
+            problems = integrity_check(tmp)
+            if problems is not None:
+                metrics.BACKUPS.inc("corrupt")
+                raise Exception(f"Backup failed the integrity check: {problems}")
+        os.replace(tmp, path)
+    except Exception:
+        metrics.BACKUPS.inc("failed")
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+    metrics.BACKUP_DURATION.observe(perf_counter() - start)
+    metrics.BACKUPS.inc("ok")
+    metrics.LAST_BACKUP.set(time())
+
+    for old in snapshots(directory)[:-keep] if keep > 0 else []:
+        logger.info(f"Removing old backup {old}")
+        os.remove(old)
+    return path
+
+
+def restore(path: str) -> None:
+    """
+    Copies a snapshot over the database. Other processes using the database
+    should be stopped first.
+    """
+    problems = integrity_check(path)
+    if problems is not None:
+        raise Exception(f"{path} failed the integrity check: {problems}")
+    src = sqlite3.connect(path)
+    dst = sqlite3.connect(db.DATABASE, timeout=db.BUSY_TIMEOUT_SECS)
+    try:
+        src.backup(dst)
+    finally:
+        src.close()
+        dst.close()
+
+
+class BackupThread(Thread):
+    """Takes a backup every BACKUP_INTERVAL_SECS on the primary scheduler process."""
+
+    def __init__(self, lease: Optional[SchedulerLease] = None) -> None:
+        super().__init__(daemon=True)
+        self.lease = lease
+
+    def due(self) -> bool:
+        existing = snapshots(BACKUP_DIR)
+        if not existing:
+            return True
+        return os.path.getmtime(existing[-1]) < time() - BACKUP_INTERVAL_SECS
+
+    def run(self) -> None:
+        while True:
+            try:
+                if (self.lease is None or self.lease.primary) and self.due():
+                    path = backup(BACKUP_DIR)
+                    logger.info(f"Backed up the database to {path}")
+            except Exception as e:
+                logger.error(f"Error during backup: {e}", exc_info=True)
+            sleep(60)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--db", default=db.DATABASE)
+    sub = parser.add_subparsers(dest="command", required=True)
+    p = sub.add_parser("backup")
+    p.add_argument("--dir", default="backups")
+    p.add_argument("--keep", type=int, default=BACKUP_KEEP)
+    p.add_argument("--pages", type=int, default=BACKUP_PAGES)
+    p.add_argument("--no-check", action="store_true")
+    p = sub.add_parser("list")
+    p.add_argument("--dir", default="backups")
+    p = sub.add_parser("restore")
+    p.add_argument("snapshot")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    db.DATABASE = args.db
+    if args.command == "backup":
+        print(backup(args.dir, args.keep, not args.no_check, args.pages))
+    elif args.command == "list":
+        for path in snapshots(args.dir):
+            print(f"{path}\t{os.path.getsize(path)}")
+    else:
+        try:
+            restore(args.snapshot)
+        except Exception as e:
+            print(e, file=sys.stderr)
+            sys.exit(1)
+        print(f"Restored {db.DATABASE} from {args.snapshot}")
+
+
+if __name__ == "__main__":
+    main()
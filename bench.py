@@ -0,0 +1,641 @@
+#!/usr/bin/env python3
+
+"""
+Benchmarks for the scheduling hot paths on reproducible synthetic data.
+
+Usage: python bench.py [--out bench_output.json] [--compare old.json]
+"""
+
+from __future__ import annotations
+
+import argparse
+import dataclasses
+import gzip
+import json
+import logging
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time as real_time
+import tracemalloc
+from datetime import datetime, timezone
+from threading import Thread
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from flask import Flask, jsonify
+
+import clock
+import db
+import responses
+from api import format_description, format_name
+from db import Db
+from model import Schedule, ScheduleWithId, extract_team_battle_teams
+from scheduler import SchedulerThread
+from simulate import init_temp_db, load_fake_lichess, remove_db, start_fake_lichess
+
+# fixed so that next_times and the generated data are reproducible
+START = datetime(2026, 1, 5, tzinfo=timezone.utc).timestamp()
+
+SCHEDULE_DAYS = (
+    [0, *range(1, 8)]
+    + [unit * 1000 + period for unit in (1, 2, 3) for period in (1, 2, 3, 14)]
+    + [10_000 + ordinal * 10 + weekday for ordinal in range(5) for weekday in range(7)]
+    + [20_000 + day for day in range(1, 8)]
+)
+ZONES = ["Europe/Berlin", "America/New_York", "Asia/Kolkata", "Australia/Sydney"]
+NAMES = [
+    "Daily Blitz",
+    "{nth} Weekly Rapid",
+    "{month} Bullet #{n}",
+    "Week {weekOfMonth|1|2|3|4|5} Arena",
+    "{weekOfMonth|A|B|C|D|Last} Cup",
+]
+DESCRIPTION = """Welcome to the {nth} edition of {name}!
+
+[Previous tournament](prev) | [Next tournament](next)
+
+Played in {month}, week {weekOfMonth}. Next one is the {nth+1}."""
+TEAM_BATTLE_TEAMS = "\n".join(
+    f"https://lichess.org/team/team-{i} Team {i}" if i % 2 else f"team-{i}"
+    for i in range(20)
+)
+
+
+class Bench:
+    def __init__(self) -> None:
+        self.results: Dict[str, Dict[str, float]] = {}
+
+    def run(
+        self, name: str, fn: Callable[[], Any], number: int, repeat: int = 5
+    ) -> None:
+        times: List[float] = []
+        for _ in range(repeat):
+            start = real_time.perf_counter()
+            for _ in range(number):
+                fn()
+            times.append((real_time.perf_counter() - start) / number)
+        self.record(name, times, number)
+
+    def record(self, name: str, times: List[float], number: int = 1) -> None:
+        self.results[name] = {
+            "number": number,
+            "bestUs": min(times) * 1e6,
+            "medianUs": statistics.median(times) * 1e6,
+        }
+        print(f"{name:<45} {min(times) * 1e6:>12.1f} us")
+
+    def once(self, name: str, fn: Callable[[], Any]) -> None:
+        self.run(name, fn, 1, 1)
+
+
+def allocated_kib(fn: Callable[[], Any]) -> float:
+    """Memory still allocated by the result of `fn`."""
+    tracemalloc.start()
+    try:
+        result = fn()
+        size, _ = tracemalloc.get_traced_memory()
+        del result
+    finally:
+        tracemalloc.stop()
+    return size / 1024
+
+
+def synthetic_schedule_json(rnd: random.Random, team: str, i: int) -> Dict[str, Any]:
+    scheduleDay = SCHEDULE_DAYS[i % len(SCHEDULE_DAYS)]
+    j: Dict[str, Any] = {
+        "name": rnd.choice(NAMES),
+        "team": team,
+        "clock": rnd.choice([1, 3, 5, 0.5]),
+        "increment": rnd.choice([0, 1, 2]),
+        "minutes": rnd.choice([30, 60, 90]),
+        "variant": "standard",
+        "rated": True,
+        "berserkable": True,
+        "streakable": rnd.random() < 0.5,
+        "description": DESCRIPTION,
+        "allowBots": False,
+        "scheduleDay": scheduleDay,
+        "scheduleTime": rnd.randrange(24 * 4) * 15,
+        "daysInAdvance": rnd.choice([None, 1, 3, 7]),
+    }
+    if 1000 < scheduleDay < 10_000:
+        j["scheduleStart"] = int(START) - rnd.randrange(365) * 24 * 60 * 60
+    if rnd.random() < 0.2:
+        j["teamBattleTeams"] = TEAM_BATTLE_TEAMS
+        j["teamBattleAlternativeTeamsEnabled"] = True
+        j["teamBattleAlternativeTeams"] = TEAM_BATTLE_TEAMS
+    if rnd.random() < 0.5:
+        j["msgMinutesBefore"] = 30
+        j["msgTemplate"] = "Starting soon: {link}"
+    return j
+
+
+def populate(rnd: random.Random, schedules: List[Schedule], rows: int) -> None:
+    with Db() as d:
+        d.insert_schedules(schedules)
+        ids = [s.id for s in d.schedules()]
+        teams = {s.id: s.team for s in d.schedules()}
+
+        def created_rows() -> Iterator[Tuple[str, int, str, int, Optional[str]]]:
+            for n in range(rows):
+                sid = ids[n % len(ids)]
+                # spread history over the last three years and the next week
+                t = int(START) - rnd.randrange(
+                    -7 * 24 * 60 * 60, 3 * 365 * 24 * 60 * 60
+                )
+                error = "failed" if n % 1000 == 0 else None
+                id = f"failed-{n}" if error else f"a{n:08}"
+                yield (id, sid, teams[sid], t - t % 900, error)
+
+        with d.db as conn:
+            conn.executemany(
+                "INSERT INTO createdArenas (id, scheduleId, team, time, error) VALUES (?, ?, ?, ?, ?)",
+                created_rows(),
+            )
+            conn.executemany(
+                "INSERT INTO scheduledMsgs (arenaId, scheduleId, team, template, minutesBefore, sendTime) VALUES (?, ?, ?, ?, ?, ?)",
+                (
+                    (
+                        f"m{n:08}",
+                        ids[n % len(ids)],
+                        teams[ids[n % len(ids)]],
+                        "{link}",
+                        30,
+                        int(START) + n * 60,
+                    )
+                    for n in range(len(ids))
+                ),
+            )
+        for team in set(teams.values()):
+            d.set_token_for_team(team, "token", "user")
+
+
+def bench_model(b: Bench, jsons: List[Dict[str, Any]]) -> None:
+    schedules = [Schedule.from_json(j) for j in jsons]
+    b.run("Schedule.from_json", lambda: [Schedule.from_json(j) for j in jsons], 1)
+    b.run("Schedule.next_times (all)", lambda: [s.next_times() for s in schedules], 1)
+    zoned = [
+        dataclasses.replace(s, timezone=ZONES[i % len(ZONES)])
+        for i, s in enumerate(schedules)
+    ]
+    b.run(
+        "Schedule.next_times (all, with timezone)",
+        lambda: [s.next_times() for s in zoned],
+        1,
+    )
+    for day in (0, 5, 2002, 3001, 10_041, 20_003):
+        s = next(s for s in schedules if s.scheduleDay == day)
+        b.run(f"Schedule.next_times scheduleDay={day}", s.next_times, 1000)
+
+    with Db() as d:
+        rows = d.db.execute("SELECT * FROM schedules").fetchall()
+        d.db.row_factory = None
+        values = d.db.execute(db.SELECT_SCHEDULES).fetchall()
+    b.run(
+        "ScheduleWithId.from_row (all)",
+        lambda: [ScheduleWithId.from_row(r) for r in rows],
+        1,
+    )
+    b.run(
+        "ScheduleWithId.from_values (all)",
+        lambda: [ScheduleWithId.from_values(v) for v in values],
+        1,
+    )
+
+    at = int(START)
+    b.run("format_name", lambda: format_name(NAMES[3], at, 42), 10_000)
+    b.run(
+        "format_description",
+        lambda: format_description(DESCRIPTION, "prevId", "nextId", "Name", at, 42),
+        10_000,
+    )
+    b.run(
+        "extract_team_battle_teams",
+        lambda: extract_team_battle_teams(TEAM_BATTLE_TEAMS),
+        10_000,
+    )
+
+
+def bench_db(b: Bench) -> None:
+    with Db() as d:
+        s = d.schedules()[0]
+        upcoming = d.created_upcoming()
+        arena = d.created(upcoming[0][0])
+        assert arena is not None
+        now = int(START)
+
+        b.run(
+            "Db.__enter__/__exit__",
+            lambda: Db().__enter__().__exit__(None, None, None),
+            1000,
+        )
+        b.run("Db.schedules", d.schedules, 3)
+        b.results["Db.schedules"]["resultKiB"] = allocated_kib(d.schedules)
+        print(f"{'':<45} {b.results['Db.schedules']['resultKiB']:>12.1f} KiB")
+        b.run("Db.created", lambda: d.created(arena.id), 1000)
+        b.run("Db.created_upcoming", d.created_upcoming, 10)
+        b.run(
+            "Db.created_upcoming_with_schedule",
+            lambda: d.created_upcoming_with_schedule(s.id),
+            10,
+        )
+        b.run("Db.created_upcoming_or_failed", d.created_upcoming_or_failed, 10)
+        b.run("Db.num_created_before", lambda: d.num_created_before(s.id, now), 10)
+        b.run("Db.previous_created", lambda: d.previous_created(s.id, now), 10)
+        b.run("Db.previous_two_created", lambda: d.previous_two_created(s.id, now), 10)
+        b.run("Db.team_of_schedule", lambda: d.team_of_schedule(s.id), 1000)
+        b.run("Db.scheduled_msg", lambda: d.scheduled_msg("m00000000"), 100)
+        b.run("Db.token_for_team", lambda: d.token_for_team(s.team), 1000)
+        b.run("Db.token_state", lambda: d.token_state(s.team), 100)
+        teams = sorted(set(x.team for x in d.schedules()))
+        b.run(
+            "Db.schedules_page (all teams, first page)",
+            lambda: d.schedules_page(teams, 0, 500),
+            10,
+        )
+        b.run(
+            "Db.schedules_page (one team, first page)",
+            lambda: d.schedules_page([s.team], 0, 500),
+            10,
+        )
+        b.run(
+            "Db.token_states (all teams, uncached)",
+            lambda: (db.token_state_cache.clear(), d.token_states(teams)),
+            100,
+        )
+        b.run(
+            "Db.token_states (all teams, cached)", lambda: d.token_states(teams), 1000
+        )
+        b.run("Db.token_user", lambda: d.token_user(s.team), 1000)
+        b.run("Db.get_and_remove_scheduled_msgs", d.get_and_remove_scheduled_msgs, 10)
+
+        b.run("Db.insert_schedule", lambda: d.insert_schedule(s), 20)
+        b.run("Db.update_schedule", lambda: d.update_schedule(s), 20)
+        b.run("Db.update_scheduled_msgs", lambda: d.update_scheduled_msgs(s), 20)
+        b.run(
+            "Db.insert_created",
+            lambda: d.insert_created("bench", s.id, s.team, now),
+            20,
+        )
+        b.run("Db.update_created", lambda: d.update_created(arena), 20)
+        b.run(
+            "Db.update_scheduled_msg",
+            lambda: d.update_scheduled_msg(arena, 30, "{link}"),
+            20,
+        )
+        b.run(
+            "Db.insert_scheduled_msg",
+            lambda: d.insert_scheduled_msg("bench", s.id, s.team, "{link}", 30, now),
+            20,
+        )
+        b.run(
+            "Db.set_token_for_team",
+            lambda: d.set_token_for_team(s.team, "token", "user"),
+            20,
+        )
+        b.run("Db.mark_bad_token", lambda: d.mark_bad_token(s.team, "token"), 20)
+        b.run("Db.delete_created", lambda: d.delete_created("bench"), 20)
+        b.run("Db.delete_schedule", lambda: d.delete_schedule(-1), 20)
+
+
+def bench_responses(b: Bench) -> None:
+    """The /schedules payload of an admin through Flask's jsonify and responses.dumps."""
+    with Db() as d:
+        schedules = d.schedules()
+    by_team: Dict[str, List[ScheduleWithId]] = {}
+    for s in schedules:
+        by_team.setdefault(s.team, []).append(s)
+    payload = list(by_team.items())
+
+    flask_app = Flask(__name__)
+    with flask_app.app_context():
+        b.run(
+            "/schedules jsonify",
+            lambda: jsonify(payload).get_data(),
+            3,
+        )
+        before = jsonify(payload).get_data()
+    b.run("/schedules responses.dumps", lambda: responses.dumps(payload), 3)
+    if responses.orjson is not None:
+        orjson, responses.orjson = responses.orjson, None
+        try:
+            b.run(
+                "/schedules responses.dumps (without orjson)",
+                lambda: responses.dumps(payload),
+                3,
+            )
+        finally:
+            responses.orjson = orjson
+    after = responses.dumps(payload)
+    encoded = {"identity": after, "gzip": gzip.compress(after, responses.GZIP_LEVEL)}
+    b.run(
+        "/schedules gzip",
+        lambda: gzip.compress(after, responses.GZIP_LEVEL, mtime=0),
+        3,
+    )
+    if responses.brotli is not None:
+        encoded["br"] = responses.brotli.compress(
+            after, quality=responses.BROTLI_QUALITY
+        )
+        b.run(
+            "/schedules brotli",
+            lambda: responses.brotli.compress(after, quality=responses.BROTLI_QUALITY),
+            3,
+        )
+    b.results["/schedules jsonify"]["bytes"] = len(before)
+    print(f"{'':<45} {len(before):>12} bytes")
+    for encoding, data in encoded.items():
+        name = f"/schedules responses.dumps ({encoding})"
+        b.results[name] = {"bytes": len(data)}
+        print(f"{name:<45} {len(data):>12} bytes")
+
+
+def bench_tick(b: Bench, jsons: List[Dict[str, Any]]) -> None:
+    fake = load_fake_lichess()
+    fake.now = clock.time
+    fake.leader_teams = sorted(set(j["team"] for j in jsons))
+    start_fake_lichess(fake)
+
+    path = init_temp_db()
+    try:
+        with Db() as d:
+            for j in jsons:
+                d.insert_schedule(Schedule.from_json(j))
+            for team in fake.leader_teams:
+                d.set_token_for_team(team, "token", "user")
+        scheduler = SchedulerThread("bench")
+        b.once(
+            "SchedulerThread.schedule_next_arenas (cold)",
+            scheduler.schedule_next_arenas,
+        )
+        b.results["SchedulerThread.schedule_next_arenas (cold)"]["apiCalls"] = len(
+            fake.calls
+        )
+        b.run(
+            "SchedulerThread.schedule_next_arenas (warm)",
+            scheduler.schedule_next_arenas,
+            10,
+        )
+    finally:
+        remove_db(path)
+
+
+def bench_concurrent_writes(b: Bench, threads: int, writes: int) -> None:
+    """HTTP workers and the scheduler writing at the same time."""
+    path = init_temp_db()
+    try:
+
+        def worker(n: int) -> None:
+            with Db() as d:
+                for i in range(writes):
+                    d.insert_created(f"w{n}-{i}", n, "team", int(START) + i)
+
+        def run() -> None:
+            workers = [Thread(target=worker, args=(n,)) for n in range(threads)]
+            for w in workers:
+                w.start()
+            for w in workers:
+                w.join()
+
+        name = f"concurrent insert_created ({threads} threads x {writes})"
+        b.once(name, run)
+        b.results[name]["writesPerSec"] = (
+            threads * writes / (b.results[name]["bestUs"] / 1e6)
+        )
+        print(f"{'':<45} {b.results[name]['writesPerSec']:>12.1f} writes/s")
+    finally:
+        remove_db(path)
+
+
+COLD_START = """
+import json, sys, time
+start = time.perf_counter()
+import app
+imported = time.perf_counter()
+app.create_app(sys.argv[1], start=False)
+created = time.perf_counter()
+print(json.dumps([imported - start, created - imported]))
+"""
+
+
+def bench_cold_start(b: Bench, repeat: int = 5) -> None:
+    """Importing app.py and create_app() in fresh interpreters."""
+    config = os.path.join(
+        os.path.dirname(os.path.abspath(__file__)), "config.example.py"
+    )
+    imports: List[float] = []
+    creates: List[float] = []
+    for _ in range(repeat):
+        with tempfile.TemporaryDirectory() as cwd:
+            out = subprocess.run(
+                [sys.executable, "-c", COLD_START, config],
+                cwd=cwd,
+                env={**os.environ, "PYTHONPATH": os.path.dirname(config)},
+                capture_output=True,
+                text=True,
+                check=True,
+            ).stdout
+        imported, created = json.loads(out.splitlines()[-1])
+        imports.append(imported)
+        creates.append(created)
+    b.record("cold start: import app", imports)
+    b.record("cold start: create_app (new db)", creates)
+
+
+SHARD_NODE = """
+import json, sys, time
+import api, clock, db, planner, scheduler
+db.DATABASE, api.HOST = sys.argv[1], sys.argv[2]
+clock.current = clock.FakeClock(float(sys.argv[3]))
+planner.BUDGET_CAPACITY = planner.BUDGET_PER_HOUR = 1_000_000_000
+lease = scheduler.ShardLease()
+lease.renew()
+print("ready", flush=True)
+sys.stdin.readline()
+start = time.perf_counter()
+lease.held = lease.renew()
+scheduler.SchedulerThread("bench", lease).schedule_next_arenas()
+print(json.dumps(time.perf_counter() - start))
+"""
+
+
+def bench_shards(
+    b: Bench, jsons: List[Dict[str, Any]], nodes: List[int], latency: float
+) -> None:
+    """
+    Tournament creation throughput of 1..n scheduler processes sharing the
+    teams, against the fake API answering after `latency` secs.
+    """
+    fake = load_fake_lichess()
+    fake.now = lambda: START
+    fake.leader_teams = sorted(set(j["team"] for j in jsons))
+    fake.app.before_request(lambda: real_time.sleep(latency))
+    host = start_fake_lichess(fake)
+    root = os.path.dirname(os.path.abspath(__file__))
+
+    for n in nodes:
+        path = init_temp_db()
+        try:
+            with Db() as d:
+                for j in jsons:
+                    d.insert_schedule(Schedule.from_json(j))
+                for team in fake.leader_teams:
+                    d.set_token_for_team(team, "token", "user")
+            procs = [
+                subprocess.Popen(
+                    [sys.executable, "-c", SHARD_NODE, path, host, str(START)],
+                    cwd=root,
+                    stdin=subprocess.PIPE,
+                    stdout=subprocess.PIPE,
+                    text=True,
+                )
+                for _ in range(n)
+            ]
+            for p in procs:
+                assert p.stdout and p.stdout.readline().strip() == "ready"
+            start = real_time.perf_counter()
+            for p in procs:
+                assert p.stdin
+                p.stdin.write("go\n")
+                p.stdin.flush()
+            node_secs = [float(p.communicate()[0].splitlines()[-1]) for p in procs]
+            wall = real_time.perf_counter() - start
+            with Db() as d:
+                arenas = sum(
+                    sum(d.num_created_by_schedule(team).values())
+                    for team in fake.leader_teams
+                )
+        finally:
+            remove_db(path)
+
+        name = f"sharded schedule_next_arenas ({n} nodes)"
+        b.record(name, [wall])
+        b.results[name]["arenas"] = arenas
+        b.results[name]["slowestNodeUs"] = max(node_secs) * 1e6
+        b.results[name]["arenasPerSec"] = arenas / wall
+        print(f"{'':<45} {arenas / wall:>12.1f} arenas/s")
+        single = b.results.get("sharded schedule_next_arenas (1 nodes)")
+        if single and n > 1:
+            b.results[name]["speedup"] = single["bestUs"] / (wall * 1e6)
+            print(f"{'':<45} {b.results[name]['speedup']:>12.2f}x of 1 node")
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except Exception:
+        return None
+
+
+def compare(results: Dict[str, Dict[str, float]], path: str) -> None:
+    with open(path) as f:
+        old = json.load(f)["results"]
+    print(f"\nCompared to {path}:")
+    for name, r in results.items():
+        if name in old and old[name]["bestUs"]:
+            print(f"{name:<45} {r['bestUs'] / old[name]['bestUs']:>8.2f}x")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--schedules", type=int, default=3000)
+    parser.add_argument("--teams", type=int, default=50)
+    parser.add_argument(
+        "--rows", type=int, default=1_000_000, help="createdArenas history rows"
+    )
+    parser.add_argument(
+        "--tick-schedules",
+        type=int,
+        default=100,
+        help="schedules for the full tick against the fake API",
+    )
+    parser.add_argument("--write-threads", type=int, default=8)
+    parser.add_argument("--writes", type=int, default=200, help="writes per thread")
+    parser.add_argument(
+        "--shard-nodes",
+        type=lambda v: [int(n) for n in v.split(",")],
+        default=[1, 2, 4],
+        help="scheduler processes to compare, comma separated",
+    )
+    parser.add_argument(
+        "--shard-schedules",
+        type=int,
+        default=400,
+        help="schedules for the sharded scheduler throughput",
+    )
+    parser.add_argument(
+        "--shard-teams",
+        type=int,
+        default=200,
+        help="teams the schedules of the sharded bench are spread over",
+    )
+    parser.add_argument(
+        "--api-latency",
+        type=float,
+        default=0.05,
+        help="secs the fake API takes per request in the sharded bench",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", default="bench_output.json")
+    parser.add_argument("--compare", help="previous results to compare against")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    logging.getLogger("scheduler").setLevel(logging.WARNING)
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)
+
+    rnd = random.Random(args.seed)
+    teams = [f"team-{i}" for i in range(args.teams)]
+    jsons = [
+        synthetic_schedule_json(rnd, teams[i % len(teams)], i)
+        for i in range(args.schedules)
+    ]
+
+    b = Bench()
+    clock.current = clock.FakeClock(START)
+    path = init_temp_db()
+    try:
+        print(
+            f"Populating {db.DATABASE} with {args.schedules} schedules and {args.rows} created arenas"
+        )
+        populate(rnd, [Schedule.from_json(j) for j in jsons], args.rows)
+        bench_model(b, jsons)
+        bench_db(b)
+        bench_responses(b)
+    finally:
+        remove_db(path)
+    bench_tick(b, jsons[: args.tick_schedules])
+    bench_concurrent_writes(b, args.write_threads, args.writes)
+    bench_cold_start(b)
+    shard_jsons = [
+        {**j, "team": f"team-{i % args.shard_teams}"}
+        for i, j in enumerate(jsons[: args.shard_schedules])
+    ]
+    bench_shards(b, shard_jsons, args.shard_nodes, args.api_latency)
+
+    with open(args.out, "w") as f:
+        json.dump(
+            {
+                "commit": git_commit(),
+                "date": datetime.now(timezone.utc).isoformat(),
+                "args": vars(args),
+                "results": b.results,
+            },
+            f,
+            indent=2,
+        )
+    print(f"Saved results to {args.out}")
+    if args.compare:
+        compare(b.results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
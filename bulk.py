@@ -0,0 +1,173 @@
+from __future__ import annotations
+
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from threading import Event, Lock
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import api
+import arenas
+import planner
+from clock import sleep, time
+from db import Db
+from model import (
+    BULK_CANCEL,
+    BULK_MESSAGE,
+    BULK_SHIFT,
+    BulkArenaOp,
+    CreatedArena,
+    ScheduleWithId,
+)
+
+# concurrent Lichess calls of a bulk operation
+WORKERS = 4
+MAX_ARENAS = 200
+# the calls draw from a token bucket like the scheduler's tournament creation
+# budget and start at least CALL_INTERVAL_SECS apart
+BUDGET_CAPACITY = 50
+BUDGET_PER_HOUR = 1200
+CALL_INTERVAL_SECS = 0.5
+# calls that would have to wait longer for the budget are skipped
+MAX_WAIT_SECS = 30
+RATE_LIMITED = "Skipped because Lichess rate-limited the previous requests"
+BUDGET_USED_UP = "Skipped because too many tournaments were changed recently"
+NOT_FOUND = "Not an upcoming tournament created by the scheduler"
+
+logger = logging.getLogger(__name__)
+
+
+class Pacer:
+    """Hands out the start times of Lichess calls of all bulk operations."""
+
+    def __init__(self) -> None:
+        self.bucket = planner.TokenBucket(BUDGET_CAPACITY, BUDGET_PER_HOUR, time())
+        self.next_call = 0.0
+        self.lock = Lock()
+
+    def reserve(self) -> Optional[float]:
+        """Start time of the next call, None if it is more than MAX_WAIT_SECS away."""
+        with self.lock:
+            now = time()
+            at = self.bucket.next_token(max(now, self.next_call))
+            if at > now + MAX_WAIT_SECS:
+                return None
+            self.bucket.take(at)
+            self.next_call = at + CALL_INTERVAL_SECS
+            return at
+
+
+pacer = Pacer()
+
+
+def select(op: BulkArenaOp) -> List[CreatedArena]:
+    with Db() as db:
+        if op.ids is not None:
+            return db.created_upcoming_by_ids(op.ids)
+        assert op.scheduleId is not None
+        return db.created_upcoming_of_schedule(
+            op.scheduleId,
+            op.start if op.start is not None else 0,
+            op.end if op.end is not None else 2**63 - 1,
+        )
+
+
+def run_calls(calls: Dict[str, Callable[[], None]]) -> Dict[str, Optional[str]]:
+    """
+    Runs the Lichess calls of each arena id on WORKERS threads, paced by
+    `pacer`, and returns their errors. Once Lichess rate-limits a call, the
+    remaining are skipped.
+    """
+    rate_limited = Event()
+
+    def run(call: Callable[[], None]) -> Optional[str]:
+        if rate_limited.is_set():
+            return RATE_LIMITED
+        at = pacer.reserve()
+        if at is None:
+            return BUDGET_USED_UP
+        sleep(max(0.0, at - time()))
+        if rate_limited.is_set():
+            return RATE_LIMITED
+        try:
+            call()
+            return None
+        except Exception as e:
+            response = getattr(e, "response", None)
+            if response is not None and response.status_code == 429:
+                rate_limited.set()
+            logger.error(f"Bulk tournament operation failed: {e}")
+            return str(e)
+
+    with ThreadPoolExecutor(WORKERS) as pool:
+        return dict(zip(calls, pool.map(run, calls.values())))
+
+
+def shift_calls(
+    selected: List[CreatedArena], secs: int, api_key: str
+) -> Dict[str, Callable[[], None]]:
+    """
+    Calls moving the arenas by `secs`. Only the start changes, the arenas
+    keep their own settings.
+    """
+    teams = sorted(set(a.team for a in selected))
+    with Db() as db:
+        schedules = {s.id: s for s in db.iter_schedules(teams)}
+
+    def move(s: Optional[ScheduleWithId], id: str, at: int) -> None:
+        api.move_arena(id, at, api_key)
+        # the teams of a battle can depend on the date
+        if s is not None and s.is_team_battle:
+            api.update_team_battle(
+                id, s.team_battle_teams(at), s.teamBattleLeaders, api_key
+            )
+
+    return {
+        a.id: partial(move, schedules.get(a.scheduleId), a.id, a.time + secs)
+        for a in selected
+    }
+
+
+def apply(
+    op: BulkArenaOp, selected: List[CreatedArena], api_key: str
+) -> List[Dict[str, Any]]:
+    """
+    Runs `op` on the selected arenas, calling Lichess concurrently and then
+    recording all changes in one transaction. Returns the result per arena.
+    """
+    errors: Dict[str, Optional[str]] = {}
+    if op.ids is not None:
+        found = set(a.id for a in selected)
+        errors.update((id, NOT_FOUND) for id in op.ids if id not in found)
+
+    deleted: List[str] = []
+    moved: List[CreatedArena] = []
+    msgs: List[Tuple[CreatedArena, Optional[int], Optional[str]]] = []
+    if op.action == BULK_CANCEL:
+        errors.update(
+            run_calls(
+                {a.id: partial(api.terminate_arena, a.id, api_key) for a in selected}
+            )
+        )
+        deleted = [a.id for a in selected if errors[a.id] is None]
+    elif op.action == BULK_SHIFT:
+        secs = (op.shiftMinutes or 0) * 60
+        errors.update(run_calls(shift_calls(selected, secs, api_key)))
+        moved = [
+            CreatedArena(a.id, a.scheduleId, a.team, a.time + secs)
+            for a in selected
+            if errors[a.id] is None
+        ]
+    elif op.action == BULK_MESSAGE:
+        msgs = [(a, op.msgMinutesBefore, op.msgTemplate) for a in selected]
+        errors.update((a.id, None) for a in selected)
+
+    with Db() as db:
+        db.apply_arena_changes(deleted, moved, msgs)
+    for team in set(a.team for a in selected):
+        arenas.team_arenas.invalidate(team)
+
+    return [
+        {"id": id, "ok": error is None, **({"error": error} if error else {})}
+        for id, error in errors.items()
+    ]
@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+
+"""
+Projects the Lichess API calls the schedules will cause per hour and team and
+flags hours and schedule times that are likely to run into rate limits.
+
+Usage: python capacity.py [--db database.sqlite] [--days 7]
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+from collections import Counter, defaultdict
+from datetime import datetime, timezone
+from typing import Any, DefaultDict, Dict, Iterable, List, Sequence, Tuple
+
+import db
+import planner
+from db import Db
+from model import Schedule
+
+KINDS = ("create", "teamBattle", "nextLink", "pm")
+# SchedulerThread.send_scheduled_messages makes these per (uncollated) message:
+# api.verify_token, api.leader_teams via is_valid_msg_token_for_team and
+# api.send_team_msgs
+PM_CALLS = 3
+CALL_LIMIT_PER_HOUR = 600
+SHARED_TIME_MIN_SCHEDULES = 10
+# occurrences before the window are needed to know when the ones in it are created
+LOOKBACK_SECS = 35 * 24 * 60 * 60
+
+
+def calls(s: Schedule, start: int, end: int) -> Iterable[Tuple[int, str, int]]:
+    """(time, kind, number of calls) caused by `s` between `start` and `end`."""
+    window = s.days_in_advance * 24 * 60 * 60
+    times = list(
+        s.occurrences(
+            datetime.utcfromtimestamp(start - window - LOOKBACK_SECS), end + window
+        )
+    )
+    links = bool(s.description and "](next)" in s.description)
+    before = s.msgMinutesBefore if s.msgTemplate else None
+    for i, at in enumerate(times):
+        # the scheduler creates the next 5 occurrences within the window
+        created = at - window if i < 5 else max(at - window, times[i - 5])
+        if start <= created < end:
+            yield created, "create", 1
+            if s.is_team_battle:
+                yield created, "teamBattle", 1
+            if links and i > 0:
+                yield created, "nextLink", 2
+        if before and before > 0:
+            send = at - before * 60
+            if start <= send < end:
+                yield send, "pm", PM_CALLS
+
+
+def report(
+    schedules: Sequence[Schedule],
+    start: int,
+    days: float,
+    creation_limit: int,
+    call_limit: int,
+) -> Dict[str, Any]:
+    end = int(start + days * 24 * 60 * 60)
+    hours: DefaultDict[int, Counter[str]] = defaultdict(Counter)
+    teams: DefaultDict[str, Counter[str]] = defaultdict(Counter)
+    for s in schedules:
+        for t, kind, n in calls(s, start, end):
+            hours[t - t % 3600][kind] += n
+            teams[s.team][kind] += n
+
+    by_hour: List[Dict[str, Any]] = []
+    hot: List[Dict[str, Any]] = []
+    for hour in sorted(hours):
+        counts = hours[hour]
+        entry: Dict[str, Any] = {
+            "hour": datetime.fromtimestamp(hour, timezone.utc).isoformat(),
+            **{kind: counts[kind] for kind in KINDS},
+            "total": sum(counts.values()),
+        }
+        by_hour.append(entry)
+        reasons: List[str] = []
+        if counts["create"] > creation_limit:
+            reasons.append(f"{counts['create']} creations > {creation_limit}")
+        if entry["total"] > call_limit:
+            reasons.append(f"{entry['total']} calls > {call_limit}")
+        if reasons:
+            hot.append({**entry, "reasons": reasons})
+
+    by_time: DefaultDict[int, List[Schedule]] = defaultdict(list)
+    for s in schedules:
+        by_time[s.scheduleTime].append(s)
+    shared = [
+        {
+            "scheduleTime": f"{time // 60:02}:{time % 60:02}",
+            "schedules": len(group),
+            "teams": sorted(set(s.team for s in group)),
+        }
+        for time, group in sorted(by_time.items(), key=lambda x: -len(x[1]))
+        if len(group) >= SHARED_TIME_MIN_SCHEDULES
+    ]
+
+    totals: Counter[str] = Counter()
+    for counts in teams.values():
+        totals.update(counts)
+    return {
+        "start": datetime.fromtimestamp(start, timezone.utc).isoformat(),
+        "end": datetime.fromtimestamp(end, timezone.utc).isoformat(),
+        "creationLimitPerHour": creation_limit,
+        "callLimitPerHour": call_limit,
+        "totals": {kind: totals[kind] for kind in KINDS},
+        "byTeam": {
+            team: {kind: counts[kind] for kind in KINDS}
+            for team, counts in sorted(teams.items())
+        },
+        "hotHours": hot,
+        "sharedScheduleTimes": shared,
+        "hours": by_hour,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--db", default=db.DATABASE)
+    parser.add_argument("--days", type=float, default=7)
+    parser.add_argument(
+        "--start",
+        type=lambda s: datetime.fromisoformat(s).replace(tzinfo=timezone.utc),
+        default=None,
+        help="UTC start date (YYYY-MM-DD), defaults to now",
+    )
+    parser.add_argument("--creation-limit", type=int, default=planner.BUDGET_PER_HOUR)
+    parser.add_argument("--call-limit", type=int, default=CALL_LIMIT_PER_HOUR)
+    args = parser.parse_args()
+
+    db.DATABASE = args.db
+    with Db() as d:
+        schedules: List[Schedule] = list(d.schedules())
+    start = args.start or datetime.now(timezone.utc)
+    print(
+        json.dumps(
+            report(
+                schedules,
+                int(start.timestamp()),
+                args.days,
+                args.creation_limit,
+                args.call_limit,
+            ),
+            indent=2,
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,44 @@
+from __future__ import annotations
+
+import time as _time
+from datetime import datetime
+
+
+class Clock:
+    def time(self) -> float:
+        return _time.time()
+
+    def sleep(self, secs: float) -> None:
+        _time.sleep(secs)
+
+
+class FakeClock(Clock):
+    """Clock for offline simulations. Sleeping advances the time instantly."""
+
+    def __init__(self, now: float) -> None:
+        self.now = now
+
+    def time(self) -> float:
+        return self.now
+
+    def sleep(self, secs: float) -> None:
+        self.now += secs
+
+    def advance(self, secs: float) -> None:
+        self.now += secs
+
+
+# replaced with a FakeClock by simulations
+current: Clock = Clock()
+
+
+def time() -> float:
+    return current.time()
+
+
+def sleep(secs: float) -> None:
+    current.sleep(secs)
+
+
+def utcnow() -> datetime:
+    return datetime.utcfromtimestamp(current.time())
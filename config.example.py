@@ -1,6 +1,24 @@
 HOST = "https://lichess.org"
 LICHESS_API_KEY = ""
 ADMINS = ["lichess"]
+# if set, /metrics requires "Authorization: Bearer <METRICS_TOKEN>"
+METRICS_TOKEN = ""
+# tournament creation budget of the scheduler: burst size and refill rate
+BUDGET_CAPACITY = 100
+BUDGET_PER_HOUR = 200
+# set to False when the scheduler runs elsewhere, e.g. via `python -m scheduler`
+START_SCHEDULER = True
+# send the team messages due within this many secs of each other as one
+# message, 0 sends each separately
+MSG_COLLATE_SECS = 0
+# run the scheduler on every process for a share of the teams instead of on
+# one process holding the lease, see README
+SCHEDULER_SHARDING = False
+# online backups, taken by the process holding the scheduler lease
+BACKUP_DIR = ""
+BACKUP_INTERVAL_SECS = 6 * 60 * 60
+BACKUP_KEEP = 7
+BACKUP_INTEGRITY_CHECK = True
 TEAMS_WHITELIST = [
     "lichess-antichess",
     "lichess-chess960",
@@ -0,0 +1,81 @@
+from __future__ import annotations
+
+import os
+import sqlite3
+from typing import Iterator
+
+import pytest
+from flask.testing import FlaskClient
+
+import api
+import clock
+import db
+import simulate
+from auth import User
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "tests", "fixtures")
+
+
+def load_fixture(path: str, name: str) -> None:
+    """Creates the database at `path` from tests/fixtures/<name>.sql."""
+    with open(os.path.join(FIXTURES, f"{name}.sql")) as f:
+        script = f.read()
+    conn = sqlite3.connect(path)
+    try:
+        conn.executescript(script)
+    finally:
+        conn.close()
+
+
+@pytest.fixture
+def database(tmp_path: str) -> Iterator[str]:
+    """Points db.DATABASE at an empty file in a temporary directory."""
+    old = db.DATABASE
+    db.DATABASE = os.path.join(tmp_path, "database.sqlite")
+    try:
+        yield db.DATABASE
+    finally:
+        db.DATABASE = old
+
+
+@pytest.fixture
+def config(database: str, tmp_path: str, monkeypatch: pytest.MonkeyPatch) -> str:
+    """Path of a config.py for `database` that doesn't start the scheduler."""
+    # create_app points api.HOST at the config, keep a started fake_lichess
+    monkeypatch.setattr(api, "HOST", api.HOST)
+    path = os.path.join(tmp_path, "config.py")
+    with open(path, "w") as f:
+        f.write(f"""HOST = {api.HOST!r}
+LICHESS_API_KEY = ""
+ADMINS = ["admin"]
+TEAMS_WHITELIST = ["lichess-chess960", "lichess-atomic"]
+DATABASE = {database!r}
+START_SCHEDULER = False
+""")
+    return path
+
+
+@pytest.fixture
+def client(config: str, monkeypatch: pytest.MonkeyPatch) -> FlaskClient:
+    """Test client of an app on `database` that authenticates everyone as admin."""
+    import app
+
+    flask_app = app.create_app(config)
+    monkeypatch.setattr(app, "auth", lambda: User(True, [], "token"))
+    return flask_app.test_client()
+
+
+@pytest.fixture
+def fake_clock(monkeypatch: pytest.MonkeyPatch) -> clock.FakeClock:
+    fake = clock.FakeClock(1_800_000_000)
+    monkeypatch.setattr(clock, "current", fake)
+    return fake
+
+
+@pytest.fixture
+def fake_lichess(monkeypatch: pytest.MonkeyPatch) -> simulate.FakeLichess:
+    """The fake Lichess API of api-test-server, served in the background."""
+    fake = simulate.load_fake_lichess()
+    monkeypatch.setattr(api, "HOST", api.HOST)
+    simulate.start_fake_lichess(fake)
+    return fake
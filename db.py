@@ -1,34 +1,287 @@
 from __future__ import annotations
 
 import logging
+import os
+import re
 import sqlite3
-from time import time
-from typing import IO, Any, Dict, List, Optional, Set, Tuple
+from collections import defaultdict
+from concurrent.futures import Future
+from operator import attrgetter
+from queue import Empty, Queue
+from threading import Lock, Thread
+from time import monotonic
+from typing import (
+    IO,
+    Any,
+    Callable,
+    DefaultDict,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Set,
+    Tuple,
+    TypeVar,
+    cast,
+)
 
-from flask import Flask
-
-from model import CreatedArena, MsgToSend, Schedule, ScheduleWithId
+import clock
+import metrics
+from model import (
+    EVENT_CREATED,
+    EVENT_DELETED,
+    EVENT_FAILED,
+    EVENT_MSG_DROPPED,
+    EVENT_RETRIED,
+    EVENT_TOKEN_BAD,
+    SCHEDULE_BOOL_FIELDS,
+    SCHEDULE_COLUMNS,
+    SCHEDULE_FIELDS,
+    SCHEDULE_JSON_FIELDS,
+    CreatedArena,
+    MsgToSend,
+    Schedule,
+    ScheduleWithId,
+    SchedulerEvent,
+    extract_team_battle_teams,
+)
 
 DATABASE = "database.sqlite"
-VERSION = 13
+# schema.sql and migrations/ live next to this file
+ROOT = os.path.dirname(os.path.abspath(__file__))
+VERSION = 20
+WRITE_BATCH_SIZE = 100
+BUSY_TIMEOUT_SECS = 30
+TOKEN_STATE_CACHE_SECS = 10
+TOKEN_STATE_CACHE_SIZE = 1000
+PAGE_TEAM_INDEX_MAX_TEAMS = 5
+
+T = TypeVar("T")
+Write = Callable[[sqlite3.Connection], Any]
 
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 
 
+INSERT_SCHEDULE = f"""INSERT INTO schedules ({", ".join(SCHEDULE_FIELDS)})
+    VALUES ({", ".join("?" * len(SCHEDULE_FIELDS))})
+"""
+# team can't be changed
+UPDATE_SCHEDULE = f"""UPDATE schedules
+    SET {", ".join(f"{name} = ?" for name in SCHEDULE_FIELDS if name != "team")}
+    WHERE id = ? and team = ?
+"""
+SELECT_SCHEDULES = f"SELECT {', '.join(SCHEDULE_COLUMNS)} FROM schedules"
+
+schedule_values: Callable[[Schedule], Tuple[Any, ...]] = attrgetter(*SCHEDULE_FIELDS)
+update_values: Callable[[ScheduleWithId], Tuple[Any, ...]] = attrgetter(
+    *(name for name in SCHEDULE_FIELDS if name != "team"), "id", "team"
+)
+
+
+def schedule_row(cursor: sqlite3.Cursor, row: Tuple[Any, ...]) -> ScheduleWithId:
+    return ScheduleWithId.from_values(row)
+
+
+def write_battle_teams(conn: sqlite3.Connection, schedule_id: int, s: Schedule) -> None:
+    insert_battle_teams(
+        conn,
+        schedule_id,
+        s.battle_team_ids(),
+        s.alternative_battle_team_ids() if s.teamBattleAlternativeTeamsEnabled else [],
+    )
+
+
+def insert_battle_teams(
+    conn: sqlite3.Connection,
+    schedule_id: int,
+    teams: List[str],
+    alternative_teams: List[str],
+) -> None:
+    conn.execute("DELETE FROM scheduleBattleTeams WHERE scheduleId = ?", (schedule_id,))
+    rows = [(schedule_id, False, i, t) for i, t in enumerate(teams)]
+    rows.extend((schedule_id, True, i, t) for i, t in enumerate(alternative_teams))
+    conn.executemany(
+        "INSERT INTO scheduleBattleTeams (scheduleId, alternative, position, teamId) VALUES (?, ?, ?, ?)",
+        rows,
+    )
+
+
+def backfill_battle_teams(conn: sqlite3.Connection) -> None:
+    # only reads columns that exist at version 15, later migrations add more
+    rows = conn.execute(
+        """SELECT id, teamBattleTeams, teamBattleAlternativeTeamsEnabled, teamBattleAlternativeTeams
+            FROM schedules WHERE teamBattleTeams IS NOT NULL"""
+    ).fetchall()
+    for id, teams, alternative_enabled, alternative_teams in rows:
+        insert_battle_teams(
+            conn,
+            id,
+            extract_team_battle_teams(teams),
+            extract_team_battle_teams(alternative_teams) if alternative_enabled else [],
+        )
+
+
+def journal(
+    conn: sqlite3.Connection,
+    kind: str,
+    team: str,
+    schedule_id: Optional[int] = None,
+    arena_id: Optional[str] = None,
+    at: Optional[int] = None,
+    detail: Optional[str] = None,
+) -> None:
+    """Appends to schedulerEvents in the transaction of the write it records."""
+    conn.execute(
+        "INSERT INTO schedulerEvents (time, kind, team, scheduleId, arenaId, at, detail) VALUES (?, ?, ?, ?, ?, ?, ?)",
+        (int(clock.time()), kind, team, schedule_id, arena_id, at, detail),
+    )
+
+
+def write_update_created(conn: sqlite3.Connection, arena: CreatedArena) -> None:
+    conn.execute(
+        "UPDATE createdArenas SET time = ? WHERE id = ?", (arena.time, arena.id)
+    )
+
+
+def write_delete_created(conn: sqlite3.Connection, id: str) -> None:
+    conn.execute(
+        """INSERT INTO schedulerEvents (time, kind, team, scheduleId, arenaId, at)
+            SELECT ?, ?, team, scheduleId, id, time FROM createdArenas WHERE id = ?""",
+        (int(clock.time()), EVENT_DELETED, id),
+    )
+    conn.execute("DELETE FROM createdArenas WHERE id = ?", (id,))
+    conn.execute("DELETE FROM scheduledMsgs WHERE arenaId = ?", (id,))
+
+
+def write_scheduled_msg(
+    conn: sqlite3.Connection,
+    arena: CreatedArena,
+    minsBefore: Optional[int],
+    template: Optional[str],
+) -> None:
+    conn.execute("DELETE FROM scheduledMsgs WHERE arenaId = ?", (arena.id,))
+    if minsBefore and minsBefore > 0 and template:
+        conn.execute(
+            """INSERT INTO scheduledMsgs (arenaId, scheduleId, team, template, minutesBefore, sendTime)
+                VALUES (?, ?, ?, ?, ?, ?)
+            """,
+            (
+                arena.id,
+                arena.scheduleId,
+                arena.team,
+                template,
+                minsBefore,
+                arena.time - minsBefore * 60,
+            ),
+        )
+
+
+# Python steps run in the same transaction after migrations/<version>.sql
+POST_MIGRATIONS: Dict[int, Callable[[sqlite3.Connection], None]] = {
+    15: backfill_battle_teams,
+}
+
+
+class DbWriter(Thread):
+    """
+    Owns the only writing connection of the process. Writes from all threads are
+    queued and committed together in one transaction, each in its own savepoint
+    so that a failing write doesn't affect the others.
+    """
+
+    def __init__(self, path: str) -> None:
+        super().__init__(daemon=True)
+        self.path = path
+        self.queue: Queue[Tuple[Write, Future[Any]]] = Queue()
+        # incremented after each commit, lets readers invalidate caches
+        self.generation = 0
+
+    def submit(self, write: Write) -> Future[Any]:
+        future: Future[Any] = Future()
+        self.queue.put((write, future))
+        return future
+
+    def run(self) -> None:
+        conn = sqlite3.connect(
+            self.path, timeout=BUSY_TIMEOUT_SECS, isolation_level=None
+        )
+        conn.row_factory = sqlite3.Row
+        while True:
+            batch = [self.queue.get()]
+            while len(batch) < WRITE_BATCH_SIZE:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except Empty:
+                    break
+            self.commit(conn, batch)
+
+    def commit(
+        self, conn: sqlite3.Connection, batch: List[Tuple[Write, Future[Any]]]
+    ) -> None:
+        results: List[Tuple[Future[Any], Any, Optional[Exception]]] = []
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            for write, future in batch:
+                conn.execute("SAVEPOINT write")
+                try:
+                    results.append((future, write(conn), None))
+                except Exception as e:
+                    conn.execute("ROLLBACK TO write")
+                    results.append((future, None, e))
+                conn.execute("RELEASE write")
+            conn.execute("COMMIT")
+            self.generation += 1
+        except Exception as e:
+            logger.error(f"Failed to commit writes: {e}", exc_info=True)
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            for _, future in batch:
+                future.set_exception(e)
+            return
+        for future, result, error in results:
+            if error is None:
+                future.set_result(result)
+            else:
+                future.set_exception(error)
+
+
+writers: Dict[str, DbWriter] = {}
+writers_lock = Lock()
+
+# team list -> (writer generation, expiry, states)
+token_state_cache: Dict[
+    Tuple[str, ...], Tuple[int, float, Dict[str, Dict[str, Any]]]
+] = {}
+token_state_lock = Lock()
+
+
+def writer() -> DbWriter:
+    with writers_lock:
+        w = writers.get(DATABASE)
+        if w is None:
+            w = writers[DATABASE] = DbWriter(DATABASE)
+            w.start()
+        return w
+
+
 class Db:
-    def create_tables(self, app: Flask) -> None:
+    def create_tables(self) -> None:
         sqlite_schema = (
             "sqlite_schema"
             if sqlite3.sqlite_version_info >= (3, 33, 0)
             else "sqlite_master"
         )
+        # lets readers proceed while the writer thread commits
+        self.db.execute("PRAGMA journal_mode = WAL")
+
         if not self._query(f"SELECT * FROM {sqlite_schema}"):
             logger.info("No tables. Initializing database schema.")
             with self.db as trans:
                 f: IO[str]
-                with app.open_resource("schema.sql", mode="r") as f:
+                with open(os.path.join(ROOT, "schema.sql")) as f:
                     trans.executescript("BEGIN;" + f.read())
                 trans.execute(f"PRAGMA user_version = {VERSION}")
             return
@@ -48,8 +301,10 @@ class Db:
             version += 1
             logger.info(f"Migrating to {version}")
             with self.db as trans:
-                with app.open_resource(f"migrations/{version}.sql", mode="r") as f:
+                with open(os.path.join(ROOT, "migrations", f"{version}.sql")) as f:
                     trans.executescript("BEGIN;" + f.read())
+                if version in POST_MIGRATIONS:
+                    POST_MIGRATIONS[version](trans)
                 trans.execute(f"PRAGMA user_version = {version}")
 
     def _version(self) -> int:
@@ -59,15 +314,16 @@ class Db:
         return int(version[0])
 
     def __enter__(self) -> Db:
-        self.db = sqlite3.connect(DATABASE)
+        self.db = sqlite3.connect(DATABASE, timeout=BUSY_TIMEOUT_SECS)
         self.db.row_factory = sqlite3.Row
         return self
 
     def __exit__(self, exc_type: Any, exc_value: Any, exc_traceback: Any) -> None:
         self.db.close()
 
-    def _begin(self) -> None:
-        self.db.execute("BEGIN")
+    def _write(self, write: Callable[[sqlite3.Connection], T]) -> T:
+        """Runs `write` on the writer thread and waits until it is committed."""
+        return writer().submit(write).result()
 
     def _query(self, query: str, args: Tuple[Any, ...] = ()) -> List[sqlite3.Row]:
         return self.db.execute(query, args).fetchall()
@@ -78,10 +334,11 @@ class Db:
         result = self._query(query, args)
         return result[0] if result else None
 
+    @metrics.DB_QUERY.timed
     def insert_created(
         self, id: str, schedule_id: int, team: str, t: int, error: Optional[str] = None
     ) -> None:
-        with self.db as conn:
+        def write(conn: sqlite3.Connection) -> None:
             conn.execute(
                 """INSERT INTO createdArenas (
                     id,
@@ -93,20 +350,68 @@ class Db:
                 """,
                 (id, schedule_id, team, t, error),
             )
+            if error is not None:
+                kind = EVENT_FAILED
+            elif conn.execute(
+                "SELECT 1 FROM schedulerEvents WHERE scheduleId = ? AND at = ? AND kind = ?",
+                (schedule_id, t, EVENT_FAILED),
+            ).fetchone():
+                kind = EVENT_RETRIED
+            else:
+                kind = EVENT_CREATED
+            journal(conn, kind, team, schedule_id, id, t, error)
+
+        self._write(write)
+
+    @metrics.DB_QUERY.timed
+    def insert_failed_attempt(
+        self, schedule_id: int, team: str, t: int, error: str
+    ) -> None:
+        """
+        Journals a failed creation that leaves the occurrence pending, like a
+        rate-limited one. Creating it later then journals EVENT_RETRIED.
+        """
 
+        def write(conn: sqlite3.Connection) -> None:
+            journal(conn, EVENT_FAILED, team, schedule_id, at=t, detail=error)
+
+        self._write(write)
+
+    @metrics.DB_QUERY.timed
     def update_created(self, arena: CreatedArena) -> None:
-        with self.db as conn:
-            conn.execute(
-                "UPDATE createdArenas SET time = ? WHERE id = ?",
-                (arena.time, arena.id),
-            )
+        self._write(lambda conn: write_update_created(conn, arena))
 
+    @metrics.DB_QUERY.timed
     def delete_created(self, id: str) -> None:
-        with self.db as conn:
-            self._begin()
-            conn.execute("DELETE FROM createdArenas WHERE id = ?", (id,))
-            conn.execute("DELETE FROM scheduledMsgs WHERE arenaId = ?", (id,))
+        self._write(lambda conn: write_delete_created(conn, id))
+
+    @metrics.DB_QUERY.timed
+    def apply_arena_changes(
+        self,
+        deleted: List[str],
+        moved: List[CreatedArena],
+        msgs: List[Tuple[CreatedArena, Optional[int], Optional[str]]],
+    ) -> None:
+        """
+        Deletes, moves (along with their team messages) and sets the messages
+        of created arenas in one transaction.
+        """
+
+        def write(conn: sqlite3.Connection) -> None:
+            for id in deleted:
+                write_delete_created(conn, id)
+            for arena in moved:
+                write_update_created(conn, arena)
+                conn.execute(
+                    "UPDATE scheduledMsgs SET sendTime = ? - minutesBefore * 60 WHERE arenaId = ?",
+                    (arena.time, arena.id),
+                )
+            for arena, minsBefore, template in msgs:
+                write_scheduled_msg(conn, arena, minsBefore, template)
+
+        self._write(write)
 
+    @metrics.DB_QUERY.timed
     def created(self, id: str) -> Optional[CreatedArena]:
         row = self._query_one(
             "SELECT id, scheduleId, team, time FROM createdArenas WHERE id = ? AND error IS NULL",
@@ -116,26 +421,94 @@ class Db:
             return CreatedArena.from_row(row)
         return None
 
+    @metrics.DB_QUERY.timed
+    def created_upcoming_by_ids(self, ids: List[str]) -> List[CreatedArena]:
+        rows = self._query(
+            f"""SELECT id, scheduleId, team, time FROM createdArenas
+                WHERE id IN ({', '.join('?' * len(ids))}) AND time > ? AND error IS NULL
+                ORDER BY time""",
+            (*ids, int(clock.time())),
+        )
+        return [CreatedArena.from_row(row) for row in rows]
+
+    @metrics.DB_QUERY.timed
+    def created_upcoming_of_schedule(
+        self, schedule_id: int, start: int, end: int
+    ) -> List[CreatedArena]:
+        """Upcoming arenas of a schedule starting from `start` up to `end`."""
+        rows = self._query(
+            """SELECT id, scheduleId, team, time FROM createdArenas
+                WHERE scheduleId = ? AND time >= ? AND time < ? AND time > ? AND error IS NULL
+                ORDER BY time""",
+            (schedule_id, start, end, int(clock.time())),
+        )
+        return [CreatedArena.from_row(row) for row in rows]
+
+    @metrics.DB_QUERY.timed
     def created_upcoming(self) -> List[Tuple[str, str]]:
         rows = self._query(
             "SELECT id, team FROM createdArenas WHERE time > ? AND error IS NULL",
-            (int(time()),),
+            (int(clock.time()),),
         )
         return [(row["id"], row["team"]) for row in rows]
 
+    @metrics.DB_QUERY.timed
     def created_upcoming_with_schedule(self, schedule_id: int) -> List[Tuple[str, int]]:
         rows = self._query(
             "SELECT id, time FROM createdArenas WHERE scheduleId = ? and time > ? AND error IS NULL ORDER BY time ASC",
-            (schedule_id, int(time())),
+            (schedule_id, int(clock.time())),
         )
         return [(row["id"], row["time"]) for row in rows]
 
+    @metrics.DB_QUERY.timed
+    def created_of_team_since(
+        self, team: str, since: int
+    ) -> List[Tuple[str, int, int, int, bool]]:
+        """
+        (id, scheduleId, time, number of earlier arenas of the schedule, failed)
+        of the arenas of `team` after `since`.
+        """
+        rows = self._query(
+            """SELECT c.id, c.scheduleId, c.time,
+                (SELECT COUNT(*) FROM createdArenas p WHERE p.scheduleId = c.scheduleId AND p.time < c.time),
+                c.error IS NOT NULL
+                FROM createdArenas c WHERE c.team = ? AND c.time > ? ORDER BY c.time""",
+            (team, since),
+        )
+        return [(row[0], row[1], row[2], row[3], bool(row[4])) for row in rows]
+
+    @metrics.DB_QUERY.timed
+    def num_created_by_schedule(self, team: str) -> Dict[int, int]:
+        rows = self._query(
+            "SELECT scheduleId, COUNT(*) FROM createdArenas WHERE team = ? GROUP BY scheduleId",
+            (team,),
+        )
+        return {row[0]: row[1] for row in rows}
+
+    @metrics.DB_QUERY.timed
+    def may_create(
+        self, node: Optional[str], team: str, schedule_id: int, t: int
+    ) -> bool:
+        """
+        Whether the occurrence still has no arena and, with sharding, `team` is
+        still assigned to `node`, checked right before creating it.
+        """
+        result = self._query_one(
+            """SELECT NOT EXISTS (SELECT 1 FROM createdArenas WHERE scheduleId = ? AND time = ?)
+                AND (? IS NULL OR EXISTS (SELECT 1 FROM teamShards WHERE team = ? AND node = ?))""",
+            (schedule_id, t, node, team, node),
+        )
+        return bool(result and result[0])
+
+    @metrics.DB_QUERY.timed
     def created_upcoming_or_failed(self) -> Set[Tuple[int, int]]:
         rows = self._query(
-            "SELECT scheduleId, time FROM createdArenas WHERE time > ?", (int(time()),)
+            "SELECT scheduleId, time FROM createdArenas WHERE time > ?",
+            (int(clock.time()),),
         )
         return set((row["scheduleId"], row["time"]) for row in rows)
 
+    @metrics.DB_QUERY.timed
     def num_created_before(self, schedule_id: int, timestamp: int) -> int:
         result = self._query_one(
             "SELECT COUNT(*) FROM createdArenas WHERE scheduleId = ? AND time < ?",
@@ -145,6 +518,7 @@ class Db:
             return int(result[0])
         return 0
 
+    @metrics.DB_QUERY.timed
     def previous_created(self, schedule_id: int, timestamp: int) -> Optional[str]:
         result = self._query_one(
             "SELECT id FROM createdArenas WHERE scheduleId = ? AND time < ? AND error IS NULL ORDER BY time DESC LIMIT 1",
@@ -152,6 +526,7 @@ class Db:
         )
         return result["id"] if result else None
 
+    @metrics.DB_QUERY.timed
     def previous_two_created(
         self, schedule_id: int, timestamp: int
     ) -> Tuple[Optional[str], Optional[str]]:
@@ -166,149 +541,150 @@ class Db:
             return prevs[0], None
         return prevs[0], prevs[1]
 
-    def schedules(self) -> List[ScheduleWithId]:
+    @metrics.DB_QUERY.timed
+    def schedules(self, node: Optional[str] = None) -> List[ScheduleWithId]:
+        """All schedules, or those of the teams assigned to a scheduler `node`."""
+        where, args = "", cast(Tuple[Any, ...], ())
+        if node is not None:
+            where = " WHERE team IN (SELECT team FROM teamShards WHERE node = ?)"
+            args = (node,)
+        cursor = self.db.cursor()
+        cursor.row_factory = schedule_row  # type: ignore
+        schedules: List[ScheduleWithId] = cursor.execute(
+            SELECT_SCHEDULES + where, args
+        ).fetchall()
+        cursor = self.db.cursor()
+        cursor.row_factory = None
+        battle_teams: DefaultDict[Tuple[int, int], List[str]] = defaultdict(list)
+        for schedule_id, alternative, team_id in cursor.execute(
+            "SELECT scheduleId, alternative, teamId FROM scheduleBattleTeams"
+            + (
+                " WHERE scheduleId IN (SELECT id FROM schedules" + where + ")"
+                if where
+                else ""
+            )
+            + " ORDER BY scheduleId, position",
+            args,
+        ):
+            battle_teams[(schedule_id, alternative)].append(team_id)
+        for s in schedules:
+            s.teamBattleTeamIds = battle_teams.get((s.id, False), [])
+            s.teamBattleAlternativeTeamIds = battle_teams.get((s.id, True), [])
+        return schedules
+
+    @metrics.DB_QUERY.timed
+    def schedules_with_battle_team(self, team: str) -> List[Tuple[int, str, str, bool]]:
+        """(id, team, name, alternative) of schedules with `team` in their battles."""
+        rows = self._query(
+            """SELECT DISTINCT s.id, s.team, s.name, b.alternative
+                FROM scheduleBattleTeams b JOIN schedules s ON s.id = b.scheduleId
+                WHERE b.teamId = ? ORDER BY s.id
+            """,
+            (team,),
+        )
         return [
-            ScheduleWithId.from_row(x) for x in self._query(f"SELECT * FROM schedules")
+            (row["id"], row["team"], row["name"], bool(row["alternative"]))
+            for row in rows
         ]
 
+    def iter_schedules(self, teams: List[str]) -> Iterator[ScheduleWithId]:
+        """Yields the schedules of `teams` straight from the cursor."""
+        placeholders = ", ".join("?" * len(teams))
+        cursor = self.db.cursor()
+        cursor.row_factory = schedule_row  # type: ignore
+        yield from cursor.execute(
+            f"{SELECT_SCHEDULES} WHERE team IN ({placeholders}) ORDER BY id",
+            tuple(teams),
+        )
+
+    @metrics.DB_QUERY.timed
+    def schedules_page(
+        self,
+        teams: List[str],
+        after: int,
+        limit: int,
+        fields: Optional[Sequence[str]] = None,
+        q: Optional[str] = None,
+    ) -> List[Dict[str, Any]]:
+        """
+        JSON of up to `limit` schedules of `teams` with an id above `after`, by
+        id. `fields` limits the selected columns (id and team are always
+        included), `q` matches a substring of the name.
+        """
+        wanted = SCHEDULE_JSON_FIELDS if fields is None else fields
+        columns = [
+            name
+            for name in SCHEDULE_COLUMNS
+            if name in wanted or name in ("id", "team")
+        ]
+        # the team index needs a sort of all schedules of the teams, for many
+        # teams walking the primary key up to `limit` matches is cheaper
+        team = "team" if len(teams) <= PAGE_TEAM_INDEX_MAX_TEAMS else "+team"
+        where = [f"{team} IN ({', '.join('?' * len(teams))})", "id > ?"]
+        args: List[Any] = [*teams, after]
+        if q:
+            where.append("name LIKE ? ESCAPE '\\'")
+            args.append(
+                "%" + re.sub(r"([%_\\])", r"\\\1", q) + "%",
+            )
+        cursor = self.db.cursor()
+        cursor.row_factory = None
+        rows = cursor.execute(
+            f"SELECT {', '.join(columns)} FROM schedules WHERE {' AND '.join(where)} ORDER BY id LIMIT ?",
+            (*args, limit),
+        ).fetchall()
+
+        page = [dict(zip(columns, row)) for row in rows]
+        for j in page:
+            for name in SCHEDULE_BOOL_FIELDS:
+                if j.get(name) is not None:
+                    j[name] = bool(j[name])
+        return page
+
+    @metrics.DB_QUERY.timed
     def team_of_schedule(self, id: int) -> Optional[str]:
         row = self._query_one("SELECT team from schedules WHERE id = ?", (id,))
         if row:
             return str(row["team"])
         return None
 
+    @metrics.DB_QUERY.timed
     def insert_schedule(self, s: Schedule) -> None:
-        with self.db as conn:
-            conn.execute(
-                """INSERT INTO schedules (
-                    name,
-                    team,
-                    clock,
-                    increment,
-                    minutes,
-                    variant,
-                    rated,
-                    position,
-                    berserkable,
-                    streakable,
-                    description,
-                    minRating,
-                    maxRating,
-                    minGames,
-                    minAccountAgeInDays,
-                    allowBots,
-                    scheduleDay,
-                    scheduleTime,
-                    scheduleStart,
-                    scheduleEnd,
-                    teamBattleTeams,
-                    teamBattleAlternativeTeamsEnabled,
-                    teamBattleAlternativeTeams,
-                    teamBattleLeaders,
-                    daysInAdvance,
-                    msgMinutesBefore,
-                    msgTemplate
-                   ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                """,
-                (
-                    s.name,
-                    s.team,
-                    s.clock,
-                    s.increment,
-                    s.minutes,
-                    s.variant,
-                    s.rated,
-                    s.position,
-                    s.berserkable,
-                    s.streakable,
-                    s.description,
-                    s.minRating,
-                    s.maxRating,
-                    s.minGames,
-                    s.minAccountAgeInDays,
-                    s.allowBots,
-                    s.scheduleDay,
-                    s.scheduleTime,
-                    s.scheduleStart,
-                    s.scheduleEnd,
-                    s.teamBattleTeams,
-                    s.teamBattleAlternativeTeamsEnabled,
-                    s.teamBattleAlternativeTeams,
-                    s.teamBattleLeaders,
-                    s.daysInAdvance,
-                    s.msgMinutesBefore,
-                    s.msgTemplate,
-                ),
-            )
+        def write(conn: sqlite3.Connection) -> None:
+            cursor = conn.execute(INSERT_SCHEDULE, schedule_values(s))
+            write_battle_teams(conn, cast(int, cursor.lastrowid), s)
+
+        self._write(write)
+
+    @metrics.DB_QUERY.timed
+    def insert_schedules(self, schedules: List[Schedule]) -> None:
+        """Inserts all schedules in one transaction, or none of them if one fails."""
 
+        def write(conn: sqlite3.Connection) -> None:
+            for s in schedules:
+                cursor = conn.execute(INSERT_SCHEDULE, schedule_values(s))
+                write_battle_teams(conn, cast(int, cursor.lastrowid), s)
+
+        self._write(write)
+
+    @metrics.DB_QUERY.timed
     def update_schedule(self, s: ScheduleWithId) -> None:
-        with self.db as conn:
-            conn.execute(
-                """UPDATE schedules SET
-                    name = ?,
-                    clock = ?,
-                    increment = ?,
-                    minutes = ?,
-                    variant = ?,
-                    rated = ?,
-                    position = ?,
-                    berserkable = ?,
-                    streakable = ?,
-                    description = ?,
-                    minRating = ?,
-                    maxRating = ?,
-                    minGames = ?,
-                    minAccountAgeInDays = ?,
-                    allowBots = ?,
-                    scheduleDay = ?,
-                    scheduleTime = ?,
-                    scheduleStart = ?,
-                    scheduleEnd = ?,
-                    teamBattleTeams = ?,
-                    teamBattleAlternativeTeamsEnabled = ?,
-                    teamBattleAlternativeTeams = ?,
-                    teamBattleLeaders = ?,
-                    daysInAdvance = ?,
-                    msgMinutesBefore = ?,
-                    msgTemplate = ?
-                   WHERE id = ? and team = ?
-                """,
-                (
-                    s.name,
-                    s.clock,
-                    s.increment,
-                    s.minutes,
-                    s.variant,
-                    s.rated,
-                    s.position,
-                    s.berserkable,
-                    s.streakable,
-                    s.description,
-                    s.minRating,
-                    s.maxRating,
-                    s.minGames,
-                    s.minAccountAgeInDays,
-                    s.allowBots,
-                    s.scheduleDay,
-                    s.scheduleTime,
-                    s.scheduleStart,
-                    s.scheduleEnd,
-                    s.teamBattleTeams,
-                    s.teamBattleAlternativeTeamsEnabled,
-                    s.teamBattleAlternativeTeams,
-                    s.teamBattleLeaders,
-                    s.daysInAdvance,
-                    s.msgMinutesBefore,
-                    s.msgTemplate,
-                    s.id,
-                    s.team,
-                ),
-            )
+        def write(conn: sqlite3.Connection) -> None:
+            cursor = conn.execute(UPDATE_SCHEDULE, update_values(s))
+            if cursor.rowcount > 0:
+                write_battle_teams(conn, s.id, s)
+
+        self._write(write)
 
+    @metrics.DB_QUERY.timed
     def delete_schedule(self, id: int) -> None:
-        with self.db as conn:
+        def write(conn: sqlite3.Connection) -> None:
             conn.execute("DELETE FROM schedules WHERE id = ?", (id,))
+            conn.execute("DELETE FROM scheduleBattleTeams WHERE scheduleId = ?", (id,))
 
+        self._write(write)
+
+    @metrics.DB_QUERY.timed
     def insert_scheduled_msg(
         self,
         arenaId: str,
@@ -318,29 +694,82 @@ class Db:
         minutesBefore: int,
         sendTime: int,
     ) -> None:
-        with self.db as conn:
+        def write(conn: sqlite3.Connection) -> None:
             conn.execute(
                 "INSERT INTO scheduledMsgs (arenaId, scheduleId, team, template, minutesBefore, sendTime) VALUES (?, ?, ?, ?, ?, ?)",
                 (arenaId, scheduleId, team, template, minutesBefore, sendTime),
             )
 
-    def get_and_remove_scheduled_msgs(self) -> List[MsgToSend]:
-        now = int(time())
-        rows = self._query(
-            "SELECT arenaId, team, template, sendTime FROM scheduledMsgs WHERE sendTime < ? AND sendTime > ?",
-            (now, now - 30 * 60),
-        )
-        msgs = [
-            MsgToSend(row["arenaId"], row["team"], row["template"], row["sendTime"])
-            for row in rows
-        ]
-        with self.db as conn:
-            conn.execute("DELETE FROM scheduledMsgs WHERE sendTime < ?", (now,))
-        return msgs
+        self._write(write)
 
+    @metrics.DB_QUERY.timed
+    def num_scheduled_msgs(self) -> int:
+        result = self._query_one("SELECT COUNT(*) FROM scheduledMsgs")
+        if result:
+            return int(result[0])
+        return 0
+
+    @metrics.DB_QUERY.timed
+    def get_and_remove_scheduled_msgs(
+        self, node: Optional[str] = None, collate_secs: int = 0
+    ) -> List[MsgToSend]:
+        """
+        Due messages, or those of the teams assigned to a scheduler `node`. With
+        `collate_secs`, the messages of a team with a due message that are due
+        within that many secs are taken along, to be sent together.
+        """
+        now = int(clock.time())
+        where = ""
+        shard: Tuple[Any, ...] = ()
+        if node is not None:
+            where = " AND team IN (SELECT team FROM teamShards WHERE node = ?)"
+            shard = (node,)
+
+        def write(conn: sqlite3.Connection) -> List[MsgToSend]:
+            rows = conn.execute(
+                "SELECT arenaId, team, template, sendTime FROM scheduledMsgs WHERE sendTime < ? AND sendTime > ?"
+                + where,
+                (now, now - 30 * 60, *shard),
+            ).fetchall()
+            teams = sorted(set(row["team"] for row in rows))
+            if collate_secs > 0 and teams:
+                in_teams = f"team IN ({', '.join('?' * len(teams))})"
+                rows.extend(
+                    conn.execute(
+                        f"SELECT arenaId, team, template, sendTime FROM scheduledMsgs WHERE sendTime >= ? AND sendTime < ? AND {in_teams}",
+                        (now, now + collate_secs, *teams),
+                    ).fetchall()
+                )
+                conn.execute(
+                    f"DELETE FROM scheduledMsgs WHERE sendTime >= ? AND sendTime < ? AND {in_teams}",
+                    (now, now + collate_secs, *teams),
+                )
+            for row in conn.execute(
+                "SELECT arenaId, scheduleId, team, sendTime FROM scheduledMsgs WHERE sendTime <= ?"
+                + where,
+                (now - 30 * 60, *shard),
+            ).fetchall():
+                journal(
+                    conn,
+                    EVENT_MSG_DROPPED,
+                    row["team"],
+                    row["scheduleId"],
+                    row["arenaId"],
+                    detail="expired",
+                )
+            conn.execute(
+                "DELETE FROM scheduledMsgs WHERE sendTime < ?" + where, (now, *shard)
+            )
+            return [
+                MsgToSend(row["arenaId"], row["team"], row["template"], row["sendTime"])
+                for row in rows
+            ]
+
+        return self._write(write)
+
+    @metrics.DB_QUERY.timed
     def update_scheduled_msgs(self, schedule: ScheduleWithId) -> None:
-        with self.db as conn:
-            self._begin()
+        def write(conn: sqlite3.Connection) -> None:
             conn.execute(
                 "DELETE FROM scheduledMsgs WHERE scheduleId = ?", (schedule.id,)
             )
@@ -359,34 +788,22 @@ class Db:
                         schedule.msgMinutesBefore * 60,
                         schedule.id,
                         schedule.msgMinutesBefore * 60,
-                        int(time()),
+                        int(clock.time()),
                     ),
                 )
 
+        self._write(write)
+
+    @metrics.DB_QUERY.timed
     def update_scheduled_msg(
         self,
         arena: CreatedArena,
         minsBefore: Optional[int],
         template: Optional[str],
     ) -> None:
-        with self.db as conn:
-            self._begin()
-            conn.execute("DELETE FROM scheduledMsgs WHERE arenaId = ?", (arena.id,))
-            if minsBefore and minsBefore > 0 and template:
-                conn.execute(
-                    """INSERT INTO scheduledMsgs (arenaId, scheduleId, team, template, minutesBefore, sendTime)
-                        VALUES (?, ?, ?, ?, ?, ?)
-                    """,
-                    (
-                        arena.id,
-                        arena.scheduleId,
-                        arena.team,
-                        template,
-                        minsBefore,
-                        arena.time - minsBefore * 60,
-                    ),
-                )
+        self._write(lambda conn: write_scheduled_msg(conn, arena, minsBefore, template))
 
+    @metrics.DB_QUERY.timed
     def scheduled_msg(self, arenaId: str) -> Optional[Tuple[int, str, str]]:
         row = self._query_one(
             "SELECT minutesBefore, template, team FROM scheduledMsgs WHERE arenaId = ?",
@@ -396,13 +813,17 @@ class Db:
             return (row["minutesBefore"], row["template"], row["team"])
         return None
 
+    @metrics.DB_QUERY.timed
     def set_token_for_team(self, team: str, token: str, user: str) -> None:
-        with self.db as conn:
+        def write(conn: sqlite3.Connection) -> None:
             conn.execute(
                 "REPLACE INTO msgTokens (token, team, user, isBad, temporary) VALUES (?, ?, ?, false, false)",
                 (token, team, user),
             )
 
+        self._write(write)
+
+    @metrics.DB_QUERY.timed
     def token_for_team(self, team: str) -> Optional[str]:
         row = self._query_one(
             "SELECT token FROM msgTokens WHERE team = ? AND NOT isBad", (team,)
@@ -411,46 +832,129 @@ class Db:
             return str(row["token"])
         return None
 
+    @metrics.DB_QUERY.timed
     def mark_bad_token(self, team: str, token: str) -> None:
-        with self.db as conn:
+        def write(conn: sqlite3.Connection) -> None:
             conn.execute(
                 "UPDATE msgTokens SET isBad = true WHERE token = ? AND team = ?",
                 (token, team),
             )
+            journal(conn, EVENT_TOKEN_BAD, team)
 
-    def token_state(self, team: str) -> Dict[str, Any]:
-        row = self._query_one(
-            "SELECT user, isBad, temporary FROM msgTokens WHERE team = ?", (team,)
-        )
+        self._write(write)
 
-        if not row:
-            if self.team_needs_token(team):
-                return {"issue": "missing"}
-            return {}
-        elif row["isBad"]:
-            return {"issue": "bad"}
-        elif row["temporary"]:
-            return {"issue": "temporary"}
+    @metrics.DB_QUERY.timed
+    def insert_event(
+        self,
+        kind: str,
+        team: str,
+        arena_id: Optional[str] = None,
+        detail: Optional[str] = None,
+    ) -> None:
+        """Journals an outcome that doesn't change any other table."""
 
-        return {"user": row["user"]}
+        def write(conn: sqlite3.Connection) -> None:
+            journal(conn, kind, team, arena_id=arena_id, detail=detail)
 
-    def team_needs_token(self, team: str) -> bool:
-        result = self._query_one(
-            "SELECT COUNT(*) FROM scheduledMsgs WHERE team = ?",
-            (team,),
-        )
-        if result and int(result[0]) > 0:
-            return True
+        self._write(write)
 
-        result = self._query_one(
-            "SELECT COUNT(*) FROM schedules WHERE team = ? AND msgMinutesBefore IS NOT NULL AND msgMinutesBefore > 0 AND msgTemplate IS NOT NULL",
-            (team,),
+    @metrics.DB_QUERY.timed
+    def events(
+        self,
+        team: Optional[str],
+        kind: Optional[str],
+        before: Optional[int],
+        limit: int,
+    ) -> List[SchedulerEvent]:
+        """The latest events, optionally of a team or kind, before the id `before`."""
+        conditions: List[str] = []
+        args: List[Any] = []
+        for condition, arg in (
+            ("team = ?", team),
+            ("kind = ?", kind),
+            ("id < ?", before),
+        ):
+            if arg is not None:
+                conditions.append(condition)
+                args.append(arg)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        rows = self._query(
+            f"SELECT * FROM schedulerEvents {where} ORDER BY id DESC LIMIT ?",
+            (*args, limit),
         )
-        if result and int(result[0]) > 0:
-            return True
+        return [SchedulerEvent.from_row(row) for row in rows]
+
+    def iter_events(self, team: Optional[str] = None) -> Iterator[SchedulerEvent]:
+        """All events in the order they happened, straight from the cursor."""
+        cursor = self.db.cursor()
+        if team is None:
+            cursor.execute("SELECT * FROM schedulerEvents ORDER BY id")
+        else:
+            cursor.execute(
+                "SELECT * FROM schedulerEvents WHERE team = ? ORDER BY id", (team,)
+            )
+        for row in cursor:
+            yield SchedulerEvent.from_row(row)
+
+    def token_state(self, team: str) -> Dict[str, Any]:
+        return self.token_states([team])[team]
+
+    @metrics.DB_QUERY.timed
+    def token_states(self, teams: List[str]) -> Dict[str, Dict[str, Any]]:
+        """
+        Message token state of each team, cached until the next write of this
+        process or for TOKEN_STATE_CACHE_SECS (writes of other processes).
+        """
+        key = tuple(teams)
+        generation = writer().generation
+        now = monotonic()
+        with token_state_lock:
+            cached = token_state_cache.get(key)
+            if cached and cached[0] == generation and cached[1] > now:
+                return cached[2]
+
+        states: Dict[str, Dict[str, Any]] = {}
+        if teams:
+            values = ", ".join(["(?)"] * len(teams))
+            rows = self._query(
+                f"""WITH requested (team) AS (VALUES {values})
+                    SELECT
+                        r.team,
+                        t.user,
+                        t.isBad,
+                        t.temporary,
+                        EXISTS (SELECT 1 FROM scheduledMsgs m WHERE m.team = r.team)
+                            OR EXISTS (
+                                SELECT 1 FROM schedules s
+                                WHERE s.team = r.team AND s.msgMinutesBefore > 0 AND s.msgTemplate IS NOT NULL
+                            ) AS needsToken
+                    FROM requested r LEFT JOIN msgTokens t ON t.team = r.team
+                """,
+                key,
+            )
+            for row in rows:
+                if row["user"] is None:
+                    states[row["team"]] = (
+                        {"issue": "missing"} if row["needsToken"] else {}
+                    )
+                elif row["isBad"]:
+                    states[row["team"]] = {"issue": "bad"}
+                elif row["temporary"]:
+                    states[row["team"]] = {"issue": "temporary"}
+                else:
+                    states[row["team"]] = {"user": row["user"]}
 
-        return False
+        with token_state_lock:
+            if len(token_state_cache) >= TOKEN_STATE_CACHE_SIZE:
+                token_state_cache.clear()
+            token_state_cache[key] = (
+                generation,
+                now + TOKEN_STATE_CACHE_SECS,
+                states,
+            )
+        return states
 
+    @metrics.DB_QUERY.timed
     def token_user(self, team: str) -> Optional[str]:
         row = self._query_one(
             "SELECT user, isBad FROM msgTokens WHERE team = ?", (team,)
@@ -460,3 +964,105 @@ class Db:
             return str(row["user"])
 
         return None
+
+    @metrics.DB_QUERY.timed
+    def acquire_lease(self, holder: str, secs: int) -> bool:
+        now = int(clock.time())
+
+        def write(conn: sqlite3.Connection) -> bool:
+            cursor = conn.execute(
+                """INSERT INTO schedulerLease (id, holder, expires) VALUES (0, ?, ?)
+                    ON CONFLICT (id) DO UPDATE SET holder = excluded.holder, expires = excluded.expires
+                    WHERE holder = excluded.holder OR expires < ?
+                """,
+                (holder, now + secs, now),
+            )
+            return cursor.rowcount > 0
+
+        return self._write(write)
+
+    @metrics.DB_QUERY.timed
+    def release_lease(self, holder: str) -> None:
+        def write(conn: sqlite3.Connection) -> None:
+            conn.execute("DELETE FROM schedulerLease WHERE holder = ?", (holder,))
+
+        self._write(write)
+
+    @metrics.DB_QUERY.timed
+    def heartbeat_node(self, node: str, secs: int) -> List[str]:
+        """Registers `node` until `secs` from now. Returns the live nodes, sorted."""
+        now = int(clock.time())
+
+        def write(conn: sqlite3.Connection) -> List[str]:
+            conn.execute(
+                """INSERT INTO schedulerNodes (id, expires) VALUES (?, ?)
+                    ON CONFLICT (id) DO UPDATE SET expires = excluded.expires
+                """,
+                (node, now + secs),
+            )
+            conn.execute("DELETE FROM schedulerNodes WHERE expires < ?", (now,))
+            return [
+                row[0]
+                for row in conn.execute("SELECT id FROM schedulerNodes ORDER BY id")
+            ]
+
+        return self._write(write)
+
+    @metrics.DB_QUERY.timed
+    def live_nodes(self) -> List[str]:
+        """Scheduler nodes with an unexpired heartbeat, sorted."""
+        rows = self._query(
+            "SELECT id FROM schedulerNodes WHERE expires >= ? ORDER BY id",
+            (int(clock.time()),),
+        )
+        return [row[0] for row in rows]
+
+    @metrics.DB_QUERY.timed
+    def leave_node(self, node: str) -> None:
+        def write(conn: sqlite3.Connection) -> None:
+            conn.execute("DELETE FROM schedulerNodes WHERE id = ?", (node,))
+
+        self._write(write)
+
+    @metrics.DB_QUERY.timed
+    def sharded_teams(self) -> List[str]:
+        """Teams with schedules or pending messages, which need a scheduler node."""
+        rows = self._query(
+            "SELECT team FROM schedules UNION SELECT team FROM scheduledMsgs"
+        )
+        return [row[0] for row in rows]
+
+    @metrics.DB_QUERY.timed
+    def assign_shards(self, assignment: Dict[str, str]) -> int:
+        """Records the node of each team. Returns the number of teams that moved."""
+        now = int(clock.time())
+
+        def write(conn: sqlite3.Connection) -> int:
+            before = conn.total_changes
+            conn.executemany(
+                """INSERT INTO teamShards (team, node, assigned) VALUES (?, ?, ?)
+                    ON CONFLICT (team) DO UPDATE SET node = excluded.node, assigned = excluded.assigned
+                    WHERE node != excluded.node
+                """,
+                ((team, node, now) for team, node in assignment.items()),
+            )
+            moved = conn.total_changes - before
+            conn.execute("""DELETE FROM teamShards WHERE team NOT IN
+                    (SELECT team FROM schedules UNION SELECT team FROM scheduledMsgs)
+                """)
+            return moved
+
+        return self._write(write)
+
+    @metrics.DB_QUERY.timed
+    def shards(self) -> List[Tuple[str, str, int]]:
+        """(team, node, assigned) of all teams."""
+        rows = self._query("SELECT team, node, assigned FROM teamShards ORDER BY team")
+        return [(row[0], row[1], row[2]) for row in rows]
+
+    @metrics.DB_QUERY.timed
+    def num_teams_of_node(self, node: str) -> int:
+        result = self._query_one(
+            "SELECT COUNT(*) FROM teamShards WHERE node = ?", (node,)
+        )
+        return int(result[0]) if result else 0
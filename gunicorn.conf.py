@@ -0,0 +1,18 @@
+"""
+gunicorn settings: `gunicorn --config gunicorn.conf.py`
+
+The app is created once in the master, and each worker starts its own
+scheduler threads after the fork (threads don't survive a fork).
+"""
+
+from typing import Any
+
+import app
+
+wsgi_app = "app:create_app(start=False)"
+preload_app = True
+
+
+def post_fork(server: Any, worker: Any) -> None:
+    if app.settings.start_scheduler:
+        app.start_background()
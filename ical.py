@@ -0,0 +1,135 @@
+from __future__ import annotations
+
+import hashlib
+from datetime import datetime
+from threading import Lock
+from time import monotonic
+from typing import Dict, Iterator, List, Set, Tuple
+
+import api
+import clock
+import db
+import metrics
+from api import format_name
+from db import Db
+from model import ScheduleWithId
+
+# calendar clients poll, and projected occurrences move on with time
+CACHE_SECS = 5 * 60
+# keep tournaments of the last day in the feed
+PAST_SECS = 24 * 60 * 60
+PRODID = "-//lichess-team-scheduler//EN"
+
+# team -> (writer generation, expiry, etag, body)
+cache: Dict[str, Tuple[int, float, str, str]] = {}
+cache_lock = Lock()
+
+
+def escape(text: str) -> str:
+    return (
+        text.replace("\\", "\\\\")
+        .replace(";", "\\;")
+        .replace(",", "\\,")
+        .replace("\n", "\\n")
+    )
+
+
+def fold(line: str) -> str:
+    """Splits content lines longer than 75 octets as RFC 5545 requires."""
+    encoded = line.encode()
+    if len(encoded) <= 75:
+        return line
+    parts: List[str] = []
+    while encoded:
+        n = min(len(encoded), 75 if not parts else 74)
+        # don't split inside a UTF-8 sequence
+        while n < len(encoded) and (encoded[n] & 0xC0) == 0x80:
+            n -= 1
+        parts.append(encoded[:n].decode())
+        encoded = encoded[n:]
+    return "\r\n ".join(parts)
+
+
+def timestamp(t: int) -> str:
+    return f"{datetime.utcfromtimestamp(t):%Y%m%dT%H%M%SZ}"
+
+
+def event(
+    s: ScheduleWithId, at: int, nth: int, url: str, description: str, now: int
+) -> Iterator[str]:
+    yield "BEGIN:VEVENT"
+    # the same UID once the projected occurrence is created updates the event
+    yield f"UID:{s.id}-{at}@lichess-team-scheduler"
+    # when the feed was generated, as RFC 5545 has it for a published feed
+    yield f"DTSTAMP:{timestamp(now)}"
+    yield f"DTSTART:{timestamp(at)}"
+    yield f"DTEND:{timestamp(at + s.minutes * 60)}"
+    yield f"SUMMARY:{escape(format_name(s.name, at, nth))}"
+    yield f"DESCRIPTION:{escape(description)}"
+    yield f"URL:{url}"
+    yield "END:VEVENT"
+
+
+def lines(
+    team: str,
+    schedules: List[ScheduleWithId],
+    created: List[Tuple[str, int, int, int, bool]],
+    num_created: Dict[int, int],
+    now: int,
+) -> Iterator[str]:
+    by_id = {s.id: s for s in schedules}
+    yield "BEGIN:VCALENDAR"
+    yield "VERSION:2.0"
+    yield f"PRODID:{PRODID}"
+    yield f"X-WR-CALNAME:{escape(team)} tournaments"
+
+    known: Set[Tuple[int, int]] = set()
+    for id, schedule_id, at, before, failed in created:
+        known.add((schedule_id, at))
+        s = by_id.get(schedule_id)
+        if failed or s is None:
+            continue
+        url = api.HOST + api.ARENA_URL.format(id)
+        yield from event(s, at, before + 1, url, url, now)
+
+    team_url = f"{api.HOST}/team/{team}/tournaments"
+    for s in schedules:
+        nth = num_created.get(s.id, 0)
+        for at in s.next_times():
+            if at <= now or (s.id, at) in known:
+                continue
+            nth += 1
+            yield from event(s, at, nth, team_url, "Not created yet", now)
+
+    yield "END:VCALENDAR"
+
+
+def feed(team: str) -> Tuple[str, str]:
+    """
+    (ETag, body) of the calendar of `team`, cached until the next write of this
+    process or for CACHE_SECS.
+    """
+    generation = db.writer().generation
+    now = monotonic()
+    with cache_lock:
+        cached = cache.get(team)
+        if cached and cached[0] == generation and cached[1] > now:
+            metrics.CALENDAR_CACHE.inc("hit")
+            return cached[2], cached[3]
+    metrics.CALENDAR_CACHE.inc("miss")
+
+    t = int(clock.time())
+    with Db() as d:
+        schedules = list(d.iter_schedules([team]))
+        created = d.created_of_team_since(team, t - PAST_SECS)
+        num_created = d.num_created_by_schedule(team)
+    folded = [fold(line) for line in lines(team, schedules, created, num_created, t)]
+    body = "".join(line + "\r\n" for line in folded)
+    # without the generation time, so that the ETag changes only with the events
+    etag = hashlib.md5(
+        "\r\n".join(line for line in folded if not line.startswith("DTSTAMP:")).encode()
+    ).hexdigest()
+
+    with cache_lock:
+        cache[team] = (generation, now + CACHE_SECS, etag, body)
+    return etag, body
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+
+"""
+Replays the scheduler event journal to rebuild per team stats and the {nth}
+sequences of the schedules without reading createdArenas or scheduledMsgs.
+
+Usage: python journal.py [--db database.sqlite] [--team TEAM] [--schedule ID]
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+from collections import Counter, defaultdict
+from dataclasses import dataclass, field
+from typing import Any, DefaultDict, Dict, Iterable, List, Optional, Tuple
+
+import db
+from db import Db
+from model import (
+    EVENT_CREATED,
+    EVENT_DELETED,
+    EVENT_FAILED,
+    EVENT_MSG_DROPPED,
+    EVENT_RETRIED,
+    SchedulerEvent,
+)
+
+
+@dataclass(slots=True)
+class Replay:
+    events: int = 0
+    kinds: DefaultDict[str, Counter[str]] = field(
+        default_factory=lambda: defaultdict(Counter)
+    )
+    dropped: DefaultDict[str, Counter[str]] = field(
+        default_factory=lambda: defaultdict(Counter)
+    )
+    # schedule id -> arena id -> start, of the arenas (or failed attempts) left
+    arenas: DefaultDict[int, Dict[str, int]] = field(
+        default_factory=lambda: defaultdict(dict)
+    )
+
+    def apply(self, e: SchedulerEvent) -> None:
+        self.events += 1
+        self.kinds[e.team][e.kind] += 1
+        if e.kind == EVENT_MSG_DROPPED:
+            self.dropped[e.team][e.detail or ""] += 1
+        if e.scheduleId is None or e.arenaId is None or e.at is None:
+            return
+        if e.kind in (EVENT_CREATED, EVENT_FAILED, EVENT_RETRIED):
+            self.arenas[e.scheduleId][e.arenaId] = e.at
+        elif e.kind == EVENT_DELETED:
+            self.arenas[e.scheduleId].pop(e.arenaId, None)
+
+    def nth(self, schedule_id: int) -> List[Tuple[str, int, int]]:
+        """
+        (arena id, start, n) of a schedule, n being what {n} renders as, which
+        counts failed attempts like Db.num_created_before does.
+        """
+        arenas = sorted(self.arenas[schedule_id].items(), key=lambda x: x[1])
+        return [(id, at, n) for n, (id, at) in enumerate(arenas, start=1)]
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        return {
+            team: {**kinds, "msgDroppedBy": dict(self.dropped[team])}
+            for team, kinds in sorted(self.kinds.items())
+        }
+
+
+def replay(events: Iterable[SchedulerEvent]) -> Replay:
+    r = Replay()
+    for e in events:
+        r.apply(e)
+    return r
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--db", default=db.DATABASE)
+    parser.add_argument("--team", default=None)
+    parser.add_argument(
+        "--schedule", type=int, default=None, help="print the nth sequence of it"
+    )
+    args = parser.parse_args()
+
+    db.DATABASE = args.db
+    with Db() as d:
+        r = replay(d.iter_events(args.team))
+
+    result: Dict[str, Any] = {"events": r.events, "teams": r.stats()}
+    schedule: Optional[int] = args.schedule
+    if schedule is not None:
+        result["nth"] = [
+            {"arenaId": id, "at": at, "n": n} for id, at, n in r.nth(schedule)
+        ]
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,250 @@
+from __future__ import annotations
+
+import functools
+import logging
+import math
+from threading import Lock
+from time import perf_counter
+from typing import Any, Callable, Dict, List, Tuple, TypeVar, cast
+
+F = TypeVar("F", bound=Callable[..., Any])
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+LATENESS_BUCKETS = (1, 5, 10, 30, 60, 120, 300, 600, 1800)
+
+REGISTRY: List[Metric] = []
+
+
+def format_labels(names: Tuple[str, ...], values: Tuple[str, ...]) -> str:
+    if not names:
+        return ""
+    labels = ",".join(f'{name}="{escape(value)}"' for name, value in zip(names, values))
+    return "{" + labels + "}"
+
+
+def escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class Metric:
+    typ = ""
+
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = ()) -> None:
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.lock = Lock()
+        REGISTRY.append(self)
+
+    def samples(self) -> List[str]:
+        raise NotImplementedError
+
+    def expose(self) -> str:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.typ}"]
+        lines.extend(self.samples())
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    typ = "counter"
+
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = ()) -> None:
+        super().__init__(name, help, labels)
+        self.values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, *labels: str, amount: float = 1) -> None:
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def samples(self) -> List[str]:
+        with self.lock:
+            values = list(self.values.items())
+        return [
+            f"{self.name}{format_labels(self.labels, labels)} {value}"
+            for labels, value in values
+        ]
+
+
+class Gauge(Counter):
+    typ = "gauge"
+
+    def set(self, value: float, *labels: str) -> None:
+        with self.lock:
+            self.values[labels] = value
+
+    def remove(self, *labels: str) -> None:
+        with self.lock:
+            self.values.pop(labels, None)
+
+
+class GaugeFunc(Metric):
+    """Gauge whose value is only computed when it is scraped."""
+
+    typ = "gauge"
+
+    def __init__(self, name: str, help: str, fn: Callable[[], float]) -> None:
+        super().__init__(name, help)
+        self.fn = fn
+
+    def samples(self) -> List[str]:
+        try:
+            value = self.fn()
+        except Exception as e:
+            # like a database error, which shouldn't fail the whole scrape
+            logger.warning(f"Error computing {self.name}: {e}")
+            value = math.nan
+        return [f"{self.name} {'NaN' if math.isnan(value) else value}"]
+
+
+class Histogram(Metric):
+    typ = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labels: Tuple[str, ...] = (),
+        buckets: Tuple[float, ...] = LATENCY_BUCKETS,
+    ) -> None:
+        super().__init__(name, help, labels)
+        self.buckets = buckets
+        # label values -> (bucket counts, sum, count)
+        self.values: Dict[Tuple[str, ...], Tuple[List[int], float, int]] = {}
+
+    def observe(self, value: float, *labels: str) -> None:
+        with self.lock:
+            counts, total, count = self.values.get(
+                labels, ([0] * len(self.buckets), 0.0, 0)
+            )
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            self.values[labels] = (counts, total + value, count + 1)
+
+    def samples(self) -> List[str]:
+        lines: List[str] = []
+        with self.lock:
+            values = [(k, (list(c), s, n)) for k, (c, s, n) in self.values.items()]
+        for labels, (counts, total, count) in values:
+            cumulative = 0
+            for bound, n in zip(self.buckets, counts):
+                cumulative += n
+                bucket_labels = format_labels(
+                    self.labels + ("le",), labels + (str(bound),)
+                )
+                lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+            inf_labels = format_labels(self.labels + ("le",), labels + ("+Inf",))
+            lines.append(f"{self.name}_bucket{inf_labels} {count}")
+            lines.append(f"{self.name}_sum{format_labels(self.labels, labels)} {total}")
+            lines.append(
+                f"{self.name}_count{format_labels(self.labels, labels)} {count}"
+            )
+        return lines
+
+    def timed(self, fn: F) -> F:
+        """Decorator observing the duration of each call, labelled with the function name."""
+
+        @functools.wraps(fn)
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            start = perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                self.observe(perf_counter() - start, fn.__name__)
+
+        return cast(F, wrapper)
+
+
+def expose() -> str:
+    return "\n".join(metric.expose() for metric in REGISTRY) + "\n"
+
+
+SCHEDULER_TICK = Histogram(
+    "scheduler_tick_seconds",
+    "Duration of a full scheduler run",
+    buckets=(0.1, 1, 10, 30, 60, 120, 300, 600, 1800),
+)
+ARENAS_CREATED = Counter(
+    "scheduler_arenas_created_total", "Tournaments created by the scheduler", ("team",)
+)
+ARENAS_FAILED = Counter(
+    "scheduler_arenas_failed_total",
+    "Tournaments the scheduler failed to create",
+    ("team",),
+)
+ARENAS_PENDING = Gauge(
+    "scheduler_arenas_pending", "Upcoming tournaments that are not created yet"
+)
+ARENAS_PROJECTED_LATE = Gauge(
+    "scheduler_arenas_projected_late",
+    "Pending tournaments projected to be created after their deadline",
+)
+MSGS_SENT = Counter(
+    "scheduler_msgs_sent_total", "Scheduled team messages sent", ("team",)
+)
+MSGS_FAILED = Counter(
+    "scheduler_msgs_failed_total",
+    "Scheduled team messages that could not be sent",
+    ("team", "reason"),
+)
+MSG_LATENESS = Histogram(
+    "scheduler_msg_lateness_seconds",
+    "Delay between the scheduled and actual sending time of team messages",
+    buckets=LATENESS_BUCKETS,
+)
+RATE_LIMITED_UNTIL = Gauge(
+    "rate_limited_until_timestamp_seconds",
+    "Unix time until which requests of this kind are paused due to rate-limiting",
+    ("kind", "team"),
+)
+API_LATENCY = Histogram(
+    "lichess_api_request_seconds",
+    "Latency of requests to the Lichess API",
+    ("method", "endpoint", "status"),
+)
+DB_QUERY = Histogram(
+    "db_query_seconds",
+    "Duration of database queries",
+    ("query",),
+    buckets=(0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5),
+)
+AUTH_CACHE = Counter(
+    "auth_cache_requests_total", "Auth token cache lookups", ("result",)
+)
+TEAM_ARENAS_CACHE = Counter(
+    "team_arenas_cache_requests_total",
+    "Team arena list cache lookups",
+    ("result",),
+)
+CALENDAR_CACHE = Counter(
+    "calendar_cache_requests_total",
+    "Team calendar feed cache lookups",
+    ("result",),
+)
+BACKUPS = Counter(
+    "backups_total",
+    "Database backup attempts (ok, restarted, corrupt, failed)",
+    ("result",),
+)
+BACKUP_DURATION = Histogram(
+    "backup_duration_seconds",
+    "Duration of database backups",
+    buckets=(0.1, 0.5, 1, 5, 10, 30, 60, 300, 600),
+)
+BACKUP_STEP = Histogram(
+    "backup_step_seconds",
+    "Time a backup step holds the database, which writers may wait for",
+    buckets=(0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1),
+)
+LAST_BACKUP = Gauge(
+    "last_backup_timestamp_seconds", "Unix time of the last successful backup"
+)
+SHARD_NODES = Gauge("scheduler_nodes", "Live scheduler nodes seen by this node")
+SHARD_TEAMS = Gauge("scheduler_node_teams", "Teams assigned to this scheduler node")
+SHARD_TEAMS_MOVED = Counter(
+    "scheduler_shard_teams_moved_total",
+    "Teams this node reassigned to another node after nodes joined or left",
+)
@@ -0,0 +1,5 @@
+CREATE TABLE schedulerLease (
+    id INT NOT NULL PRIMARY KEY,
+    holder TEXT NOT NULL,
+    expires INT NOT NULL
+);
@@ -0,0 +1,8 @@
+CREATE TABLE scheduleBattleTeams (
+    scheduleId INT NOT NULL,
+    alternative BOOLEAN NOT NULL,
+    position INT NOT NULL,
+    teamId TEXT NOT NULL
+);
+CREATE INDEX scheduleBattleTeamsSchedule ON scheduleBattleTeams (scheduleId);
+CREATE INDEX scheduleBattleTeamsTeam ON scheduleBattleTeams (teamId);
@@ -0,0 +1,2 @@
+CREATE INDEX schedulesTeam ON schedules (team);
+CREATE INDEX scheduledMsgsTeam ON scheduledMsgs (team);
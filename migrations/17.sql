@@ -0,0 +1,2 @@
+CREATE INDEX createdArenasTeamTime ON createdArenas (team, time);
+CREATE INDEX createdArenasScheduleTime ON createdArenas (scheduleId, time);
@@ -0,0 +1 @@
+ALTER TABLE schedules ADD COLUMN timezone TEXT;
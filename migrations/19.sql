@@ -0,0 +1,24 @@
+CREATE TABLE schedulerEvents (
+    id INTEGER NOT NULL PRIMARY KEY AUTOINCREMENT,
+    time INT NOT NULL, -- unix time in secs of the event
+    kind TEXT NOT NULL,
+    team TEXT NOT NULL,
+    scheduleId INT,
+    arenaId TEXT,
+    at INT, -- start of the tournament
+    detail TEXT
+);
+CREATE INDEX schedulerEventsTeamTime ON schedulerEvents (team, time);
+CREATE INDEX schedulerEventsScheduleAt ON schedulerEvents (scheduleId, at);
+
+-- the tournaments created so far, at their start time
+INSERT INTO schedulerEvents (time, kind, team, scheduleId, arenaId, at, detail)
+SELECT
+    time,
+    CASE WHEN error IS NULL THEN 'created' ELSE 'failed' END,
+    team,
+    scheduleId,
+    id,
+    time,
+    error
+FROM createdArenas ORDER BY time;
@@ -0,0 +1,11 @@
+CREATE TABLE schedulerNodes (
+    id TEXT NOT NULL PRIMARY KEY, -- host:pid
+    expires INT NOT NULL -- unix time in secs
+);
+
+CREATE TABLE teamShards (
+    team TEXT NOT NULL PRIMARY KEY,
+    node TEXT NOT NULL, -- schedulerNodes.id running the scheduler for the team
+    assigned INT NOT NULL -- unix time in secs
+);
+CREATE INDEX teamShardsNode ON teamShards (node);
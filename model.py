@@ -4,16 +4,33 @@ import calendar
 import re
 import sqlite3
 from calendar import monthrange
-from dataclasses import dataclass
+from dataclasses import dataclass, field, fields
 from datetime import datetime, timedelta
-from time import time
-from typing import Any, Dict, List, Optional, Protocol, Type, TypeVar
+from itertools import islice
+from operator import attrgetter
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    Protocol,
+    Sequence,
+    Tuple,
+    Type,
+    TypeVar,
+    cast,
+)
+
+import clock
+import zones
 
 T = TypeVar("T")
 U = TypeVar("U")
 
 
-@dataclass
+@dataclass(slots=True)
 class Schedule:
     name: str
     team: str
@@ -42,6 +59,14 @@ class Schedule:
     daysInAdvance: Optional[int]
     msgMinutesBefore: Optional[int]
     msgTemplate: Optional[str]
+    timezone: Optional[str]  # IANA name, scheduleTime and days are local to it
+    # parsed team battle team lists, filled from scheduleBattleTeams or from_json
+    teamBattleTeamIds: Optional[List[str]] = field(
+        default=None, init=False, compare=False
+    )
+    teamBattleAlternativeTeamIds: Optional[List[str]] = field(
+        default=None, init=False, compare=False
+    )
 
     @property
     def scheduleHour(self) -> int:
@@ -59,13 +84,31 @@ class Schedule:
     def days_in_advance(self) -> int:
         return self.daysInAdvance or 1
 
+    def local_time(self, at: int) -> datetime:
+        """Naive wall clock time of the unix time `at` in the schedule's timezone."""
+        if self.timezone:
+            return zones.get(self.timezone).to_wall(at)
+        return datetime.utcfromtimestamp(at)
+
     def team_battle_teams(self, at: int) -> List[str]:
         if self.teamBattleAlternativeTeamsEnabled:
-            date = datetime.utcfromtimestamp(at)
+            date = self.local_time(at)
             daysInMonth = calendar.monthrange(date.year, date.month)[1]
             if date.day > daysInMonth - 7:
-                return extract_team_battle_teams(self.teamBattleAlternativeTeams)
-        return extract_team_battle_teams(self.teamBattleTeams)
+                return self.alternative_battle_team_ids()
+        return self.battle_team_ids()
+
+    def battle_team_ids(self) -> List[str]:
+        if self.teamBattleTeamIds is None:
+            self.teamBattleTeamIds = extract_team_battle_teams(self.teamBattleTeams)
+        return self.teamBattleTeamIds
+
+    def alternative_battle_team_ids(self) -> List[str]:
+        if self.teamBattleAlternativeTeamIds is None:
+            self.teamBattleAlternativeTeamIds = extract_team_battle_teams(
+                self.teamBattleAlternativeTeams
+            )
+        return self.teamBattleAlternativeTeamIds
 
     @staticmethod
     def from_json(j: dict[str, Any]) -> Schedule:
@@ -108,8 +151,13 @@ class Schedule:
         if len(long_name) > 30:
             raise ParseError("The tournament is longer than 30 characters")
 
+        timezone = get_opt_or_raise(j, "timezone", str) or None
+        if timezone is not None and not zones.is_valid(timezone):
+            raise ParseError(f"Unknown timezone: {timezone}")
+
         teamBattleTeams = get_opt_or_raise(j, "teamBattleTeams", str)
-        if teamBattleTeams and not extract_team_battle_teams(teamBattleTeams):
+        teamBattleTeamIds = extract_team_battle_teams(teamBattleTeams)
+        if teamBattleTeams and not teamBattleTeamIds:
             raise ParseError(
                 "Invalid or empty team battle teams list. Expected one line per team starting with either the team ID or team page URL."
             )
@@ -121,16 +169,18 @@ class Schedule:
             teamBattleAlternativeTeams = get_or_raise(
                 j, "teamBattleAlternativeTeams", str
             )
-            if not teamBattleAlternativeTeams or not extract_team_battle_teams(
+            teamBattleAlternativeTeamIds = extract_team_battle_teams(
                 teamBattleAlternativeTeams
-            ):
+            )
+            if not teamBattleAlternativeTeams or not teamBattleAlternativeTeamIds:
                 raise ParseError(
                     "Invalid or empty team battle alternative teams list. Expected one line per team starting with either the team ID or team page URL."
                 )
         else:
             teamBattleAlternativeTeams = None
+            teamBattleAlternativeTeamIds = []
 
-        return Schedule(
+        s = Schedule(
             name,
             get_or_raise(j, "team", str),
             float(get_or_raise2(j, "clock", int, float)),
@@ -158,10 +208,33 @@ class Schedule:
             get_opt_or_raise(j, "daysInAdvance", int),
             get_opt_or_raise(j, "msgMinutesBefore", int),
             get_opt_or_raise(j, "msgTemplate", str),
+            timezone,
         )
+        s.teamBattleTeamIds = teamBattleTeamIds
+        s.teamBattleAlternativeTeamIds = teamBattleAlternativeTeamIds
+        return s
+
+    def with_id(self, id: int) -> ScheduleWithId:
+        s = ScheduleWithId(
+            **{name: getattr(self, name) for name in SCHEDULE_FIELDS}, id=id
+        )
+        s.teamBattleTeamIds = self.teamBattleTeamIds
+        s.teamBattleAlternativeTeamIds = self.teamBattleAlternativeTeamIds
+        return s
 
     def next_times(self) -> List[int]:
-        now = datetime.utcnow()
+        end = int(clock.time()) + self.days_in_advance * 24 * 60 * 60
+        return list(islice(self.occurrences(clock.utcnow(), end), 5))
+
+    def occurrences(self, now: datetime, end: int) -> Iterator[int]:
+        """Start times from `now` (naive UTC) up to the unix time `end`."""
+        to_unix: Callable[[datetime], int] = utc_to_unix
+        if self.timezone:
+            # walk the wall clock of the timezone
+            zone = zones.get(self.timezone)
+            to_unix = zone.to_unix
+            now = zone.to_wall((now - zones.EPOCH) // zones.SECOND)
+
         new = now.replace(
             hour=self.scheduleHour,
             minute=self.scheduleMinute,
@@ -177,7 +250,8 @@ class Schedule:
             delta = AddDelta(timedelta(days=7))
         elif self.scheduleDay < 10_000:
             if not self.scheduleStart:
-                return []
+                return
+            # the start date is picked as a UTC date
             new = datetime.utcfromtimestamp(self.scheduleStart).replace(
                 hour=self.scheduleHour,
                 minute=self.scheduleMinute,
@@ -187,7 +261,7 @@ class Schedule:
             unit = self.scheduleDay // 1000
             period = self.scheduleDay % 1000
             if period <= 0:
-                return []
+                return
             if unit == 1:  # days
                 delta = AddDelta(timedelta(days=period))
             elif unit == 2:  # weeks
@@ -208,77 +282,50 @@ class Schedule:
         while new < now:
             new = delta.find_next(new)
 
-        nxt = int(new.timestamp())
+        nxt = to_unix(new)
 
-        endTime = int(time()) + self.days_in_advance * 24 * 60 * 60
+        endTime = end
         if self.scheduleEnd and self.scheduleEnd < endTime:
             endTime = self.scheduleEnd
 
-        times: List[int] = []
         while nxt <= endTime:
             if not self.scheduleStart or self.scheduleStart <= nxt:
-                times.append(nxt)
-                if len(times) == 5:
-                    break
+                yield nxt
             new = delta.find_next(new)
-            nxt = int(new.timestamp())
+            nxt = to_unix(new)
 
-        return times
 
+def utc_to_unix(d: datetime) -> int:
+    return int(d.timestamp())
 
-@dataclass
+
+@dataclass(slots=True)
 class ScheduleWithId(Schedule):
     id: int
 
     @staticmethod
     def from_row(row: sqlite3.Row) -> ScheduleWithId:
-        s = ScheduleWithId(**row)  # type: ignore
-        s.rated = bool(s.rated)
-        s.berserkable = bool(s.berserkable)
-        s.streakable = bool(s.streakable)
-        s.allowBots = bool(s.allowBots)
-        if s.teamBattleAlternativeTeamsEnabled is not None:
-            s.teamBattleAlternativeTeamsEnabled = bool(
-                s.teamBattleAlternativeTeamsEnabled
-            )
-        return s
+        return ScheduleWithId.from_values([row[name] for name in SCHEDULE_COLUMNS])
+
+    @staticmethod
+    def from_values(values: Sequence[Any]) -> ScheduleWithId:
+        """Builds a schedule from column values in SCHEDULE_COLUMNS order."""
+        values = list(values)
+        for i in SCHEDULE_BOOL_INDEXES:
+            if values[i] is not None:
+                values[i] = bool(values[i])
+        return ScheduleWithId(*values)
 
     @staticmethod
     def from_json(j: Dict[str, object]) -> ScheduleWithId:
-        s = Schedule.from_json(j)
-        return ScheduleWithId(
-            s.name,
-            s.team,
-            s.clock,
-            s.increment,
-            s.minutes,
-            s.variant,
-            s.rated,
-            s.position,
-            s.berserkable,
-            s.streakable,
-            s.description,
-            s.minRating,
-            s.maxRating,
-            s.minGames,
-            s.minAccountAgeInDays,
-            s.allowBots,
-            s.scheduleDay,
-            s.scheduleTime,
-            s.scheduleStart,
-            s.scheduleEnd,
-            s.teamBattleTeams,
-            s.teamBattleAlternativeTeamsEnabled,
-            s.teamBattleAlternativeTeams,
-            s.teamBattleLeaders,
-            s.daysInAdvance,
-            s.msgMinutesBefore,
-            s.msgTemplate,
-            get_or_raise(j, "id", int),
-        )
+        return Schedule.from_json(j).with_id(get_or_raise(j, "id", int))
+
+    def to_json(self) -> Dict[str, Any]:
+        """Same as dataclasses.asdict, without its recursive deep copy."""
+        return dict(zip(SCHEDULE_JSON_FIELDS, schedule_json_values(self)))
 
 
-@dataclass
+@dataclass(slots=True)
 class ArenaEdit:
     id: str
     name: str
@@ -309,30 +356,14 @@ class ArenaEdit:
 
     @staticmethod
     def from_schedule(s: Schedule, id: str, at: int) -> ArenaEdit:
+        values = {name: getattr(s, name) for name in ARENA_SCHEDULE_FIELDS}
         return ArenaEdit(
-            id,
-            s.name,
-            s.team,
-            at,
-            s.clock,
-            s.increment,
-            s.minutes,
-            s.variant,
-            s.rated,
-            s.position,
-            s.berserkable,
-            s.streakable,
-            s.description,
-            s.minRating,
-            s.maxRating,
-            s.minGames,
-            s.minAccountAgeInDays,
-            s.allowBots,
-            s.is_team_battle,
-            s.teamBattleTeams,
-            s.teamBattleLeaders,
-            None,
-            None,
+            **values,
+            id=id,
+            startsAt=at,
+            isTeamBattle=s.is_team_battle,
+            msgMinutesBefore=None,
+            msgTemplate=None,
         )
 
     @staticmethod
@@ -364,7 +395,7 @@ class ArenaEdit:
         )
 
 
-@dataclass
+@dataclass(slots=True)
 class CreatedArena:
     id: str
     scheduleId: int
@@ -376,6 +407,71 @@ class CreatedArena:
         return CreatedArena(**row)  # type: ignore
 
 
+BULK_CANCEL = "cancel"
+BULK_SHIFT = "shift"
+BULK_MESSAGE = "message"
+BULK_ACTIONS = (BULK_CANCEL, BULK_SHIFT, BULK_MESSAGE)
+
+
+@dataclass(slots=True)
+class BulkArenaOp:
+    """An action on many created arenas, given by id or by schedule and time range."""
+
+    action: str
+    ids: Optional[List[str]]
+    scheduleId: Optional[int]
+    start: Optional[int]
+    end: Optional[int]
+    shiftMinutes: Optional[int]
+    msgMinutesBefore: Optional[int]
+    msgTemplate: Optional[str]
+
+    @staticmethod
+    def from_json(j: Dict[str, object]) -> BulkArenaOp:
+        op = BulkArenaOp(
+            get_or_raise(j, "action", str),
+            get_opt_str_list_or_raise(j, "ids"),
+            get_opt_or_raise(j, "scheduleId", int),
+            get_opt_or_raise(j, "start", int),
+            get_opt_or_raise(j, "end", int),
+            get_opt_or_raise(j, "shiftMinutes", int),
+            get_opt_or_raise(j, "msgMinutesBefore", int),
+            get_opt_or_raise(j, "msgTemplate", str),
+        )
+        if op.action not in BULK_ACTIONS:
+            raise ParseError(f"Invalid value for action: {op.action}")
+        if (op.ids is None) == (op.scheduleId is None):
+            raise ParseError("Expected either ids or scheduleId")
+        if op.action == BULK_SHIFT and not op.shiftMinutes:
+            raise ParseError("Missing key: shiftMinutes")
+        return op
+
+
+# schedules columns in the order of the Schedule fields, followed by id
+SCHEDULE_FIELDS: Tuple[str, ...] = tuple(f.name for f in fields(Schedule) if f.init)
+SCHEDULE_COLUMNS = SCHEDULE_FIELDS + ("id",)
+# fields of a schedule as in its JSON, without the parsed team battle teams
+SCHEDULE_JSON_FIELDS = SCHEDULE_COLUMNS
+schedule_json_values: Callable[[ScheduleWithId], Tuple[Any, ...]] = attrgetter(
+    *SCHEDULE_JSON_FIELDS
+)
+# sqlite returns booleans as 0 and 1
+SCHEDULE_BOOL_FIELDS = (
+    "rated",
+    "berserkable",
+    "streakable",
+    "allowBots",
+    "teamBattleAlternativeTeamsEnabled",
+)
+SCHEDULE_BOOL_INDEXES = tuple(SCHEDULE_FIELDS.index(f) for f in SCHEDULE_BOOL_FIELDS)
+# fields that ArenaEdit.from_schedule copies over by name
+ARENA_SCHEDULE_FIELDS = tuple(
+    f.name
+    for f in fields(ArenaEdit)
+    if f.name in SCHEDULE_FIELDS and f.name not in ("msgMinutesBefore", "msgTemplate")
+)
+
+
 class ParseError(Exception):
     pass
 
@@ -407,10 +503,24 @@ def get_opt_or_raise(j: Dict[str, object], key: str, typ: Type[T]) -> T | None:
     return val
 
 
+def get_opt_str_list_or_raise(j: Dict[str, object], key: str) -> Optional[List[str]]:
+    val = j.get(key)
+    if val is None:
+        return None
+    if not isinstance(val, list) or not all(
+        isinstance(v, str) for v in cast(List[object], val)
+    ):
+        raise ParseError(f"Invalid value for {key}: {val}")
+    return cast(List[str], val)
+
+
 def extract_team_battle_teams(ts: Optional[str]) -> List[str]:
     if not ts:
         return []
-    teams = set(line.strip().split()[0] for line in ts.splitlines() if line.strip())
+    # dict keeps the order of the lines
+    teams = dict.fromkeys(
+        line.strip().split()[0] for line in ts.splitlines() if line.strip()
+    )
     result: List[str] = []
     for team in teams:
         teamId = re.findall(r"^https://lichess.org/team/([\w-]{2,})$", team)
@@ -460,10 +570,11 @@ class XofMonth:
         self.ordinal = ordinal
 
     def find_next(self, date: datetime) -> datetime:
+        # in_month picks the day, the current one might not exist next month
         if date.month == 12:
-            date = date.replace(year=date.year + 1, month=1)
+            date = date.replace(year=date.year + 1, month=1, day=1)
         else:
-            date = date.replace(month=date.month + 1)
+            date = date.replace(month=date.month + 1, day=1)
         return self.in_month(date)
 
     def in_month(self, date: datetime) -> datetime:
@@ -487,7 +598,42 @@ class AddDayButSkipX:
         return new
 
 
-@dataclass
+EVENT_CREATED = "created"
+EVENT_FAILED = "failed"
+# created after an earlier attempt for the same occurrence failed
+EVENT_RETRIED = "retried"
+EVENT_DELETED = "deleted"
+EVENT_MSG_SENT = "msgSent"
+EVENT_MSG_DROPPED = "msgDropped"
+EVENT_TOKEN_BAD = "tokenBad"
+EVENT_KINDS = (
+    EVENT_CREATED,
+    EVENT_FAILED,
+    EVENT_RETRIED,
+    EVENT_DELETED,
+    EVENT_MSG_SENT,
+    EVENT_MSG_DROPPED,
+    EVENT_TOKEN_BAD,
+)
+
+
+@dataclass(slots=True)
+class SchedulerEvent:
+    id: int
+    time: int
+    kind: str
+    team: str
+    scheduleId: Optional[int]
+    arenaId: Optional[str]
+    at: Optional[int]
+    detail: Optional[str]
+
+    @staticmethod
+    def from_row(row: sqlite3.Row) -> SchedulerEvent:
+        return SchedulerEvent(**row)  # type: ignore
+
+
+@dataclass(slots=True)
 class MsgToSend:
     arenaId: str
     team: str
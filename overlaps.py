@@ -0,0 +1,97 @@
+from __future__ import annotations
+
+import heapq
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from model import Schedule, ScheduleWithId
+
+# how far ahead occurrences are checked for overlaps
+WINDOW_DAYS = 28
+
+# (start, end, index of the schedule)
+Interval = Tuple[int, int, int]
+
+
+@dataclass(slots=True)
+class Conflict:
+    """Two schedules of a team (or one with itself) whose tournaments overlap."""
+
+    team: str
+    scheduleId: Optional[int]
+    name: str
+    otherScheduleId: Optional[int]
+    otherName: str
+    firstAt: int  # start of the later tournament of the first overlap
+    count: int
+
+
+def intervals(schedules: Sequence[Schedule], start: int, end: int) -> List[Interval]:
+    """Occurrences of `schedules` starting between `start` and `end`, sorted."""
+    now = datetime.utcfromtimestamp(start)
+    result: List[Interval] = []
+    for i, s in enumerate(schedules):
+        duration = s.minutes * 60
+        result.extend((at, at + duration, i) for at in s.occurrences(now, end))
+    result.sort()
+    return result
+
+
+def sweep(sorted_intervals: Iterable[Interval]) -> Iterator[Tuple[Interval, Interval]]:
+    """Pairs of overlapping intervals, the earlier one first."""
+    active: List[Interval] = []  # (end, start, index), a heap by end
+    for interval in sorted_intervals:
+        while active and active[0][0] <= interval[0]:
+            heapq.heappop(active)
+        for other in active:
+            yield (other[1], other[0], other[2]), interval
+        heapq.heappush(active, (interval[1], interval[0], interval[2]))
+
+
+def conflicts(
+    schedules: Sequence[Schedule], start: int, end: int, only: Optional[int] = None
+) -> List[Conflict]:
+    """
+    Overlapping tournaments of schedules that all belong to one team, only those
+    involving `schedules[only]` if given.
+    """
+    found: Dict[Tuple[int, int], Conflict] = {}
+    for a, b in sweep(intervals(schedules, start, end)):
+        i, j = sorted((a[2], b[2]))
+        if only is not None and only not in (i, j):
+            continue
+        conflict = found.get((i, j))
+        if conflict is None:
+            s, o = schedules[i], schedules[j]
+            found[(i, j)] = Conflict(
+                s.team, schedule_id(s), s.name, schedule_id(o), o.name, b[0], 1
+            )
+        else:
+            conflict.count += 1
+    return sorted(found.values(), key=lambda c: c.firstAt)
+
+
+def conflicts_with(
+    schedule: Schedule, others: Iterable[ScheduleWithId], start: int
+) -> List[Conflict]:
+    """Conflicts of `schedule` with itself and with the other schedules of its team."""
+    own_id = schedule_id(schedule)
+    team: List[Schedule] = [schedule]
+    team.extend(o for o in others if o.team == schedule.team and o.id != own_id)
+    return conflicts(team, start, start + WINDOW_DAYS * 24 * 60 * 60, only=0)
+
+
+def all_conflicts(schedules: Iterable[ScheduleWithId], start: int) -> List[Conflict]:
+    by_team: Dict[str, List[Schedule]] = {}
+    for s in schedules:
+        by_team.setdefault(s.team, []).append(s)
+    end = start + WINDOW_DAYS * 24 * 60 * 60
+    result: List[Conflict] = []
+    for team in sorted(by_team):
+        result.extend(conflicts(by_team[team], start, end))
+    return result
+
+
+def schedule_id(s: Schedule) -> Optional[int]:
+    return s.id if isinstance(s, ScheduleWithId) else None
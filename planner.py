@@ -0,0 +1,137 @@
+from __future__ import annotations
+
+from copy import copy
+from dataclasses import dataclass
+from math import ceil
+from typing import Iterable, List, Optional, Set, Tuple
+
+from model import ScheduleWithId
+
+# Lichess doesn't let us create tournaments starting in less than an hour
+MIN_LEAD_SECS = 60 * 60
+# team messages should go out for an existing tournament
+MSG_LEAD_SECS = 5 * 60
+TICK_SECS = 60
+
+# tournament creation budget, overridden from config in app.py
+BUDGET_CAPACITY = 100
+BUDGET_PER_HOUR = 200
+
+
+@dataclass(slots=True)
+class Pending:
+    """An occurrence of a schedule that has no tournament yet."""
+
+    at: int
+    schedule: ScheduleWithId
+
+    @property
+    def deadline(self) -> int:
+        """Latest time the tournament can be created at without being late."""
+        lead = MIN_LEAD_SECS
+        s = self.schedule
+        if s.msgMinutesBefore and s.msgMinutesBefore > 0 and s.msgTemplate:
+            lead = max(lead, s.msgMinutesBefore * 60 + MSG_LEAD_SECS)
+        return self.at - lead
+
+
+@dataclass(slots=True)
+class Projection:
+    pending: Pending
+    creation: float  # projected creation time
+
+    @property
+    def late(self) -> bool:
+        return self.creation > self.pending.deadline
+
+
+class TokenBucket:
+    """Model of the remaining tournament creation budget."""
+
+    def __init__(self, capacity: float, per_hour: float, now: float) -> None:
+        self.capacity = capacity
+        self.per_sec = per_hour / (60 * 60)
+        self.tokens = capacity
+        self.updated = now
+
+    def refill(self, now: float) -> None:
+        if now > self.updated:
+            self.tokens = min(
+                self.capacity, self.tokens + (now - self.updated) * self.per_sec
+            )
+            self.updated = now
+
+    def available(self, now: float) -> int:
+        self.refill(now)
+        return int(self.tokens)
+
+    def take(self, now: float) -> None:
+        self.refill(now)
+        self.tokens = max(0.0, self.tokens - 1)
+
+    def drain(self, now: float) -> None:
+        self.refill(now)
+        self.tokens = 0
+
+    def resize(self, capacity: float, per_hour: float, now: float) -> None:
+        """Changes the budget, keeping the tokens up to the new capacity."""
+        self.refill(now)
+        self.capacity = capacity
+        self.per_sec = per_hour / (60 * 60)
+        self.tokens = min(self.tokens, capacity)
+
+    def next_token(self, now: float) -> float:
+        """Time at which the next whole token is available."""
+        self.refill(now)
+        if self.tokens >= 1 or self.per_sec <= 0:
+            return now
+        return now + (1 - self.tokens) / self.per_sec
+
+
+def pending(
+    schedules: Iterable[ScheduleWithId], scheduled: Set[Tuple[int, int]], now: float
+) -> List[Pending]:
+    """Occurrences without a tournament, earliest deadline first."""
+    result: List[Pending] = []
+    for s in schedules:
+        for nxt in s.next_times():
+            if nxt < now + MIN_LEAD_SECS or (s.id, nxt) in scheduled:
+                continue
+            result.append(Pending(nxt, s))
+    result.sort(key=lambda p: (p.deadline, p.at))
+    return result
+
+
+def project(
+    work: List[Pending],
+    now: float,
+    bucket: TokenBucket,
+    paused_until: Optional[float] = None,
+) -> List[Projection]:
+    """
+    Projected creation times when creating in order as fast as the budget
+    allows, starting once rate-limiting is over.
+    """
+    bucket = copy(bucket)
+    t = max(now, paused_until or now)
+    projections: List[Projection] = []
+    for p in work:
+        t = bucket.next_token(t)
+        bucket.take(t)
+        projections.append(Projection(p, t))
+    return projections
+
+
+def batch(work: List[Pending], now: float, bucket: TokenBucket) -> List[Pending]:
+    """
+    What to create in this tick: the share of the refill rate, so that the
+    budget isn't burnt at once, or more if some occurrence would otherwise be
+    created after its deadline.
+    """
+    per_tick = max(1, ceil(bucket.per_sec * TICK_SECS))
+    needed = 0
+    for i, p in enumerate(work):
+        # at the steady pace, the i-th one would be created i // per_tick ticks later
+        if now + (i // per_tick) * TICK_SECS > p.deadline:
+            needed = i + 1
+    return work[: min(bucket.available(now), max(per_tick, needed))]
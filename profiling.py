@@ -0,0 +1,108 @@
+from __future__ import annotations
+
+import cProfile
+import io
+import logging
+import pstats
+import tracemalloc
+from contextlib import contextmanager
+from threading import Lock
+from typing import Any, Dict, Generator, List, Optional
+
+TARGETS = ("ticks", "requests")
+TRACEMALLOC_FRAMES = 10
+
+logger = logging.getLogger(__name__)
+
+
+class Profiler:
+    """
+    Collects an aggregated cProfile of the next N scheduler ticks or HTTP requests
+    and tracemalloc snapshot diffs.
+    """
+
+    def __init__(self) -> None:
+        self.lock = Lock()
+        self.target: Optional[str] = None
+        self.remaining = 0
+        self.captured = 0
+        self.stats: Optional[pstats.Stats] = None
+        self.baseline: Optional[tracemalloc.Snapshot] = None
+
+    def start(self, target: str, count: int) -> None:
+        with self.lock:
+            self.target = target
+            self.remaining = count
+            self.captured = 0
+            self.stats = None
+
+    def begin(self, target: str) -> Optional[cProfile.Profile]:
+        with self.lock:
+            if self.target != target or self.remaining <= 0:
+                return None
+            self.remaining -= 1
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError as e:
+            # only one profiler can be active at a time in recent Python versions
+            logger.warning(f"Could not start profiler: {e}")
+            with self.lock:
+                self.remaining += 1
+            return None
+        return profile
+
+    def end(self, profile: Optional[cProfile.Profile]) -> None:
+        if profile is None:
+            return
+        profile.disable()
+        with self.lock:
+            if self.stats is None:
+                self.stats = pstats.Stats(profile)
+            else:
+                self.stats.add(profile)
+            self.captured += 1
+
+    @contextmanager
+    def capture(self, target: str) -> Generator[None, None, None]:
+        profile = self.begin(target)
+        try:
+            yield
+        finally:
+            self.end(profile)
+
+    def result(self, sort: str, limit: int) -> Dict[str, Any]:
+        with self.lock:
+            out = io.StringIO()
+            if self.stats is not None:
+                self.stats.stream = out  # type: ignore
+                self.stats.sort_stats(sort).print_stats(limit)
+            return {
+                "target": self.target,
+                "captured": self.captured,
+                "remaining": self.remaining,
+                "profile": out.getvalue(),
+            }
+
+    def start_memory_diff(self) -> None:
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(TRACEMALLOC_FRAMES)
+        self.baseline = tracemalloc.take_snapshot()
+
+    def memory_diff(self, limit: int) -> List[str]:
+        if self.baseline is None or not tracemalloc.is_tracing():
+            return []
+        snapshot = tracemalloc.take_snapshot()
+        stats = snapshot.compare_to(self.baseline, "traceback")
+        result: List[str] = []
+        for stat in stats[:limit]:
+            result.append(str(stat))
+            result.extend(f"    {line}" for line in stat.traceback.format())
+        return result
+
+    def stop_memory_diff(self) -> None:
+        self.baseline = None
+        tracemalloc.stop()
+
+
+profiler = Profiler()
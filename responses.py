@@ -0,0 +1,87 @@
+from __future__ import annotations
+
+import gzip
+import json
+from typing import Any, Optional
+
+from flask import Request, Response
+
+try:
+    import orjson
+except ImportError:  # optional, serializes dataclasses natively and faster
+    orjson = None  # type: ignore
+try:
+    import brotli
+except ImportError:  # optional, gzip is used without it (stubs in typings/)
+    brotli = None  # type: ignore
+
+# smaller responses don't gain from compression
+COMPRESS_MIN_BYTES = 1024
+GZIP_LEVEL = 6
+# 11 is the default but is meant for static assets and too slow per request
+BROTLI_QUALITY = 5
+COMPRESSIBLE = {
+    "application/json",
+    "application/x-ndjson",
+    "text/calendar",
+    "text/plain",
+}
+
+
+def default(o: Any) -> Any:
+    to_json = getattr(o, "to_json", None)
+    if to_json is None:
+        raise TypeError(f"Object of type {type(o).__name__} is not JSON serializable")
+    return to_json()
+
+
+def dumps(obj: Any) -> bytes:
+    """Compact JSON of `obj`, schedules serialized like dataclasses.asdict."""
+    if orjson is not None:
+        return orjson.dumps(obj, default=default)
+    return json.dumps(obj, default=default, separators=(",", ":")).encode()
+
+
+def json_response(obj: Any) -> Response:
+    return Response(dumps(obj), mimetype="application/json")
+
+
+def negotiate(request: Request) -> Optional[str]:
+    """The preferred supported Content-Encoding of the client, if any."""
+    accepted = request.accept_encodings
+    if brotli is not None and accepted.quality("br") > 0:
+        return "br"
+    if accepted.quality("gzip") > 0:
+        return "gzip"
+    return None
+
+
+def compress(request: Request, response: Response) -> Response:
+    """Compresses buffered responses with the encoding negotiated by `request`."""
+    if (
+        response.direct_passthrough
+        or response.is_streamed
+        or response.status_code < 200
+        or response.status_code in (204, 304)
+        or "Content-Encoding" in response.headers
+        or response.mimetype not in COMPRESSIBLE
+    ):
+        return response
+    response.vary.add("Accept-Encoding")
+    encoding = negotiate(request)
+    if encoding is None:
+        return response
+    data = response.get_data()
+    if len(data) < COMPRESS_MIN_BYTES:
+        return response
+
+    if encoding == "br" and brotli is not None:
+        response.set_data(brotli.compress(data, quality=BROTLI_QUALITY))
+    else:
+        response.set_data(gzip.compress(data, GZIP_LEVEL, mtime=0))
+    response.headers["Content-Encoding"] = encoding
+    # the compressed body is equivalent, not byte-for-byte equal
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+    return response
@@ -1,48 +1,114 @@
 from __future__ import annotations
 
+import argparse
+import json
 import logging
+import os
+import socket
+import sys
 from datetime import datetime
 from threading import Thread
-from time import sleep, time
-from typing import Any, Dict, List, Optional, Tuple, cast
+from time import perf_counter
+from typing import Any, Dict, List, Optional, cast
 
 import api
+import db as db_module
+import metrics
+import planner
+import profiling
+from clock import sleep, time
 from db import Db
-from model import ScheduleWithId
+from model import EVENT_MSG_DROPPED, EVENT_MSG_SENT, MsgToSend
+from shards import HashRing
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 
+LEASE_SECS = 2 * 60
+LEASE_RENEW_SECS = 30
+SCHEDULER_STUCK_SECS = 90 * 60
+# messages of a team due within that many secs of a due one are sent with it as
+# one message, 0 sends each separately. MSG_COLLATE_SECS in config.py
+MSG_COLLATE_SECS = 0
+
 last_scheduler_run = time()
 
 
+def msg_queue_depth() -> float:
+    with Db() as db:
+        return db.num_scheduled_msgs()
+
+
+metrics.GaugeFunc(
+    "scheduler_last_run_timestamp_seconds",
+    "Unix time of the last scheduler run",
+    lambda: last_scheduler_run,
+)
+metrics.GaugeFunc(
+    "scheduler_msg_queue_depth", "Number of scheduled team messages", msg_queue_depth
+)
+
+
+def msg_dropped(msg: MsgToSend, reason: str) -> None:
+    metrics.MSGS_FAILED.inc(msg.team, reason)
+    with Db() as db:
+        db.insert_event(EVENT_MSG_DROPPED, msg.team, msg.arenaId, reason)
+
+
 class SchedulerThread(Thread):
-    def __init__(self, api_key: str) -> None:
+    def __init__(
+        self,
+        api_key: str,
+        lease: Optional[SchedulerLease] = None,
+        collate_secs: int = MSG_COLLATE_SECS,
+    ) -> None:
         super().__init__(daemon=True)
         self.api_key = api_key
+        self.lease = lease
+        self.collate_secs = collate_secs
         self.arenas_rate_limited_until: Optional[float] = None
+        self.budget = planner.TokenBucket(
+            planner.BUDGET_CAPACITY, planner.BUDGET_PER_HOUR, time()
+        )
         self.msgs_rate_limited_until: Dict[str, float] = {}
 
+    @property
+    def node(self) -> Optional[str]:
+        """With sharding, the node whose teams this thread schedules."""
+        return self.lease.node if self.lease else None
+
     def schedule_next_arenas(self) -> None:
         with Db() as db:
-            schedules = db.schedules()
-
             now = time()
-            scheduled = db.created_upcoming_or_failed()
-            to_schedule: List[Tuple[int, ScheduleWithId]] = []
-            for s in schedules:
-                for nxt in s.next_times():
-                    # don't schedule if starting too soon (in <1h)
-                    if nxt < now + 60 * 60:
-                        continue
-                    if (s.id, nxt) in scheduled:
-                        continue
-                    to_schedule.append((nxt, s))
-
-            # Create soonest tournaments first in case of rate-limiting
-            to_schedule.sort(key=lambda x: x[0])
-
-            for nxt, s in to_schedule:
+            if self.lease is not None:
+                # nodes sharing the API key share its budget
+                share = self.lease.budget_share
+                self.budget.resize(
+                    planner.BUDGET_CAPACITY * share,
+                    planner.BUDGET_PER_HOUR * share,
+                    now,
+                )
+            work = planner.pending(
+                db.schedules(self.node), db.created_upcoming_or_failed(), now
+            )
+            late = sum(p.late for p in planner.project(work, now, self.budget))
+            to_schedule = planner.batch(work, now, self.budget)
+            if work:
+                logger.info(
+                    f"{len(work)} tournaments to create, {len(to_schedule)} now, {late} projected late"
+                )
+            metrics.ARENAS_PENDING.set(len(work))
+            metrics.ARENAS_PROJECTED_LATE.set(late)
+
+            for p in to_schedule:
+                if self.lease is not None and not self.lease.keep():
+                    logger.error("Lost the scheduler lease, stopping creation")
+                    return
+                nxt, s = p.at, p.schedule
+                # another node may have taken the team over since the pass started
+                if not db.may_create(self.node, s.team, s.id, nxt):
+                    logger.info(f"Skipping {s.name} at {nxt}, no longer this node's")
+                    continue
                 logger.info(
                     f"Trying to create {s.name} for {s.team} at {nxt} ({datetime.utcfromtimestamp(nxt):%Y-%m-%d %H:%M:%S})"
                 )
@@ -51,6 +117,7 @@ class SchedulerThread(Thread):
                 else:
                     nth = 0
                 prev, prev2 = db.previous_two_created(s.id, nxt)
+                self.budget.take(time())
                 try:
                     id, name = api.schedule_arena(s, nxt, self.api_key, nth, prev)
                 except Exception as e:
@@ -64,7 +131,13 @@ class SchedulerThread(Thread):
                                 f"Response: {response.status_code} {response.text}"
                             )
                             if response.status_code == 429:
+                                # retried once rate-limiting is over
+                                db.insert_failed_attempt(s.id, s.team, nxt, str(e))
+                                self.budget.drain(time())
                                 self.arenas_rate_limited_until = int(time()) + 60 * 60
+                                metrics.RATE_LIMITED_UNTIL.set(
+                                    self.arenas_rate_limited_until, "arenas", ""
+                                )
                                 return
                         except Exception:
                             pass
@@ -72,10 +145,12 @@ class SchedulerThread(Thread):
                     db.insert_created(
                         f"failed-{int(time())}", s.id, s.team, nxt, str(e)
                     )
+                    metrics.ARENAS_FAILED.inc(s.team)
                     sleep(10)
                     continue
 
                 db.insert_created(id, s.id, s.team, nxt)
+                metrics.ARENAS_CREATED.inc(s.team)
                 logger.info(f"Created {name or s.name} as {id}")
 
                 if s.msgMinutesBefore and s.msgMinutesBefore > 0 and s.msgTemplate:
@@ -98,40 +173,71 @@ class SchedulerThread(Thread):
 
     def send_scheduled_messages(self) -> None:
         with Db() as db:
-            msgs = db.get_and_remove_scheduled_msgs()
+            msgs = db.get_and_remove_scheduled_msgs(self.node, self.collate_secs)
 
         now_timestamp = time()
         now = datetime.utcfromtimestamp(int(now_timestamp))
 
-        for msg in msgs:
-            logger.info(
-                f"Sending team PM for {msg.arenaId} at {now:%Y-%m-%d %H:%M:%S} (scheduled {datetime.utcfromtimestamp(msg.sendTime):%Y-%m-%d %H:%M:%S})"
-            )
+        # with collation, all messages of a team go out as one
+        batches: List[List[MsgToSend]] = []
+        if self.collate_secs > 0:
+            by_team: Dict[str, List[MsgToSend]] = {}
+            for msg in msgs:
+                by_team.setdefault(msg.team, []).append(msg)
+            for team_msgs in by_team.values():
+                team_msgs.sort(key=lambda m: m.sendTime)
+                batches.append(team_msgs)
+        else:
+            batches = [[msg] for msg in msgs]
+
+        for batch in batches:
+            team = batch[0].team
+            for msg in batch:
+                logger.info(
+                    f"Sending team PM for {msg.arenaId} at {now:%Y-%m-%d %H:%M:%S} (scheduled {datetime.utcfromtimestamp(msg.sendTime):%Y-%m-%d %H:%M:%S})"
+                )
+            if len(batch) > 1:
+                logger.info(f"Collating {len(batch)} team PMs for {team}")
 
-            if msg.team in self.msgs_rate_limited_until:
-                if self.msgs_rate_limited_until[msg.team] > now_timestamp:
+            if team in self.msgs_rate_limited_until:
+                if self.msgs_rate_limited_until[team] > now_timestamp:
                     logger.warn(f"Skipping team PM due to active rate-limiting")
+                    for msg in batch:
+                        msg_dropped(msg, "rate-limited")
                     continue
-                del self.msgs_rate_limited_until[msg.team]
+                del self.msgs_rate_limited_until[team]
+                metrics.RATE_LIMITED_UNTIL.remove("msgs", team)
 
             with Db() as db:
-                token = db.token_for_team(msg.team)
+                token = db.token_for_team(team)
 
             if not token:
                 logger.warn(f"No valid token found")
+                for msg in batch:
+                    msg_dropped(msg, "no-token")
                 continue
 
             vToken = api.verify_token(token)
-            if not vToken or not vToken.is_valid_msg_token_for_team(msg.team):
+            if not vToken or not vToken.is_valid_msg_token_for_team(team):
                 logger.warn("Bad token")
+                for msg in batch:
+                    msg_dropped(msg, "bad-token")
                 with Db() as db:
-                    db.mark_bad_token(msg.team, token)
+                    db.mark_bad_token(team, token)
                 continue
 
             try:
-                api.send_team_msg(msg, token)
+                api.send_team_msgs(batch, token)
+                with Db() as db:
+                    for msg in batch:
+                        db.insert_event(EVENT_MSG_SENT, team, msg.arenaId)
+                for msg in batch:
+                    metrics.MSGS_SENT.inc(team)
+                    metrics.MSG_LATENESS.observe(time() - msg.sendTime)
             except Exception as e:
                 logger.error(f"Error during msg sending: {e}", exc_info=True)
+                for msg in batch:
+                    msg_dropped(msg, "error")
                 if hasattr(e, "response"):
                     try:
                         response = cast(Any, e).response
@@ -139,43 +245,55 @@ class SchedulerThread(Thread):
                             f"Response: {response.status_code} {response.text}"
                         )
                         if response.status_code == 429:
-                            self.msgs_rate_limited_until[msg.team] = (
-                                now_timestamp + 60 * 60
+                            self.msgs_rate_limited_until[team] = now_timestamp + 60 * 60
+                            metrics.RATE_LIMITED_UNTIL.set(
+                                now_timestamp + 60 * 60, "msgs", team
                             )
                     except Exception:
                         pass
 
             sleep(5)
 
-    def run(self) -> None:
+    def tick(self) -> None:
         global last_scheduler_run
 
-        try:
-            while True:
-                logger.info("Running scheduling")
-                last_scheduler_run = time()
+        logger.info("Running scheduling")
+        last_scheduler_run = time()
+        start = perf_counter()
+        with profiling.profiler.capture("ticks"):
+            try:
+                if (
+                    self.arenas_rate_limited_until is None
+                    or self.arenas_rate_limited_until < time()
+                ):
+                    self.schedule_next_arenas()
+                self.send_scheduled_messages()
+            except Exception as e:
+                logger.error(f"Error during scheduling: {e}", exc_info=True)
                 try:
-                    if (
-                        self.arenas_rate_limited_until is None
-                        or self.arenas_rate_limited_until < time()
-                    ):
-                        self.schedule_next_arenas()
-                    self.send_scheduled_messages()
-                except Exception as e:
-                    logger.error(f"Error during scheduling: {e}", exc_info=True)
-                    try:
-                        if hasattr(e, "response"):
-                            response = cast(Any, e).response
-                            logger.error(
-                                f"Response: {response.status_code} {response.text}"
-                            )
-                            if response.status_code == 429:
-                                sleep(60 * 60)
-                    except Exception:
+                    if hasattr(e, "response"):
+                        response = cast(Any, e).response
                         logger.error(
-                            f"Error trying to log response while handling error: {e}",
-                            exc_info=True,
+                            f"Response: {response.status_code} {response.text}"
                         )
+                        if response.status_code == 429:
+                            sleep(60 * 60)
+                except Exception:
+                    logger.error(
+                        f"Error trying to log response while handling error: {e}",
+                        exc_info=True,
+                    )
+        metrics.SCHEDULER_TICK.observe(perf_counter() - start)
+
+    def run(self) -> None:
+        global last_scheduler_run
+
+        try:
+            while True:
+                if self.lease is None or self.lease.held:
+                    self.tick()
+                else:
+                    last_scheduler_run = time()
                 sleep(60)
         except BaseException as e:
             try:
@@ -185,15 +303,236 @@ class SchedulerThread(Thread):
             raise
 
 
-class SchedulerWatchdog(Thread):
+class SchedulerLease(Thread):
+    """
+    Leader election between processes sharing the database. Only the process
+    holding the lease runs the scheduler. The lease is renewed as long as the
+    local scheduler thread keeps running and expires if the process dies, at
+    which point another process takes over.
+    """
+
     def __init__(self) -> None:
         super().__init__(daemon=True)
+        self.holder = f"{socket.gethostname()}:{os.getpid()}"
+        self.held = False
+        # set with sharding, the scheduler then only runs for the node's teams
+        self.node: Optional[str] = None
 
-    def run(self) -> None:
-        global last_scheduler_run
+    @property
+    def primary(self) -> bool:
+        """Whether this process runs once-per-deployment jobs like backups."""
+        return self.held
+
+    @property
+    def budget_share(self) -> float:
+        """Share of the tournament creation budget of this process."""
+        return 1.0
+
+    def keep(self) -> bool:
+        """Whether the lease is still held, checked between arenas."""
+        return self.held
+
+    def renew(self) -> bool:
+        with Db() as db:
+            if time() - last_scheduler_run < SCHEDULER_STUCK_SECS:
+                return db.acquire_lease(self.holder, LEASE_SECS)
+            if self.held:
+                logger.error(
+                    "Scheduler thread has not run in a long time. Releasing lease..."
+                )
+            db.release_lease(self.holder)
+            return False
 
+    def run(self) -> None:
         while True:
-            if time() - last_scheduler_run > 60 * 60:
-                logger.error("Scheduler thread has not run in an hour. Restarting...")
-                exit(42)
-            sleep(60 * 60)
+            try:
+                held = self.renew()
+            except Exception as e:
+                logger.error(
+                    f"Error while renewing scheduler lease: {e}", exc_info=True
+                )
+                held = False
+            if held != self.held:
+                logger.info(
+                    f"{self.holder} {'acquired' if held else 'lost'} the scheduler lease"
+                )
+            self.held = held
+            sleep(LEASE_RENEW_SECS)
+
+
+class ShardLease(SchedulerLease):
+    """
+    Membership of this process in a group of scheduler nodes sharing the
+    database. Each node heartbeats in schedulerNodes and the first live node
+    assigns all teams to the live nodes by consistent hashing in teamShards, so
+    teams move only when a node joins or leaves. Every node runs the scheduler
+    for its teams, with an equal share of the tournament budget.
+    """
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.node = self.holder
+        self.nodes: List[str] = []
+        self.ring = HashRing([])
+
+    @property
+    def primary(self) -> bool:
+        return self.held and bool(self.nodes) and self.nodes[0] == self.node
+
+    @property
+    def budget_share(self) -> float:
+        return 1 / len(self.nodes) if self.nodes else 1.0
+
+    def renew(self) -> bool:
+        with Db() as db:
+            if time() - last_scheduler_run >= SCHEDULER_STUCK_SECS:
+                if self.held:
+                    logger.error(
+                        "Scheduler thread has not run in a long time. Leaving the shard group..."
+                    )
+                db.leave_node(self.holder)
+                return False
+            nodes = db.heartbeat_node(self.holder, LEASE_SECS)
+            if nodes != self.nodes:
+                logger.info(f"Scheduler nodes: {', '.join(nodes)}")
+                self.nodes = nodes
+                self.ring = HashRing(nodes)
+                metrics.SHARD_NODES.set(len(nodes))
+            # only the first node writes the assignment, the others follow it, so
+            # that nodes seeing different sets of nodes don't move teams back and forth
+            if nodes[0] == self.node:
+                moved = db.assign_shards(self.ring.assign(db.sharded_teams()))
+                if moved:
+                    logger.info(f"Assigned {moved} teams to new nodes")
+                    metrics.SHARD_TEAMS_MOVED.inc(amount=moved)
+            metrics.SHARD_TEAMS.set(db.num_teams_of_node(self.holder))
+            return True
+
+
+class OneShotLease(SchedulerLease):
+    """
+    The lease of a one-shot pass of main(). It isn't started as a thread, the
+    pass renews it between arenas instead, as often as the thread would.
+    Sharded schedulers don't take the lease, so it also fails while any
+    scheduler node is heartbeating.
+    """
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.renewed = float("-inf")
+
+    def renew(self) -> bool:
+        with Db() as db:
+            nodes = db.live_nodes()
+            if nodes:
+                logger.error(f"Sharded scheduler nodes are running: {', '.join(nodes)}")
+                return False
+            return db.acquire_lease(self.holder, LEASE_SECS)
+
+    def keep(self) -> bool:
+        if time() - self.renewed >= LEASE_RENEW_SECS:
+            try:
+                self.held = self.renew()
+            except Exception as e:
+                logger.error(
+                    f"Error while renewing scheduler lease: {e}", exc_info=True
+                )
+                self.held = False
+            self.renewed = time()
+        return self.held
+
+
+def load_config(path: str) -> Dict[str, Any]:
+    """Upper case names of a config.py, like Flask's config.from_pyfile."""
+    values: Dict[str, Any] = {}
+    with open(path) as f:
+        exec(compile(f.read(), path, "exec"), values)
+    return {k: v for k, v in values.items() if k.isupper()}
+
+
+def dry_run() -> List[Dict[str, Any]]:
+    """The creations the next tick would plan, without calling Lichess."""
+    budget = planner.TokenBucket(
+        planner.BUDGET_CAPACITY, planner.BUDGET_PER_HOUR, time()
+    )
+    with Db() as db:
+        now = time()
+        work = planner.pending(db.schedules(), db.created_upcoming_or_failed(), now)
+        now_ids = set(id(p) for p in planner.batch(work, now, budget))
+        # pending occurrences of each schedule, which count towards {nth} too
+        times: Dict[int, List[int]] = {}
+        for p in work:
+            times.setdefault(p.schedule.id, []).append(p.at)
+        for ts in times.values():
+            ts.sort()
+        planned: List[Dict[str, Any]] = []
+        for p in planner.project(work, now, budget):
+            s, at = p.pending.schedule, p.pending.at
+            nth = db.num_created_before(s.id, at) + times[s.id].index(at) + 1
+            planned.append(
+                {
+                    "scheduleId": s.id,
+                    "team": s.team,
+                    "name": api.format_name(s.name, at, nth),
+                    "at": f"{datetime.utcfromtimestamp(at):%Y-%m-%d %H:%M} UTC",
+                    "deadline": p.pending.deadline,
+                    "projectedCreation": int(p.creation),
+                    "late": p.late,
+                    "thisTick": id(p.pending) in now_ids,
+                }
+            )
+    return planned
+
+
+def main() -> None:
+    """
+    One-shot scheduler passes for running under cron or a systemd timer.
+
+    Usage: python -m scheduler [--config config.py] [--db database.sqlite]
+           {create,messages,dry-run}
+    """
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument("--config", default="config.py")
+    parser.add_argument("--db", default=db_module.DATABASE)
+    parser.add_argument("command", choices=("create", "messages", "dry-run"))
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        format="[%(asctime)s] %(levelname)s: %(message)s", level=logging.INFO
+    )
+    config = load_config(args.config)
+    db_module.DATABASE = args.db
+    api.HOST = config.get("HOST", api.HOST)
+    planner.BUDGET_CAPACITY = config.get("BUDGET_CAPACITY", planner.BUDGET_CAPACITY)
+    planner.BUDGET_PER_HOUR = config.get("BUDGET_PER_HOUR", planner.BUDGET_PER_HOUR)
+    with Db() as db:
+        db.create_tables()
+
+    if args.command == "dry-run":
+        print(json.dumps(dry_run(), indent=2))
+        return
+
+    # don't run next to a scheduler daemon holding the lease
+    lease = OneShotLease()
+    if not lease.keep():
+        logger.error("Another scheduler process is running")
+        sys.exit(1)
+    try:
+        scheduler = SchedulerThread(
+            cast(str, config["LICHESS_API_KEY"]),
+            lease,
+            config.get("MSG_COLLATE_SECS", MSG_COLLATE_SECS),
+        )
+        start = perf_counter()
+        if args.command == "create":
+            scheduler.schedule_next_arenas()
+        else:
+            scheduler.send_scheduled_messages()
+        logger.info(f"{args.command} pass took {perf_counter() - start:.3f} s")
+    finally:
+        with Db() as db:
+            db.release_lease(lease.holder)
+
+
+if __name__ == "__main__":
+    main()
@@ -8,7 +8,7 @@ CREATE TABLE schedules (
     -- 3xxx every xxx months
     -- 100ab every a-th weekday b of the month (a == 4 means always the last, b == 0 means Monday)
     -- 2000x every day except x (1-7 for Mon-Sun)
-    scheduleTime INT NOT NULL, -- in UTC minutes
+    scheduleTime INT NOT NULL, -- in minutes, UTC unless timezone is set
     scheduleStart INT, -- unix time in secs when to first schedule this tournament
     scheduleEnd INT, -- unix time in secs when to stop scheduling this tournament
     name TEXT NOT NULL,
@@ -33,8 +33,10 @@ CREATE TABLE schedules (
     teamBattleLeaders INT,
     daysInAdvance INT,
     msgMinutesBefore INT,
-    msgTemplate TEXT
+    msgTemplate TEXT,
+    timezone TEXT -- IANA name, scheduleDay and scheduleTime are in its local time
 );
+CREATE INDEX schedulesTeam ON schedules (team);
 
 CREATE TABLE createdArenas (
     id TEXT NOT NULL,
@@ -43,6 +45,8 @@ CREATE TABLE createdArenas (
     time INT NOT NULL,
     error TEXT
 );
+CREATE INDEX createdArenasTeamTime ON createdArenas (team, time);
+CREATE INDEX createdArenasScheduleTime ON createdArenas (scheduleId, time);
 
 CREATE TABLE scheduledMsgs (
     arenaId TEXT NOT NULL,
@@ -52,6 +56,7 @@ CREATE TABLE scheduledMsgs (
     minutesBefore INT NOT NULL,
     sendTime INT NOT NULL
 );
+CREATE INDEX scheduledMsgsTeam ON scheduledMsgs (team);
 
 CREATE TABLE msgTokens (
     token TEXT NOT NULL,
@@ -60,3 +65,45 @@ CREATE TABLE msgTokens (
     isBad BOOLEAN NOT NULL,
     temporary BOOLEAN NOT NULL
 );
+
+CREATE TABLE schedulerLease (
+    id INT NOT NULL PRIMARY KEY, -- always 0
+    holder TEXT NOT NULL, -- host:pid of the process running the scheduler
+    expires INT NOT NULL -- unix time in secs
+);
+
+-- with sharding, the live scheduler nodes and which of them schedules a team
+CREATE TABLE schedulerNodes (
+    id TEXT NOT NULL PRIMARY KEY, -- host:pid
+    expires INT NOT NULL -- unix time in secs
+);
+
+CREATE TABLE teamShards (
+    team TEXT NOT NULL PRIMARY KEY,
+    node TEXT NOT NULL, -- schedulerNodes.id running the scheduler for the team
+    assigned INT NOT NULL -- unix time in secs
+);
+CREATE INDEX teamShardsNode ON teamShards (node);
+
+CREATE TABLE scheduleBattleTeams (
+    scheduleId INT NOT NULL,
+    alternative BOOLEAN NOT NULL, -- from teamBattleAlternativeTeams
+    position INT NOT NULL, -- line in the team list
+    teamId TEXT NOT NULL
+);
+CREATE INDEX scheduleBattleTeamsSchedule ON scheduleBattleTeams (scheduleId);
+CREATE INDEX scheduleBattleTeamsTeam ON scheduleBattleTeams (teamId);
+
+-- append-only journal of the scheduler's outcomes
+CREATE TABLE schedulerEvents (
+    id INTEGER NOT NULL PRIMARY KEY AUTOINCREMENT,
+    time INT NOT NULL, -- unix time in secs of the event
+    kind TEXT NOT NULL, -- see EVENT_KINDS in model.py
+    team TEXT NOT NULL,
+    scheduleId INT,
+    arenaId TEXT,
+    at INT, -- start of the tournament
+    detail TEXT
+);
+CREATE INDEX schedulerEventsTeamTime ON schedulerEvents (team, time);
+CREATE INDEX schedulerEventsScheduleAt ON schedulerEvents (scheduleId, at);
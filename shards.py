@@ -0,0 +1,36 @@
+from __future__ import annotations
+
+import hashlib
+from bisect import bisect_right
+from typing import Dict, Iterable, Optional, cast
+
+# points per node on the ring, more spread the teams more evenly
+VNODES = 64
+
+
+def point(key: str) -> int:
+    return int.from_bytes(hashlib.md5(key.encode()).digest()[:8], "big")
+
+
+class HashRing:
+    """
+    Consistent hashing of teams onto scheduler nodes: when a node joins or
+    leaves, only the teams between its points and their predecessors move.
+    """
+
+    def __init__(self, nodes: Iterable[str], vnodes: int = VNODES) -> None:
+        ring = sorted(
+            (point(f"{node}#{i}"), node) for node in nodes for i in range(vnodes)
+        )
+        self.points = [p for p, _ in ring]
+        self.nodes = [node for _, node in ring]
+
+    def owner(self, key: str) -> Optional[str]:
+        if not self.points:
+            return None
+        return self.nodes[bisect_right(self.points, point(key)) % len(self.points)]
+
+    def assign(self, keys: Iterable[str]) -> Dict[str, str]:
+        if not self.points:
+            return {}
+        return {key: cast(str, self.owner(key)) for key in keys}
@@ -0,0 +1,280 @@
+#!/usr/bin/env python3
+
+"""
+Replays the scheduler offline against a temporary database and the fake Lichess API
+(api-test-server/app.py) using a simulated clock.
+
+Usage: python simulate.py --schedules schedules.json --days 365
+"""
+
+from __future__ import annotations
+
+import argparse
+import importlib.util
+import json
+import logging
+import os
+import re
+import sqlite3
+import statistics
+import tempfile
+import time as real_time
+from datetime import datetime, timezone
+from itertools import islice
+from math import ceil
+from threading import Thread
+from typing import Any, Callable, Dict, Iterable, List, Optional, Protocol, Tuple, cast
+
+from flask import Flask
+from werkzeug.serving import make_server
+
+import api
+import clock
+import db
+import planner
+from db import Db
+from model import Schedule, ScheduleWithId
+from scheduler import SchedulerThread
+
+FAKE_SERVER_PATH = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "api-test-server", "app.py"
+)
+ARENA_LINK_RE = re.compile(r"/tournament/(\w+)")
+
+
+class FakeLichess(Protocol):
+    """The module api-test-server/app.py."""
+
+    app: Flask
+    now: Callable[[], float]
+    leader_teams: List[str]
+    calls: List[Tuple[float, str, str, Dict[str, str]]]
+    arenas: Dict[str, Dict[str, str]]
+    created_at: Dict[str, float]
+
+
+def load_fake_lichess() -> FakeLichess:
+    spec = importlib.util.spec_from_file_location("fake_lichess", FAKE_SERVER_PATH)
+    assert spec and spec.loader
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return cast(FakeLichess, module)
+
+
+def start_fake_lichess(fake: FakeLichess) -> str:
+    """Serves the fake API in a background thread and points `api.HOST` at it."""
+    server = make_server("127.0.0.1", 0, fake.app, threaded=True)
+    Thread(target=server.serve_forever, daemon=True).start()
+    api.HOST = f"http://127.0.0.1:{server.server_port}"
+    return api.HOST
+
+
+def init_temp_db() -> str:
+    fd, path = tempfile.mkstemp(suffix=".sqlite", prefix="simulation-")
+    os.close(fd)
+    os.remove(path)
+    db.DATABASE = path
+    with Db() as d:
+        d.create_tables()
+    return path
+
+
+def remove_db(path: str) -> None:
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+
+
+def load_schedules(path: str) -> List[Schedule]:
+    if path.endswith(".sqlite"):
+        conn = sqlite3.connect(path)
+        conn.row_factory = sqlite3.Row
+        try:
+            return [
+                ScheduleWithId.from_row(row)
+                for row in conn.execute("SELECT * FROM schedules")
+            ]
+        finally:
+            conn.close()
+    with open(path) as f:
+        return [Schedule.from_json(j) for j in json.load(f)]
+
+
+def percentile(values: List[float], p: float) -> Optional[float]:
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def summarize(values: List[float]) -> Dict[str, Optional[float]]:
+    return {
+        "min": min(values, default=None),
+        "median": statistics.median(values) if values else None,
+        "p95": percentile(values, 0.95),
+        "max": max(values, default=None),
+    }
+
+
+def build_report(
+    fake: FakeLichess, start: float, end: float, ticks: int, wall: float
+) -> Dict[str, Any]:
+    conn = sqlite3.connect(db.DATABASE)
+    conn.row_factory = sqlite3.Row
+    try:
+        created = conn.execute(
+            """SELECT createdArenas.id, createdArenas.time, createdArenas.error, schedules.msgMinutesBefore
+               FROM createdArenas JOIN schedules ON schedules.id = createdArenas.scheduleId"""
+        ).fetchall()
+    finally:
+        conn.close()
+
+    msg_sent_at: Dict[str, float] = {}
+    for t, method, path, form in fake.calls:
+        if method == "POST" and path.endswith("/pm-all"):
+            # collated messages link several tournaments
+            for m in ARENA_LINK_RE.finditer(form.get("message", "")):
+                msg_sent_at[m.group(1)] = t
+
+    failed = 0
+    lead_times: List[float] = []
+    msg_lateness: List[float] = []
+    msgs_dropped = 0
+    for row in created:
+        if row["error"] is not None:
+            failed += 1
+            continue
+        if row["id"] in fake.created_at:
+            lead_times.append((row["time"] - fake.created_at[row["id"]]) / 60 / 60)
+        if row["msgMinutesBefore"] and row["msgMinutesBefore"] > 0:
+            send_time = row["time"] - row["msgMinutesBefore"] * 60
+            if row["id"] in msg_sent_at:
+                msg_lateness.append(msg_sent_at[row["id"]] - send_time)
+            elif send_time < end - 30 * 60:  # older msgs are dropped by the scheduler
+                msgs_dropped += 1
+
+    days = (end - start) / 60 / 60 / 24
+    return {
+        "start": datetime.fromtimestamp(start, timezone.utc).isoformat(),
+        "days": days,
+        "ticks": ticks,
+        "arenasCreated": len(created) - failed,
+        "arenasFailed": failed,
+        "arenaLeadTimeHours": summarize(lead_times),
+        "msgsSent": len(msg_lateness),
+        "msgsDropped": msgs_dropped,
+        "msgLatenessSecs": summarize(msg_lateness),
+        "apiCalls": len(fake.calls),
+        "wallSecs": wall,
+        "ticksPerSec": ticks / wall if wall else None,
+        "simulatedDaysPerSec": days / wall if wall else None,
+    }
+
+
+def next_event(
+    schedules: Iterable[ScheduleWithId], scheduler: SchedulerThread, now: float
+) -> float:
+    """
+    Earliest time after `now` at which a tick could do something: a pending
+    tournament, an occurrence entering the days in advance window of its
+    schedule or dropping out of next_times, a due message or the end of
+    rate-limiting. Ticks before that find nothing to do.
+    """
+    with Db() as d:
+        if planner.pending(schedules, d.created_upcoming_or_failed(), now):
+            return now
+    events: List[float] = []
+    day = 24 * 60 * 60
+    for s in schedules:
+        window = now + s.days_in_advance * day
+        for start, offset in ((window, s.days_in_advance * day), (now, -1)):
+            after = datetime.utcfromtimestamp(int(start) + 1)
+            first = list(islice(s.occurrences(after, int(start) + 400 * day), 1))
+            if first:
+                events.append(first[0] - offset)
+
+    conn = sqlite3.connect(db.DATABASE)
+    try:
+        send = conn.execute("SELECT MIN(sendTime) FROM scheduledMsgs").fetchone()[0]
+    finally:
+        conn.close()
+    if send is not None:
+        events.append(send + 1)  # sent once the time is past
+    if scheduler.arenas_rate_limited_until is not None:
+        events.append(scheduler.arenas_rate_limited_until)
+    return min(events, default=float("inf"))
+
+
+def simulate(
+    schedules: List[Schedule], start: float, days: float, step: int
+) -> Dict[str, Any]:
+    fake = load_fake_lichess()
+    fake_clock = clock.FakeClock(start)
+    fake.now = fake_clock.time
+    fake.leader_teams = sorted(set(s.team for s in schedules))
+    start_fake_lichess(fake)
+
+    path = init_temp_db()
+    old_clock = clock.current
+    clock.current = fake_clock
+    try:
+        with Db() as d:
+            for s in schedules:
+                d.insert_schedule(s)
+            for team in fake.leader_teams:
+                d.set_token_for_team(team, "simulation", "benwerner")
+            stored = d.schedules()
+
+        scheduler = SchedulerThread("simulation")
+        end = start + days * 24 * 60 * 60
+        ticks = 0
+        wall_start = real_time.perf_counter()
+        while fake_clock.time() < end:
+            scheduler.tick()
+            ticks += 1
+            # skips the ticks that would find nothing to do, keeping the
+            # times of the others
+            now = fake_clock.time()
+            event = next_event(stored, scheduler, now)
+            fake_clock.advance(max(1, ceil((event - now) / step)) * step)
+        wall = real_time.perf_counter() - wall_start
+
+        return build_report(fake, start, end, ticks, wall)
+    finally:
+        clock.current = old_clock
+        remove_db(path)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--schedules",
+        required=True,
+        help="JSON file with a list of schedules (as sent to /create) or a database.sqlite to copy them from",
+    )
+    parser.add_argument("--days", type=float, default=365)
+    parser.add_argument(
+        "--start",
+        type=lambda s: datetime.fromisoformat(s).replace(tzinfo=timezone.utc),
+        default=None,
+        help="UTC start date (YYYY-MM-DD), defaults to now",
+    )
+    parser.add_argument(
+        "--step",
+        type=int,
+        default=60,
+        help="simulated seconds between scheduler ticks (must stay below the 30 minute message window)",
+    )
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    logging.getLogger("scheduler").setLevel(logging.WARNING)
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)
+
+    start = args.start.timestamp() if args.start else real_time.time()
+    report = simulate(load_schedules(args.schedules), start, args.days, args.step)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
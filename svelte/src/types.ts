@@ -27,6 +27,7 @@ export interface Schedule {
   daysInAdvance?: number;
   msgMinutesBefore?: number;
   msgTemplate?: string;
+  timezone?: string;
 }
 
 export type Schedules = [string, Schedule[]][] | null;
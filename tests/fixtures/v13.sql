@@ -0,0 +1,77 @@
+CREATE TABLE schedules (
+    id INTEGER NOT NULL PRIMARY KEY AUTOINCREMENT,
+    scheduleDay INT NOT NULL,
+    -- 0 every day
+    -- 1-7 on that weekday (Mon-Sun)
+    -- 1xxx every xxx days
+    -- 2xxx every xxx weeks
+    -- 3xxx every xxx months
+    -- 100ab every a-th weekday b of the month (a == 4 means always the last, b == 0 means Monday)
+    -- 2000x every day except x (1-7 for Mon-Sun)
+    scheduleTime INT NOT NULL, -- in UTC minutes
+    scheduleStart INT, -- unix time in secs when to first schedule this tournament
+    scheduleEnd INT, -- unix time in secs when to stop scheduling this tournament
+    name TEXT NOT NULL,
+    team TEXT NOT NULL,
+    clock FLOAT NOT NULL,
+    increment INT NOT NULL,
+    minutes INT NOT NULL,
+    variant TEXT NOT NULL,
+    rated BOOLEAN NOT NULL,
+    position TEXT,
+    berserkable BOOLEAN NOT NULL,
+    streakable BOOLEAN NOT NULL,
+    description TEXT,
+    minRating INT,
+    maxRating INT,
+    minGames INT,
+    minAccountAgeInDays INT,
+    allowBots BOOLEAN NOT NULL,
+    teamBattleTeams TEXT,
+    teamBattleAlternativeTeamsEnabled BOOLEAN,
+    teamBattleAlternativeTeams TEXT,
+    teamBattleLeaders INT,
+    daysInAdvance INT,
+    msgMinutesBefore INT,
+    msgTemplate TEXT
+);
+
+CREATE TABLE createdArenas (
+    id TEXT NOT NULL,
+    scheduleId INT NOT NULL,
+    team TEXT NOT NULL,
+    time INT NOT NULL,
+    error TEXT
+);
+
+CREATE TABLE scheduledMsgs (
+    arenaId TEXT NOT NULL,
+    scheduleId INT NOT NULL,
+    team TEXT NOT NULL,
+    template TEXT NOT NULL,
+    minutesBefore INT NOT NULL,
+    sendTime INT NOT NULL
+);
+
+CREATE TABLE msgTokens (
+    token TEXT NOT NULL,
+    team TEXT NOT NULL UNIQUE,
+    user TEXT NOT NULL,
+    isBad BOOLEAN NOT NULL,
+    temporary BOOLEAN NOT NULL
+);
+
+INSERT INTO schedules (scheduleDay, scheduleTime, name, team, clock, increment, minutes, variant, rated, berserkable, streakable, allowBots, teamBattleTeams, teamBattleAlternativeTeamsEnabled, teamBattleAlternativeTeams, teamBattleLeaders, daysInAdvance, msgMinutesBefore, msgTemplate)
+VALUES (1, 1200, 'Weekly battle', 'lichess-chess960', 3, 2, 90, 'chess960', 1, 1, 1, 0, 'lichess-chess960 leaders
+lichess-atomic', 1, 'lichess-horde
+lichess-antichess', 3, 7, 30, 'Starting soon: {link}');
+
+INSERT INTO schedules (scheduleDay, scheduleTime, name, team, clock, increment, minutes, variant, rated, berserkable, streakable, allowBots)
+VALUES (0, 600, 'Daily arena', 'lichess-atomic', 1, 0, 60, 'atomic', 1, 1, 0, 0);
+
+INSERT INTO createdArenas (id, scheduleId, team, time) VALUES ('abcd1234', 1, 'lichess-chess960', 1792418400);
+INSERT INTO scheduledMsgs (arenaId, scheduleId, team, template, minutesBefore, sendTime)
+VALUES ('abcd1234', 1, 'lichess-chess960', 'Starting soon: {link}', 30, 1792416600);
+INSERT INTO msgTokens (token, team, user, isBad, temporary) VALUES ('lip_x', 'lichess-chess960', 'benwerner', 0, 0);
+
+PRAGMA user_version = 13;
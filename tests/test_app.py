@@ -0,0 +1,28 @@
+from __future__ import annotations
+
+from typing import List
+
+import pytest
+
+import app
+
+
+@pytest.mark.parametrize(
+    "start_scheduler, start, started",
+    [(True, True, 1), (True, False, 0), (False, True, 0)],
+)
+def test_create_app_starts_scheduler(
+    config: str,
+    monkeypatch: pytest.MonkeyPatch,
+    start_scheduler: bool,
+    start: bool,
+    started: int,
+) -> None:
+    calls: List[None] = []
+    monkeypatch.setattr(app, "start_background", lambda: calls.append(None))
+    with open(config, "a") as f:
+        f.write(f"START_SCHEDULER = {start_scheduler}\n")
+
+    app.create_app(config, start)
+    assert len(calls) == started
+    assert app.settings.start_scheduler == start_scheduler
@@ -0,0 +1,107 @@
+from __future__ import annotations
+
+import os
+import sqlite3
+from typing import List
+
+import pytest
+
+import backup
+import clock
+import metrics
+from db import Db
+from model import Schedule
+
+SCHEDULE = {
+    "name": "Daily",
+    "team": "lichess-chess960",
+    "scheduleDay": 0,
+    "scheduleTime": 600,
+    "clock": 3,
+    "increment": 2,
+    "minutes": 60,
+    "variant": "chess960",
+    "rated": True,
+    "berserkable": True,
+    "streakable": False,
+    "allowBots": False,
+}
+
+
+def num_schedules(path: str) -> int:
+    conn = sqlite3.connect(path)
+    try:
+        return int(conn.execute("SELECT COUNT(*) FROM schedules").fetchone()[0])
+    finally:
+        conn.close()
+
+
+@pytest.fixture
+def schedules(database: str) -> int:
+    with Db() as d:
+        d.create_tables()
+        for i in range(300):
+            d.insert_schedule(Schedule.from_json({**SCHEDULE, "name": f"S{i}"}))
+    return 300
+
+
+def test_backup_rotates_and_restores(
+    schedules: int, database: str, tmp_path: str, fake_clock: clock.FakeClock
+) -> None:
+    directory = os.path.join(tmp_path, "backups")
+    paths: List[str] = []
+    for _ in range(4):
+        paths.append(backup.backup(directory, keep=3, check=True, pages=4))
+        fake_clock.advance(60)
+    assert backup.snapshots(directory) == paths[1:]
+    assert num_schedules(paths[-1]) == schedules
+    assert not [name for name in os.listdir(directory) if name.endswith(".tmp")]
+
+    with Db() as d:
+        for s in d.schedules():
+            d.delete_schedule(s.id)
+    backup.restore(paths[-1])
+    assert num_schedules(database) == schedules
+
+
+def test_backup_restarts_after_writes(
+    schedules: int, tmp_path: str, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    steps: List[float] = []
+
+    def write_between_steps(secs: float) -> None:
+        # another connection writes while the backup is copying
+        steps.append(secs)
+        if len(steps) == 5:
+            with Db() as d:
+                d.insert_schedule(Schedule.from_json(SCHEDULE))
+
+    monkeypatch.setattr(backup, "real_sleep", write_between_steps)
+    restarted = metrics.BACKUPS.values.get(("restarted",), 0)
+    path = backup.backup(os.path.join(tmp_path, "backups"), pages=1)
+    assert metrics.BACKUPS.values[("restarted",)] == restarted + 1
+    assert num_schedules(path) == schedules + 1
+
+
+def test_restore_refuses_corrupt_snapshots(database: str, tmp_path: str) -> None:
+    path = os.path.join(tmp_path, "corrupt.sqlite")
+    with open(path, "wb") as f:
+        f.write(b"SQLite format 3\0" + b"\xff" * 4096)
+    with pytest.raises(Exception):
+        backup.restore(path)
+
+
+def test_backup_is_due_after_the_interval(
+    schedules: int,
+    tmp_path: str,
+    fake_clock: clock.FakeClock,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    monkeypatch.setattr(backup, "BACKUP_DIR", os.path.join(tmp_path, "backups"))
+    thread = backup.BackupThread()
+    assert thread.due()
+    path = backup.backup(backup.BACKUP_DIR)
+    os.utime(path, (fake_clock.time(), fake_clock.time()))
+    assert not thread.due()
+    fake_clock.advance(backup.BACKUP_INTERVAL_SECS + 1)
+    assert thread.due()
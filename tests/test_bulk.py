@@ -0,0 +1,96 @@
+from __future__ import annotations
+
+from typing import Any, Dict
+
+import pytest
+from flask.testing import FlaskClient
+
+import api
+import bulk
+import clock
+from db import Db
+from model import CreatedArena, Schedule
+from simulate import FakeLichess
+
+SCHEDULE: Dict[str, Any] = {
+    "name": "Daily {n}",
+    "team": "lichess-chess960",
+    "scheduleDay": 0,
+    "scheduleTime": 600,
+    "clock": 3,
+    "increment": 2,
+    "minutes": 60,
+    "variant": "chess960",
+    "rated": True,
+    "berserkable": True,
+    "streakable": False,
+    "allowBots": False,
+    "description": "[next](next)",
+    "daysInAdvance": 1,
+}
+
+
+def test_shift_keeps_arena_settings(
+    fake_lichess: FakeLichess, client: FlaskClient, fake_clock: clock.FakeClock
+) -> None:
+    s = Schedule.from_json(SCHEDULE)
+    at = int(fake_clock.time()) + 24 * 60 * 60
+    id, _ = api.schedule_arena(s, at, "", 1, None)
+    # edited through /editArena after it was created
+    fake_lichess.arenas[id].update(name="Renamed", description="Our own")
+    with Db() as d:
+        d.insert_schedule(s)
+        d.insert_created(id, 1, s.team, at)
+        d.insert_scheduled_msg(id, 1, s.team, "Soon: {link}", 30, at - 30 * 60)
+
+    response = client.post(
+        "/bulkArenas", json={"action": "shift", "ids": [id], "shiftMinutes": 90}
+    )
+    assert response.get_json() == {"ok": True, "results": [{"id": id, "ok": True}]}
+
+    arena = fake_lichess.arenas[id]
+    assert arena["name"] == "Renamed"
+    assert arena["description"] == "Our own"
+    assert int(arena["startDate"]) == (at + 90 * 60) * 1000
+    with Db() as d:
+        assert d.created(id) == CreatedArena(id, 1, s.team, at + 90 * 60)
+        # the message moved along
+        fake_clock.advance(at - 30 * 60 - fake_clock.time())
+        assert d.get_and_remove_scheduled_msgs() == []
+        fake_clock.advance(90 * 60 + 1)
+        assert [m.arenaId for m in d.get_and_remove_scheduled_msgs()] == [id]
+
+
+def test_rejects_invalid_ids(client: FlaskClient) -> None:
+    response = client.post("/bulkArenas", json={"action": "cancel", "ids": [1]})
+    assert response.status_code == 400
+    assert response.get_json()["description"] == "Invalid value for ids: [1]"
+
+
+def test_rejects_too_many_ids_before_selecting(
+    client: FlaskClient, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    def select(op: Any) -> Any:
+        raise AssertionError("selected")
+
+    monkeypatch.setattr(bulk, "select", select)
+    ids = [f"arena{i:03}" for i in range(bulk.MAX_ARENAS + 1)]
+    response = client.post("/bulkArenas", json={"action": "cancel", "ids": ids})
+    assert response.status_code == 400
+    assert response.get_json()["description"].startswith(
+        f"At most {bulk.MAX_ARENAS} tournaments"
+    )
+
+
+def test_pacer_spaces_calls_and_skips_when_used_up(
+    fake_clock: clock.FakeClock, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    monkeypatch.setattr(bulk, "BUDGET_CAPACITY", 5)
+    pacer = bulk.Pacer()
+    starts = [pacer.reserve() for _ in range(20)]
+    reserved = [t for t in starts if t is not None]
+    assert reserved[0] == fake_clock.time()
+    assert all(b - a >= bulk.CALL_INTERVAL_SECS for a, b in zip(reserved, reserved[1:]))
+    assert reserved[-1] <= fake_clock.time() + bulk.MAX_WAIT_SECS
+    # beyond the burst, calls follow the refill rate until the wait is too long
+    assert len(reserved) < 20 and starts[len(reserved)] is None
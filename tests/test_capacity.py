@@ -0,0 +1,46 @@
+from __future__ import annotations
+
+import calendar
+from typing import Any, Dict
+
+import capacity
+from model import ScheduleWithId
+
+SCHEDULE: Dict[str, Any] = {
+    "id": 1,
+    "name": "Daily",
+    "team": "lichess-chess960",
+    "scheduleDay": 0,
+    "scheduleTime": 600,
+    "clock": 3,
+    "increment": 2,
+    "minutes": 60,
+    "variant": "chess960",
+    "rated": True,
+    "berserkable": True,
+    "streakable": False,
+    "allowBots": False,
+    "daysInAdvance": 1,
+    "msgMinutesBefore": 30,
+    "msgTemplate": "Soon: {link}",
+}
+
+
+def test_report_counts_messages_with_template() -> None:
+    start = calendar.timegm((2025, 1, 1, 0, 0, 0))
+    schedules = [
+        ScheduleWithId.from_json(SCHEDULE),
+        ScheduleWithId.from_json({**SCHEDULE, "id": 2, "msgTemplate": None}),
+        ScheduleWithId.from_json({**SCHEDULE, "id": 3, "msgMinutesBefore": None}),
+    ]
+    report = capacity.report(schedules, start, 7, 200, 600)
+    assert report["totals"]["create"] == 3 * 7
+    assert report["totals"]["pm"] == 7 * capacity.PM_CALLS
+
+
+def test_report_spans_month_ends() -> None:
+    # the last Friday, which is the 31st in January 2025
+    s = ScheduleWithId.from_json({**SCHEDULE, "scheduleDay": 10044})
+    start = calendar.timegm((2025, 1, 1, 0, 0, 0))
+    report = capacity.report([s], start, 60, 200, 600)
+    assert report["totals"]["create"] == 2
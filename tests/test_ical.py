@@ -0,0 +1,58 @@
+from __future__ import annotations
+
+from typing import Any, Dict, List
+
+import pytest
+from flask.testing import FlaskClient
+
+import clock
+import ical
+from db import Db
+from model import Schedule
+
+SCHEDULE: Dict[str, Any] = {
+    "name": "Daily",
+    "team": "lichess-chess960",
+    "scheduleDay": 0,
+    "scheduleTime": 600,
+    "clock": 3,
+    "increment": 2,
+    "minutes": 60,
+    "variant": "chess960",
+    "rated": True,
+    "berserkable": True,
+    "streakable": False,
+    "allowBots": False,
+    "daysInAdvance": 7,
+}
+
+
+def stamps(body: str) -> List[str]:
+    return [line for line in body.split("\r\n") if line.startswith("DTSTAMP:")]
+
+
+def test_dtstamp_is_generation_time(
+    client: FlaskClient, fake_clock: clock.FakeClock, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    monkeypatch.setattr(ical, "cache", {})
+    with Db() as d:
+        d.insert_schedule(Schedule.from_json(SCHEDULE))
+
+    first = client.get("/calendar/lichess-chess960.ics")
+    assert set(stamps(first.text)) == {
+        f"DTSTAMP:{ical.timestamp(int(fake_clock.time()))}"
+    }
+
+    # regenerated later with the same events: new stamps, same ETag
+    ical.cache.clear()
+    fake_clock.advance(60)
+    second = client.get("/calendar/lichess-chess960.ics")
+    assert set(stamps(second.text)) == {
+        f"DTSTAMP:{ical.timestamp(int(fake_clock.time()))}"
+    }
+    assert second.headers["ETag"] == first.headers["ETag"]
+    response = client.get(
+        "/calendar/lichess-chess960.ics",
+        headers={"If-None-Match": first.headers["ETag"]},
+    )
+    assert response.status_code == 304
@@ -0,0 +1,100 @@
+from __future__ import annotations
+
+import json
+from typing import Any, Dict
+
+import pytest
+from flask.testing import FlaskClient
+
+import app
+from auth import User
+from db import Db
+from model import Schedule
+
+SCHEDULE: Dict[str, Any] = {
+    "name": "Daily",
+    "team": "lichess-chess960",
+    "scheduleDay": 0,
+    "scheduleTime": 600,
+    "clock": 3,
+    "increment": 2,
+    "minutes": 60,
+    "variant": "chess960",
+    "rated": True,
+    "berserkable": True,
+    "streakable": False,
+    "allowBots": False,
+    "daysInAdvance": 7,
+}
+
+
+def ndjson(*lines: Any) -> str:
+    return "\n".join(
+        line if isinstance(line, str) else json.dumps(line) for line in lines
+    )
+
+
+def test_import_reports_errors_by_line(
+    client: FlaskClient, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    monkeypatch.setattr(app, "auth", lambda: User(False, ["lichess-chess960"], "t"))
+    missing = {k: v for k, v in SCHEDULE.items() if k != "clock"}
+    body = ndjson(
+        SCHEDULE,
+        "{not json",
+        "",
+        [SCHEDULE],
+        missing,
+        {**SCHEDULE, "team": "lichess-atomic"},
+    )
+
+    response = client.post("/import", data=body)
+    assert response.status_code == 400
+    errors = response.get_json()["errors"]
+    # blank lines count, the JSON error text is up to the json module
+    assert [e["line"] for e in errors] == [2, 4, 5, 6]
+    assert [e["error"] for e in errors[1:]] == [
+        "Expected a JSON object",
+        "Missing key: clock",
+        "Not a leader of lichess-atomic",
+    ]
+    # all or nothing
+    with Db() as d:
+        assert d.schedules() == []
+
+
+def test_export_imports_back(client: FlaskClient) -> None:
+    body = ndjson(SCHEDULE, {**SCHEDULE, "team": "lichess-atomic"})
+    response = client.post("/import", data=body)
+    assert response.get_json() == {"ok": True, "imported": 2}
+
+    exported = client.get("/export").text
+    with Db() as d:
+        for s in d.schedules():
+            d.delete_schedule(s.id)
+    assert client.post("/import", data=exported).get_json()["imported"] == 2
+    assert client.get("/export").text.count("\n") == 2
+
+
+def test_import_stores_battle_teams_like_create(client: FlaskClient) -> None:
+    battle = {
+        **SCHEDULE,
+        "teamBattleTeams": "lichess-atomic\nlichess-chess960",
+        "teamBattleAlternativeTeamsEnabled": True,
+        "teamBattleAlternativeTeams": "lichess-horde",
+    }
+    # alternative teams without regular ones aren't a team battle
+    alternatives_only = {**battle, "teamBattleTeams": None}
+    with Db() as d:
+        for j in (battle, alternatives_only):
+            d.insert_schedule(Schedule.from_json(j))
+    response = client.post("/import", data=ndjson(battle, alternatives_only))
+    assert response.get_json()["imported"] == 2
+
+    with Db() as d:
+        created, imported = d.schedules()[:2], d.schedules()[2:]
+    for a, b in zip(created, imported):
+        assert a.battle_team_ids() == b.battle_team_ids()
+        assert a.alternative_battle_team_ids() == b.alternative_battle_team_ids()
+    assert imported[0].battle_team_ids() == ["lichess-atomic", "lichess-chess960"]
+    assert imported[1].alternative_battle_team_ids() == ["lichess-horde"]
@@ -0,0 +1,71 @@
+from __future__ import annotations
+
+from typing import Any, List
+
+import pytest
+from flask.testing import FlaskClient
+
+import app
+import metrics
+import scheduler
+
+
+@pytest.fixture
+def registry(monkeypatch: pytest.MonkeyPatch) -> List[metrics.Metric]:
+    registry: List[metrics.Metric] = []
+    monkeypatch.setattr(metrics, "REGISTRY", registry)
+    return registry
+
+
+def test_exposition(registry: List[metrics.Metric]) -> None:
+    counter = metrics.Counter("calls_total", "Calls", ("team",))
+    counter.inc('a"b')
+    counter.inc('a"b', amount=2)
+    histogram = metrics.Histogram("latency_seconds", "Latency", buckets=(0.1, 1))
+    histogram.observe(0.05)
+    histogram.observe(5)
+    assert metrics.expose().splitlines() == [
+        "# HELP calls_total Calls",
+        "# TYPE calls_total counter",
+        'calls_total{team="a\\"b"} 3',
+        "# HELP latency_seconds Latency",
+        "# TYPE latency_seconds histogram",
+        'latency_seconds_bucket{le="0.1"} 1',
+        'latency_seconds_bucket{le="1"} 1',
+        'latency_seconds_bucket{le="+Inf"} 2',
+        "latency_seconds_sum 5.05",
+        "latency_seconds_count 2",
+    ]
+
+
+def test_failing_gauge_func_is_nan(registry: List[metrics.Metric]) -> None:
+    def fail() -> float:
+        raise RuntimeError("database is locked")
+
+    metrics.GaugeFunc("queue_depth", "Depth", fail)
+    metrics.GaugeFunc("up", "Up", lambda: 1)
+    assert metrics.expose().splitlines()[-4:] == [
+        "queue_depth NaN",
+        "# HELP up Up",
+        "# TYPE up gauge",
+        "up 1",
+    ]
+
+
+def test_metrics_endpoint(client: FlaskClient, monkeypatch: pytest.MonkeyPatch) -> None:
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert "\nscheduler_msg_queue_depth 0\n" in response.text
+
+    def broken(*args: Any) -> Any:
+        raise RuntimeError("no database")
+
+    monkeypatch.setattr(scheduler, "Db", broken)
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert "\nscheduler_msg_queue_depth NaN\n" in response.text
+
+    monkeypatch.setattr(app.settings, "metrics_token", "secret")
+    assert client.get("/metrics").status_code == 401
+    response = client.get("/metrics", headers={"Authorization": "Bearer secret"})
+    assert response.status_code == 200
@@ -0,0 +1,58 @@
+from __future__ import annotations
+
+import os
+import sqlite3
+from typing import Dict, Set
+
+import db
+from conftest import load_fixture
+from db import Db
+
+
+def tables(conn: sqlite3.Connection) -> Dict[str, Set[str]]:
+    names = [
+        row[0]
+        for row in conn.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%'"
+        )
+    ]
+    return {
+        name: set(row[1] for row in conn.execute(f"PRAGMA table_info({name})"))
+        for name in names
+    }
+
+
+def test_migrates_v13_database(database: str) -> None:
+    load_fixture(database, "v13")
+    with Db() as d:
+        d.create_tables()
+        schedules = {s.id: s for s in d.schedules()}
+        assert d.created("abcd1234") is not None
+        assert d.scheduled_msg("abcd1234") is not None
+        assert d.token_for_team("lichess-chess960") == "lip_x"
+        assert [id for id, *_ in d.schedules_with_battle_team("lichess-horde")] == [1]
+
+    battle = schedules[1]
+    assert battle.timezone is None
+    assert battle.teamBattleTeamIds == ["lichess-chess960", "lichess-atomic"]
+    assert battle.teamBattleAlternativeTeamIds == [
+        "lichess-horde",
+        "lichess-antichess",
+    ]
+    assert schedules[2].teamBattleTeamIds == []
+
+
+def test_migrations_match_schema(database: str) -> None:
+    load_fixture(database, "v13")
+    with Db() as d:
+        d.create_tables()
+    migrated = sqlite3.connect(database)
+    fresh = sqlite3.connect(":memory:")
+    try:
+        with open(os.path.join(db.ROOT, "schema.sql")) as f:
+            fresh.executescript(f.read())
+        assert migrated.execute("PRAGMA user_version").fetchone()[0] == db.VERSION
+        assert tables(migrated) == tables(fresh)
+    finally:
+        migrated.close()
+        fresh.close()
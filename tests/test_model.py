@@ -0,0 +1,122 @@
+from __future__ import annotations
+
+import calendar
+from datetime import datetime, timezone
+from itertools import islice
+from typing import Any, Dict, List
+
+import pytest
+
+from model import SCHEDULE_FIELDS, Schedule, ScheduleWithId, XofMonth
+
+SCHEDULE: Dict[str, Any] = {
+    "name": "Weekly {nth}",
+    "team": "lichess-chess960",
+    "scheduleDay": 10004,
+    "scheduleTime": 1200,
+    "clock": 3,
+    "increment": 2,
+    "minutes": 90,
+    "variant": "chess960",
+    "rated": True,
+    "berserkable": False,
+    "streakable": True,
+    "allowBots": False,
+    "description": "[next](next)",
+    "minRating": 1500,
+    "teamBattleTeams": "lichess-chess960\nlichess-atomic",
+    "teamBattleLeaders": 3,
+    "daysInAdvance": 7,
+    "msgMinutesBefore": 30,
+    "msgTemplate": "Soon: {link}",
+    "timezone": "Europe/Berlin",
+}
+
+
+def test_with_id_keeps_all_fields() -> None:
+    s = Schedule.from_json(SCHEDULE)
+    with_id = s.with_id(42)
+    assert isinstance(with_id, ScheduleWithId)
+    assert with_id.id == 42
+    for name in SCHEDULE_FIELDS:
+        assert getattr(with_id, name) == getattr(s, name), name
+    assert with_id.battle_team_ids() == ["lichess-chess960", "lichess-atomic"]
+    assert ScheduleWithId.from_json({**SCHEDULE, "id": 42}) == with_id
+
+
+def test_to_json_has_only_schedule_fields() -> None:
+    s = ScheduleWithId.from_json({**SCHEDULE, "id": 42})
+    s.battle_team_ids()
+    j = s.to_json()
+    assert list(j) == [*SCHEDULE_FIELDS, "id"]
+    assert ScheduleWithId.from_json(j) == s
+
+
+def test_from_values_decodes_booleans() -> None:
+    s = ScheduleWithId.from_json({**SCHEDULE, "id": 42})
+    values = [int(v) if isinstance(v, bool) else v for v in s.to_json().values()]
+    decoded = ScheduleWithId.from_values(values)
+    assert decoded == s
+    assert decoded.rated is True and decoded.berserkable is False
+
+
+def utc(year: int, month: int, day: int) -> int:
+    return calendar.timegm((year, month, day, 0, 0, 0))
+
+
+def occurrences(s: Schedule, start: datetime, n: int) -> List[datetime]:
+    times = islice(s.occurrences(start, utc(2100, 1, 1)), n)
+    return [datetime.fromtimestamp(t, timezone.utc).replace(tzinfo=None) for t in times]
+
+
+@pytest.mark.parametrize(
+    "weekday, ordinal, date, expected",
+    [
+        # the last Friday of January is the 31st, which February doesn't have
+        (4, 4, datetime(2025, 1, 31, 20), datetime(2025, 2, 28, 20)),
+        (4, 4, datetime(2024, 12, 27, 20), datetime(2025, 1, 31, 20)),
+        # the first Monday
+        (0, 0, datetime(2025, 3, 3), datetime(2025, 4, 7)),
+        # the third Sunday, from the 30th
+        (6, 2, datetime(2025, 8, 30), datetime(2025, 9, 21)),
+    ],
+)
+def test_x_of_month_find_next(
+    weekday: int, ordinal: int, date: datetime, expected: datetime
+) -> None:
+    assert XofMonth(weekday, ordinal).find_next(date) == expected
+
+
+def test_last_weekday_of_month_occurrences() -> None:
+    s = Schedule.from_json({**SCHEDULE, "scheduleDay": 10044, "timezone": None})
+    assert occurrences(s, datetime(2025, 1, 1), 3) == [
+        datetime(2025, 1, 31, 20),
+        datetime(2025, 2, 28, 20),
+        datetime(2025, 3, 28, 20),
+    ]
+
+
+def test_timezone_occurrences_follow_dst() -> None:
+    # 20:00 in Berlin every day, which is 19:00 UTC in winter and 18:00 in summer
+    s = Schedule.from_json({**SCHEDULE, "scheduleDay": 0})
+    assert occurrences(s, datetime(2025, 3, 28), 4) == [
+        datetime(2025, 3, 28, 19),
+        datetime(2025, 3, 29, 19),
+        datetime(2025, 3, 30, 18),
+        datetime(2025, 3, 31, 18),
+    ]
+    assert occurrences(s, datetime(2025, 10, 25), 3) == [
+        datetime(2025, 10, 25, 18),
+        datetime(2025, 10, 26, 19),
+        datetime(2025, 10, 27, 19),
+    ]
+
+
+def test_timezone_find_next_in_gap() -> None:
+    # 02:30 doesn't exist in Berlin on the day clocks go forward
+    s = Schedule.from_json({**SCHEDULE, "scheduleDay": 0, "scheduleTime": 150})
+    assert occurrences(s, datetime(2025, 3, 29), 3) == [
+        datetime(2025, 3, 29, 1, 30),
+        datetime(2025, 3, 30, 1, 30),
+        datetime(2025, 3, 31, 0, 30),
+    ]
@@ -0,0 +1,98 @@
+from __future__ import annotations
+
+from typing import Any, Dict
+
+import pytest
+
+import clock
+import planner
+from model import ScheduleWithId
+
+SCHEDULE: Dict[str, Any] = {
+    "id": 1,
+    "name": "Daily",
+    "team": "lichess-chess960",
+    "scheduleDay": 0,
+    "scheduleTime": 600,
+    "clock": 3,
+    "increment": 2,
+    "minutes": 60,
+    "variant": "chess960",
+    "rated": True,
+    "berserkable": True,
+    "streakable": False,
+    "allowBots": False,
+    "daysInAdvance": 7,
+}
+
+
+def test_token_bucket() -> None:
+    bucket = planner.TokenBucket(2, 60 * 60, 0)
+    assert bucket.available(0) == 2
+    bucket.take(0)
+    bucket.take(0)
+    assert bucket.next_token(0) == 1
+    assert bucket.available(10) == 2
+    bucket.drain(10)
+    assert bucket.next_token(10) == 11
+    bucket.resize(1, 30 * 60, 20)
+    assert bucket.available(100) == 1
+    bucket.take(100)
+    assert bucket.next_token(100) == 102
+
+
+def test_pending_earliest_deadline_first(fake_clock: clock.FakeClock) -> None:
+    now = fake_clock.time()
+    daily = ScheduleWithId.from_json(SCHEDULE)
+    # a message an hour before moves the deadline of the same start earlier
+    with_msg = ScheduleWithId.from_json(
+        {**SCHEDULE, "id": 2, "msgMinutesBefore": 60, "msgTemplate": "Soon"}
+    )
+    work = planner.pending([daily, with_msg], {(1, daily.next_times()[0])}, now)
+    assert all(p.at >= now + planner.MIN_LEAD_SECS for p in work)
+    assert [p.deadline for p in work] == sorted(p.deadline for p in work)
+    assert len(work) == 2 * 5 - 1
+    assert work[0].schedule.id == 2
+    assert work[0].deadline == work[0].at - 60 * 60 - planner.MSG_LEAD_SECS
+
+
+def test_batch_paces_and_catches_up(fake_clock: clock.FakeClock) -> None:
+    now = fake_clock.time()
+    s = ScheduleWithId.from_json(SCHEDULE)
+    far = [planner.Pending(int(now) + 10 * 24 * 60 * 60 + i, s) for i in range(20)]
+    bucket = planner.TokenBucket(100, 600, now)
+    # a tick's share of the refill rate
+    assert len(planner.batch(far, now, bucket)) == 600 * planner.TICK_SECS // 3600
+    slow = planner.TokenBucket(100, 60, now)
+    assert len(planner.batch(far, now, slow)) == 1
+    # unless later ones would miss their deadline at that pace
+    soon = [
+        planner.Pending(int(now) + planner.MIN_LEAD_SECS + 2 * 60, s) for _ in range(5)
+    ]
+    assert len(planner.batch(soon + far, now, slow)) == 5
+    # never more than the budget has
+    assert len(planner.batch(soon, now, planner.TokenBucket(3, 60, now))) == 3
+
+
+@pytest.mark.parametrize("paused", [None, 60 * 60])
+def test_project_flags_late_creations(fake_clock: clock.FakeClock, paused: Any) -> None:
+    now = fake_clock.time()
+    s = ScheduleWithId.from_json(SCHEDULE)
+    at = int(now) + planner.MIN_LEAD_SECS + 30 * 60
+    work = [planner.Pending(at, s) for _ in range(3)]
+    bucket = planner.TokenBucket(1, 2, now)
+    projections = planner.project(
+        work, now, bucket, None if paused is None else now + paused
+    )
+    # one token now, the next ones 30 minutes apart
+    start = now + (paused or 0)
+    assert [p.creation for p in projections] == [
+        start,
+        start + 30 * 60,
+        start + 60 * 60,
+    ]
+    assert [p.late for p in projections] == (
+        [False, False, True] if paused is None else [True, True, True]
+    )
+    # projecting doesn't use up the budget
+    assert bucket.available(now) == 1
@@ -0,0 +1,45 @@
+from __future__ import annotations
+
+import pytest
+from flask.testing import FlaskClient
+
+import profiling
+
+
+def busy() -> int:
+    return sum(range(1000))
+
+
+def test_captures_the_next_n_of_a_target() -> None:
+    profiler = profiling.Profiler()
+    with profiler.capture("ticks"):
+        busy()
+    assert profiler.result("cumulative", 10)["captured"] == 0
+
+    profiler.start("ticks", 2)
+    for target in ("requests", "ticks", "ticks", "ticks"):
+        with profiler.capture(target):
+            busy()
+    result = profiler.result("cumulative", 10)
+    assert (result["captured"], result["remaining"]) == (2, 0)
+    assert "busy" in result["profile"]
+
+
+def test_profile_endpoint_profiles_requests(
+    client: FlaskClient, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    monkeypatch.setattr(profiling, "profiler", profiling.Profiler())
+    response = client.post("/profile", json={"target": "ticks", "count": 0})
+    assert response.status_code == 400
+
+    response = client.post("/profile", json={"target": "requests", "count": 2})
+    assert response.status_code == 200
+    for _ in range(3):
+        client.get("/schedules")
+    result = client.get("/profile?limit=5").get_json()
+    assert (result["target"], result["captured"], result["remaining"]) == (
+        "requests",
+        2,
+        0,
+    )
+    assert client.get("/profile?sort=nonsense").status_code == 400
@@ -0,0 +1,200 @@
+from __future__ import annotations
+
+from typing import List, Optional, Tuple
+
+import pytest
+import requests
+
+import api
+import clock
+import planner
+import scheduler
+from db import Db
+from model import (
+    EVENT_CREATED,
+    EVENT_FAILED,
+    EVENT_RETRIED,
+    Schedule,
+    ScheduleWithId,
+)
+from simulate import FakeLichess
+
+SCHEDULE = {
+    "name": "Daily",
+    "team": "lichess-chess960",
+    "scheduleDay": 0,
+    "scheduleTime": 600,
+    "clock": 3,
+    "increment": 2,
+    "minutes": 60,
+    "variant": "chess960",
+    "rated": True,
+    "berserkable": True,
+    "streakable": False,
+    "allowBots": False,
+    "daysInAdvance": 7,
+}
+
+
+def create_pass(
+    monkeypatch: pytest.MonkeyPatch, lease: scheduler.SchedulerLease, steal_at: int
+) -> List[str]:
+    """Runs a create pass in which another process takes the lease over after
+    `steal_at` arenas, returns the ids of the created arenas."""
+    created: List[str] = []
+    schedule_arena = api.schedule_arena
+
+    def steal(
+        s: ScheduleWithId, at: int, api_key: str, nth: int, prev: Optional[str]
+    ) -> Tuple[str, Optional[str]]:
+        if len(created) == steal_at:
+            with Db() as d:
+                d.release_lease(lease.holder)
+                assert d.acquire_lease("other", scheduler.LEASE_SECS)
+        id, name = schedule_arena(s, at, api_key, nth, prev)
+        created.append(id)
+        return id, name
+
+    monkeypatch.setattr(api, "schedule_arena", steal)
+    # all of them in one pass
+    monkeypatch.setattr(planner, "BUDGET_PER_HOUR", 1_000_000)
+    scheduler.SchedulerThread("", lease).schedule_next_arenas()
+    return created
+
+
+def test_one_shot_pass_renews_its_lease(
+    database: str,
+    fake_clock: clock.FakeClock,
+    fake_lichess: FakeLichess,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    with Db() as d:
+        d.create_tables()
+        # 5 occurrences each
+        for _ in range(6):
+            d.insert_schedule(Schedule.from_json(SCHEDULE))
+    lease = scheduler.OneShotLease()
+    assert lease.keep()
+
+    # 10 s between arenas, longer than LEASE_SECS in total
+    created = create_pass(monkeypatch, lease, steal_at=-1)
+    assert len(created) * 10 > scheduler.LEASE_SECS
+    fake_clock.advance(scheduler.LEASE_SECS // 2)
+    with Db() as d:
+        assert not d.acquire_lease("other", scheduler.LEASE_SECS)
+
+
+def test_one_shot_pass_stops_without_lease(
+    database: str,
+    fake_clock: clock.FakeClock,
+    fake_lichess: FakeLichess,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    with Db() as d:
+        d.create_tables()
+        # 5 occurrences each
+        for _ in range(6):
+            d.insert_schedule(Schedule.from_json(SCHEDULE))
+    lease = scheduler.OneShotLease()
+    assert lease.keep()
+
+    created = create_pass(monkeypatch, lease, steal_at=2)
+    # noticed at the first renewal, 30 s into the pass
+    assert len(created) == scheduler.LEASE_RENEW_SECS // 10
+    assert not lease.held
+    with Db() as d:
+        assert len(d.created_upcoming_or_failed()) == len(created)
+
+
+def test_one_shot_pass_refuses_to_run_next_to_shards(
+    database: str, fake_clock: clock.FakeClock
+) -> None:
+    with Db() as d:
+        d.create_tables()
+        d.heartbeat_node("node-a", scheduler.LEASE_SECS)
+    assert not scheduler.OneShotLease().keep()
+
+    # the node stopped heartbeating
+    fake_clock.advance(scheduler.LEASE_SECS + 1)
+    lease = scheduler.OneShotLease()
+    assert lease.keep()
+
+    # and a sharded deployment started during the pass
+    with Db() as d:
+        d.heartbeat_node("node-a", scheduler.LEASE_SECS)
+    fake_clock.advance(scheduler.LEASE_RENEW_SECS)
+    assert not lease.keep()
+
+
+def test_journals_retry_after_rate_limiting(
+    database: str,
+    fake_clock: clock.FakeClock,
+    fake_lichess: FakeLichess,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    with Db() as d:
+        d.create_tables()
+        d.insert_schedule(Schedule.from_json(SCHEDULE))
+    schedule_arena = api.schedule_arena
+    attempts: List[int] = []
+
+    def rate_limited(
+        s: ScheduleWithId, at: int, api_key: str, nth: int, prev: Optional[str]
+    ) -> Tuple[str, Optional[str]]:
+        attempts.append(at)
+        if len(attempts) == 1:
+            response = requests.Response()
+            response.status_code = 429
+            raise requests.HTTPError("429 Too Many Requests", response=response)
+        return schedule_arena(s, at, api_key, nth, prev)
+
+    monkeypatch.setattr(api, "schedule_arena", rate_limited)
+    thread = scheduler.SchedulerThread("")
+    thread.schedule_next_arenas()
+    fake_clock.advance(60 * 60)
+    thread.schedule_next_arenas()
+
+    at = attempts[0]
+    assert attempts[1] == at
+    with Db() as d:
+        events = d.events(None, None, None, 100)
+    assert [(e.kind, e.at) for e in reversed(events)][:2] == [
+        (EVENT_FAILED, at),
+        (EVENT_RETRIED, at),
+    ]
+    assert all(e.kind == EVENT_CREATED for e in events[:-2])
+
+
+@pytest.mark.parametrize("collate_secs, sent", [(0, [["a1"]]), (120, [["a1", "a2"]])])
+def test_collates_due_messages_of_a_team(
+    database: str,
+    fake_clock: clock.FakeClock,
+    fake_lichess: FakeLichess,
+    collate_secs: int,
+    sent: List[List[str]],
+) -> None:
+    teams = ["lichess-chess960", "lichess-atomic"]
+    fake_lichess.leader_teams = teams
+    fake_lichess.now = fake_clock.time
+    now = int(fake_clock.time())
+    with Db() as d:
+        d.create_tables()
+        for team in teams:
+            d.set_token_for_team(team, "lip_token", "benwerner")
+        for id, team, send in (
+            ("a1", teams[0], now - 1),
+            ("a2", teams[0], now + 60),
+            ("a3", teams[0], now + 600),
+            ("b1", teams[1], now + 60),
+        ):
+            d.insert_scheduled_msg(id, 1, team, "Soon: {link}", 30, send)
+
+    scheduler.SchedulerThread("", collate_secs=collate_secs).send_scheduled_messages()
+
+    pms = [c for c in fake_lichess.calls if c[2].endswith("/pm-all")]
+    assert [path for _, _, path, _ in pms] == ["/team/lichess-chess960/pm-all"]
+    assert [form["message"].split("\n\n") for _, _, _, form in pms] == [
+        [f"Soon: https://lichess.org/tournament/{id}" for id in ids] for ids in sent
+    ]
+    with Db() as d:
+        assert d.num_scheduled_msgs() == 4 - len(sent[0])
@@ -0,0 +1,77 @@
+from __future__ import annotations
+
+from typing import Any, Dict, List
+
+from flask.testing import FlaskClient
+
+from db import Db
+from model import SCHEDULE_JSON_FIELDS, Schedule
+
+SCHEDULE: Dict[str, Any] = {
+    "name": "Daily",
+    "team": "lichess-chess960",
+    "scheduleDay": 0,
+    "scheduleTime": 600,
+    "clock": 3,
+    "increment": 2,
+    "minutes": 60,
+    "variant": "chess960",
+    "rated": True,
+    "berserkable": True,
+    "streakable": False,
+    "allowBots": False,
+    "teamBattleTeams": "lichess-atomic\nlichess-horde",
+    "daysInAdvance": 7,
+}
+
+
+def insert(n: int, **j: Any) -> None:
+    with Db() as d:
+        for i in range(n):
+            d.insert_schedule(Schedule.from_json({**SCHEDULE, "name": f"S{i}", **j}))
+
+
+def ids(body: List[Any]) -> List[int]:
+    return [s["id"] for _, schedules in body for s in schedules]
+
+
+def test_pages_by_cursor(client: FlaskClient) -> None:
+    insert(3)
+    insert(2, team="lichess-atomic")
+
+    pages: List[List[int]] = []
+    cursor = "0"
+    while cursor:
+        response = client.get(f"/schedules?limit=2&cursor={cursor}")
+        pages.append(ids(response.get_json()))
+        cursor = response.headers.get("X-Next-Cursor", "")
+    assert pages == [[1, 2], [3, 4], [5]]
+
+    body = client.get("/schedules?team=lichess-atomic").get_json()
+    assert [team for team, _ in body] == ["lichess-atomic"]
+    assert ids(body) == [4, 5]
+
+
+def test_schedule_json(client: FlaskClient) -> None:
+    insert(1)
+    [[team, [j]]] = [entry for entry in client.get("/schedules").get_json() if entry[1]]
+    assert team == "lichess-chess960"
+    assert list(j) == list(SCHEDULE_JSON_FIELDS)
+    assert j["rated"] is True and j["streakable"] is False
+
+
+def test_filters_and_projects(client: FlaskClient) -> None:
+    insert(12)
+    body = client.get("/schedules?q=S1&fields=name,clock").get_json()
+    names = [s for _, schedules in body for s in schedules]
+    assert names == [
+        {"id": id, "team": "lichess-chess960", "name": name, "clock": 3}
+        for id, name in ((2, "S1"), (11, "S10"), (12, "S11"))
+    ]
+    # LIKE wildcards are matched literally
+    assert ids(client.get("/schedules?q=S_").get_json()) == []
+
+    response = client.get("/schedules?fields=name,teamBattleTeamIds")
+    assert response.status_code == 400
+    assert response.get_json()["description"] == "Unknown fields: teamBattleTeamIds"
+    assert client.get("/schedules?limit=0").status_code == 400
@@ -0,0 +1,177 @@
+from __future__ import annotations
+
+from typing import Any, Dict, List, Optional, Tuple
+
+import pytest
+
+import api
+import clock
+import planner
+import scheduler
+from db import Db
+from model import Schedule, ScheduleWithId
+from shards import HashRing
+from simulate import FakeLichess
+
+SCHEDULE: Dict[str, Any] = {
+    "name": "Daily",
+    "team": "lichess-chess960",
+    "scheduleDay": 0,
+    "scheduleTime": 600,
+    "clock": 3,
+    "increment": 2,
+    "minutes": 60,
+    "variant": "chess960",
+    "rated": True,
+    "berserkable": True,
+    "streakable": False,
+    "allowBots": False,
+    "daysInAdvance": 7,
+}
+TEAMS = [f"team-{i}" for i in range(20)]
+
+
+@pytest.fixture
+def teams(
+    database: str, fake_clock: clock.FakeClock, monkeypatch: pytest.MonkeyPatch
+) -> List[str]:
+    """A schedule for each of TEAMS, with nodes that aren't stuck."""
+    monkeypatch.setattr(scheduler, "last_scheduler_run", fake_clock.time())
+    with Db() as d:
+        d.create_tables()
+        for team in TEAMS:
+            d.insert_schedule(Schedule.from_json({**SCHEDULE, "team": team}))
+    return TEAMS
+
+
+def node(name: str) -> scheduler.ShardLease:
+    lease = scheduler.ShardLease()
+    lease.holder = lease.node = name
+    lease.held = lease.renew()
+    return lease
+
+
+def assignment() -> Dict[str, str]:
+    with Db() as d:
+        return {team: node for team, node, _ in d.shards()}
+
+
+def test_first_node_assigns_teams(
+    teams: List[str], monkeypatch: pytest.MonkeyPatch
+) -> None:
+    b = node("node-b")
+    assert assignment() == {team: "node-b" for team in teams}
+    a = node("node-a")
+    assert a.primary
+    expected = HashRing(["node-a", "node-b"]).assign(teams)
+    assert assignment() == expected
+    assert set(expected.values()) == {"node-a", "node-b"}
+
+    # the others only follow
+    def assign_shards(self: Db, assignment: Dict[str, str]) -> int:
+        raise AssertionError("not the first node")
+
+    monkeypatch.setattr(Db, "assign_shards", assign_shards)
+    assert b.renew()
+    assert not b.primary
+    assert b.budget_share == a.budget_share == 0.5
+
+
+def test_rebalances_when_a_node_leaves(
+    teams: List[str], fake_clock: clock.FakeClock
+) -> None:
+    a, b = node("node-a"), node("node-b")
+    a.renew()
+    assert set(assignment().values()) == {"node-a", "node-b"}
+
+    # node-a stops heartbeating, node-b becomes the first node
+    fake_clock.advance(scheduler.LEASE_SECS + 1)
+    scheduler.last_scheduler_run = fake_clock.time()
+    assert b.renew()
+    assert b.nodes == ["node-b"] and b.budget_share == 1
+    assert assignment() == {team: "node-b" for team in teams}
+
+    # and it comes back, getting the same teams as before
+    a.renew()
+    assert assignment() == HashRing(["node-a", "node-b"]).assign(teams)
+
+
+def create_pass(
+    monkeypatch: pytest.MonkeyPatch,
+    lease: scheduler.ShardLease,
+    after_first: Any,
+) -> List[Tuple[str, int]]:
+    """Runs a create pass of `lease`'s node, calling `after_first` once the
+    first arena is created. Returns the (team, time) of the created arenas."""
+    created: List[Tuple[str, int]] = []
+    schedule_arena = api.schedule_arena
+
+    def create(
+        s: ScheduleWithId, at: int, api_key: str, nth: int, prev: Optional[str]
+    ) -> Tuple[str, Optional[str]]:
+        result = schedule_arena(s, at, api_key, nth, prev)
+        created.append((s.team, at))
+        if len(created) == 1:
+            after_first(s, at)
+        return result
+
+    monkeypatch.setattr(api, "schedule_arena", create)
+    monkeypatch.setattr(planner, "BUDGET_PER_HOUR", 1_000_000)
+    scheduler.SchedulerThread("", lease).schedule_next_arenas()
+    return created
+
+
+def test_handoff_stops_old_owner(
+    teams: List[str], fake_lichess: FakeLichess, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    a = node("node-a")
+    assert len(assignment()) == len(teams)
+
+    def hand_over(s: ScheduleWithId, at: int) -> None:
+        # node-b joined and got the team of the first arena
+        with Db() as d:
+            d.assign_shards({s.team: "node-b"})
+
+    created = create_pass(monkeypatch, a, hand_over)
+    first_team = created[0][0]
+    # 5 occurrences of each team, only the first of the handed over one
+    assert len(created) == 5 * (len(teams) - 1) + 1
+    assert [at for team, at in created if team == first_team] == [created[0][1]]
+
+
+def test_skips_occurrences_created_elsewhere(
+    teams: List[str], fake_lichess: FakeLichess, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    a = node("node-a")
+    other: List[Tuple[str, int]] = []
+
+    def create_elsewhere(s: ScheduleWithId, at: int) -> None:
+        # the previous owner created the next occurrence meanwhile
+        nxt = at + 24 * 60 * 60
+        with Db() as d:
+            d.insert_created("elsewhere", s.id, s.team, nxt)
+        other.append((s.team, nxt))
+
+    created = create_pass(monkeypatch, a, create_elsewhere)
+    assert other[0] not in created
+    assert len(created) == 5 * len(teams) - 1
+    with Db() as d:
+        assert len(d.created_upcoming_or_failed()) == 5 * len(teams)
+
+
+def test_nodes_split_the_budget(
+    teams: List[str], monkeypatch: pytest.MonkeyPatch
+) -> None:
+    monkeypatch.setattr(api, "schedule_arena", None)
+    a, b = node("node-a"), node("node-b")
+    a.renew()
+    thread = scheduler.SchedulerThread("", a)
+    with Db() as d:
+        # nothing is due before the budget is checked
+        for s in d.schedules():
+            for at in s.next_times():
+                d.insert_created(f"{s.id}-{at}", s.id, s.team, at)
+    thread.schedule_next_arenas()
+    assert thread.budget.capacity == planner.BUDGET_CAPACITY / 2
+    assert thread.budget.per_sec * 60 * 60 == pytest.approx(planner.BUDGET_PER_HOUR / 2)
+    assert b.budget_share == 0.5
@@ -0,0 +1,46 @@
+from __future__ import annotations
+
+import clock
+import simulate
+from model import Schedule
+
+SCHEDULE = {
+    "name": "Daily",
+    "team": "lichess-chess960",
+    "scheduleDay": 0,
+    "scheduleTime": 600,
+    "clock": 3,
+    "increment": 2,
+    "minutes": 60,
+    "variant": "chess960",
+    "rated": True,
+    "berserkable": True,
+    "streakable": False,
+    "allowBots": False,
+    "daysInAdvance": 5,
+    "msgMinutesBefore": 30,
+    "msgTemplate": "Soon: {link}",
+}
+
+
+def test_fake_clock() -> None:
+    fake_clock = clock.FakeClock(1_800_000_000)
+    fake_clock.advance(90)
+    assert fake_clock.time() == 1_800_000_090
+
+
+def test_simulates_a_month() -> None:
+    current = clock.current
+    report = simulate.simulate([Schedule.from_json(SCHEDULE)], 1_800_000_000, 30, 60)
+    assert clock.current is current
+
+    assert report["days"] == 30
+    # the daily arenas of the month and those of the days in advance after it
+    assert report["arenasCreated"] == 30 + 5
+    assert report["arenasFailed"] == 0
+    assert report["arenaLeadTimeHours"]["max"] <= 5 * 24
+    assert report["msgsSent"] == 30
+    assert report["msgsDropped"] == 0
+    assert 0 <= report["msgLatenessSecs"]["max"] <= 60
+    # idle ticks are skipped: about one per arena and one per message
+    assert report["ticks"] <= 3 * 30
@@ -0,0 +1,25 @@
+from __future__ import annotations
+
+import json
+
+import pytest
+from flask.testing import FlaskClient
+
+import arenas
+from db import Db
+
+
+def test_team_arenas_reports_failed_team(
+    client: FlaskClient, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    with Db() as d:
+        d.insert_created("abcd1234", 1, "lichess-chess960", 2**40)
+
+    def fail(team: str) -> None:
+        raise Exception("Lichess is down")
+
+    monkeypatch.setattr(arenas.team_arenas, "get", fail)
+    response = client.get("/teamArenas?team=lichess-chess960")
+    assert response.status_code == 200
+    lines = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    assert lines == [{"team": "lichess-chess960", "error": "Failed to load arenas"}]
@@ -0,0 +1,92 @@
+from __future__ import annotations
+
+import sqlite3
+from typing import Any, Dict, List
+
+import pytest
+from flask.testing import FlaskClient
+
+import app
+import db
+from auth import User
+from db import Db
+from model import Schedule
+
+SCHEDULE: Dict[str, Any] = {
+    "name": "Daily",
+    "team": "lichess-chess960",
+    "scheduleDay": 0,
+    "scheduleTime": 600,
+    "clock": 3,
+    "increment": 2,
+    "minutes": 60,
+    "variant": "chess960",
+    "rated": True,
+    "berserkable": True,
+    "streakable": False,
+    "allowBots": False,
+    "msgMinutesBefore": 30,
+    "msgTemplate": "Soon: {link}",
+}
+TEAMS = ["needs-token", "no-messages", "has-token", "bad-token"]
+
+
+@pytest.fixture
+def now(monkeypatch: pytest.MonkeyPatch) -> List[float]:
+    """The monotonic time of the token state cache."""
+    now = [1000.0]
+    monkeypatch.setattr(db, "monotonic", lambda: now[0])
+    monkeypatch.setattr(db, "token_state_cache", {})
+    return now
+
+
+def test_token_states(client: FlaskClient, now: List[float]) -> None:
+    with Db() as d:
+        d.insert_schedule(Schedule.from_json({**SCHEDULE, "team": "needs-token"}))
+        d.insert_schedule(
+            Schedule.from_json({**SCHEDULE, "team": "no-messages", "msgTemplate": None})
+        )
+        d.set_token_for_team("has-token", "lip_a", "alice")
+        d.set_token_for_team("bad-token", "lip_b", "bob")
+        d.mark_bad_token("bad-token", "lip_b")
+        assert d.token_states(TEAMS) == {
+            "needs-token": {"issue": "missing"},
+            "no-messages": {},
+            "has-token": {"user": "alice"},
+            "bad-token": {"issue": "bad"},
+        }
+        assert d.token_state("has-token") == {"user": "alice"}
+        assert d.token_states([]) == {}
+
+
+def test_token_states_cache(client: FlaskClient, now: List[float]) -> None:
+    with Db() as d:
+        d.set_token_for_team("has-token", "lip_a", "alice")
+        assert d.token_states(TEAMS[2:3]) == {"has-token": {"user": "alice"}}
+
+        # writes of this process show up right away
+        d.set_token_for_team("has-token", "lip_c", "carol")
+        assert d.token_states(TEAMS[2:3]) == {"has-token": {"user": "carol"}}
+
+    # those of other processes once the cache expires
+    conn = sqlite3.connect(db.DATABASE)
+    with conn:
+        conn.execute("UPDATE msgTokens SET user = 'dave'")
+    conn.close()
+    with Db() as d:
+        assert d.token_states(TEAMS[2:3]) == {"has-token": {"user": "carol"}}
+        now[0] += db.TOKEN_STATE_CACHE_SECS
+        assert d.token_states(TEAMS[2:3]) == {"has-token": {"user": "dave"}}
+
+
+def test_token_state_endpoint(
+    client: FlaskClient, now: List[float], monkeypatch: pytest.MonkeyPatch
+) -> None:
+    with Db() as d:
+        d.set_token_for_team("lichess-atomic", "lip_a", "alice")
+    assert client.get("/tokenState").get_json() == {
+        "lichess-chess960": {},
+        "lichess-atomic": {"user": "alice"},
+    }
+    monkeypatch.setattr(app, "auth", lambda: User(False, ["lichess-atomic"], "t"))
+    assert client.get("/tokenState").get_json() == {"lichess-atomic": {"user": "alice"}}
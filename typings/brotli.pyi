@@ -0,0 +1,14 @@
+# the parts of the optional brotli package used by responses.py, it ships no stubs
+
+MODE_GENERIC: int
+MODE_TEXT: int
+MODE_FONT: int
+
+def compress(
+    string: bytes,
+    mode: int = ...,
+    quality: int = ...,
+    lgwin: int = ...,
+    lgblock: int = ...,
+) -> bytes: ...
+def decompress(string: bytes) -> bytes: ...
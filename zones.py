@@ -0,0 +1,95 @@
+from __future__ import annotations
+
+import calendar
+from bisect import bisect_right
+from datetime import datetime, timedelta, timezone
+from threading import Lock
+from typing import Dict, List
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+import clock
+
+# years around the current one for which transitions are precomputed, times
+# outside of them fall back to zoneinfo
+YEARS_BEFORE = 1
+YEARS_AFTER = 10
+
+EPOCH = datetime(1970, 1, 1)
+SECOND = timedelta(seconds=1)
+
+
+class ZoneTable:
+    """
+    UTC offsets of an IANA timezone as sorted transition tables, so converting
+    between unix and wall clock time is a bisect instead of a zoneinfo lookup.
+    """
+
+    def __init__(self, name: str, first_year: int, last_year: int) -> None:
+        self.zone = ZoneInfo(name)
+        self.start = calendar.timegm((first_year, 1, 1, 0, 0, 0))
+        self.end = calendar.timegm((last_year + 1, 1, 1, 0, 0, 0))
+        # offsets[i] is in effect from transitions[i - 1] up to transitions[i]
+        self.transitions: List[int] = []
+        self.offsets: List[int] = [self.offset(self.start)]
+        # wall clock times from which offsets[i + 1] applies: in a gap, wall
+        # times are shifted forward, ambiguous ones are the first occurrence
+        self.wall_transitions: List[int] = []
+
+        day = 24 * 60 * 60
+        t = self.start
+        while t < self.end:
+            if self.offset(t + day) != self.offsets[-1]:
+                lo, hi = t, t + day
+                while hi - lo > 1:
+                    mid = (lo + hi) // 2
+                    if self.offset(mid) == self.offsets[-1]:
+                        lo = mid
+                    else:
+                        hi = mid
+                before, after = self.offsets[-1], self.offset(hi)
+                self.transitions.append(hi)
+                self.offsets.append(after)
+                self.wall_transitions.append(hi + max(before, after))
+            t += day
+
+    def offset(self, ts: int) -> int:
+        d = datetime.fromtimestamp(ts, timezone.utc).astimezone(self.zone)
+        return int(d.utcoffset().total_seconds())  # type: ignore
+
+    def to_wall(self, ts: int) -> datetime:
+        """Naive wall clock time at the unix time `ts`."""
+        if not self.start <= ts < self.end:
+            return datetime.fromtimestamp(ts, self.zone).replace(tzinfo=None)
+        return datetime.utcfromtimestamp(
+            ts + self.offsets[bisect_right(self.transitions, ts)]
+        )
+
+    def to_unix(self, wall: datetime) -> int:
+        """Unix time of the naive wall clock time `wall`."""
+        w = (wall - EPOCH) // SECOND
+        if not self.start <= w < self.end:
+            return int(wall.replace(tzinfo=self.zone).timestamp())
+        return w - self.offsets[bisect_right(self.wall_transitions, w)]
+
+
+tables: Dict[str, ZoneTable] = {}
+tables_lock = Lock()
+
+
+def get(name: str) -> ZoneTable:
+    table = tables.get(name)
+    # rebuilt once the current year is no longer covered
+    if table is not None and clock.time() < table.end - 366 * 24 * 60 * 60:
+        return table
+    with tables_lock:
+        year = clock.utcnow().year
+        table = tables[name] = ZoneTable(name, year - YEARS_BEFORE, year + YEARS_AFTER)
+        return table
+
+
+def is_valid(name: str) -> bool:
+    try:
+        ZoneInfo(name)
+        return True
+    except (ZoneInfoNotFoundError, ValueError):
+        return False